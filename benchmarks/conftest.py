@@ -0,0 +1,111 @@
+import os
+import tempfile
+import tracemalloc
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from opsy.app import create_app
+from opsy.auth.utils import create_token
+from opsy.config import ConfigSchema
+from opsy.flask_extensions import db as opsy_db
+from benchmarks.data import inventory_size, seed_inventory, seed_admin_user
+
+# Defaults to a throwaway SQLite file, point this at a local Postgres to
+# benchmark against that instead.
+DATABASE_URI = os.environ.get(
+    'OPSY_BENCHMARK_DATABASE_URI',
+    f'sqlite:///{tempfile.gettempdir()}/opsy_benchmark.db')
+
+
+###############################################################################
+# Flask Fixtures
+###############################################################################
+
+
+@pytest.fixture(scope='session')
+def app():
+    config = ConfigSchema().load({
+        'app': {'database_uri': DATABASE_URI,
+                'secret_key': 'this is only a benchmark'},
+        'logging': {'log_level': 'WARNING'}})
+    benchmark_app = create_app(config)
+    benchmark_app.config['TESTING'] = True
+    return benchmark_app
+
+
+@pytest.fixture(scope='session')
+def inventory(app):
+    """Seeds the database once for the whole run."""
+    size = inventory_size()
+    with app.app_context():
+        opsy_db.drop_all()
+        opsy_db.create_all()
+        seed_inventory(**size)
+        admin_user = seed_admin_user()
+        token = create_token(admin_user).session_token
+        opsy_db.session.remove()
+    yield {'size': size, 'token': token}
+    with app.app_context():
+        opsy_db.drop_all()
+
+
+###############################################################################
+# Measurement Fixtures
+###############################################################################
+
+
+@pytest.fixture(scope='function')
+def measure(benchmark, client, inventory):
+    """
+    Benchmark one or more requests against the seeded inventory.
+
+    Each request is a tuple of (method, url, expected status, json body),
+    the last two being optional. They're sent in order every round, so a
+    create can be paired with the delete that undoes it. The url can also
+    be a callable for when it depends on the previous request.
+
+    Latency comes from pytest-benchmark. A separate untimed round records
+    the SQL statement count and peak Python memory in the benchmark's extra
+    info, so all three end up in the --benchmark-json output.
+    """
+
+    def measure_requests(*requests):
+        headers = [('X-AUTH-TOKEN', inventory['token'])]
+
+        def send_requests():
+            for method, url, *args in requests:
+                expected_status = args[0] if args else 200
+                body = args[1] if len(args) > 1 else None
+                if callable(url):
+                    url = url()
+                response = client.open(
+                    url, method=method, headers=headers, json=body,
+                    follow_redirects=True)
+                # Make sure streamed bodies are actually consumed.
+                response.get_data()
+                # Like a real request, don't carry the session over.
+                opsy_db.session.remove()
+                assert response.status_code == expected_status, \
+                    f'{method} {url} returned {response.status_code}'
+
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', record_statement)
+        tracemalloc.start()
+        try:
+            send_requests()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            event.remove(Engine, 'before_cursor_execute', record_statement)
+        benchmark.extra_info.update({
+            'database': opsy_db.engine.dialect.name,
+            'inventory_size': inventory['size'],
+            'sql_statements': len(statements),
+            'peak_memory_bytes': peak_memory})
+        benchmark(send_requests)
+
+    return measure_requests
@@ -0,0 +1,78 @@
+import os
+import uuid
+from opsy.auth.models import Role, User
+from opsy.flask_extensions import db
+from opsy.inventory.models import (
+    Zone, Group, GroupClosure, Host, HostGroupMapping)
+from opsy.utils import get_valid_permissions
+
+
+def inventory_size():
+    """The synthetic inventory size, overridable from the environment."""
+    return {
+        'zones': int(os.environ.get('OPSY_BENCHMARK_ZONES', 5)),
+        'hosts': int(os.environ.get('OPSY_BENCHMARK_HOSTS', 1000)),
+        'groups': int(os.environ.get('OPSY_BENCHMARK_GROUPS', 20)),
+        'mappings': int(os.environ.get('OPSY_BENCHMARK_MAPPINGS', 3)),
+        'vars_depth': int(os.environ.get('OPSY_BENCHMARK_VARS_DEPTH', 3)),
+    }
+
+
+def nested_vars(name, depth):
+    """Makes vars nested depth levels deep, with a list at every level."""
+    synthetic_vars = {f'{name}_value': name, 'shared': [name, 'common']}
+    if depth > 1:
+        synthetic_vars['nested'] = nested_vars(name, depth - 1)
+    return synthetic_vars
+
+
+def seed_inventory(zones=5, hosts=1000, groups=20, mappings=3, vars_depth=3):
+    """
+    Seed an inventory of zones x hosts x groups, skipping the ORM.
+
+    Every zone gets hosts hosts and groups groups, each parented to a global
+    group of the same name. Every host is mapped to mappings of its zone's
+    groups and every asset gets vars_depth levels of vars.
+    """
+    global_groups = [
+        {'id': str(uuid.uuid4()), 'name': f'group{x:03d}',
+         'vars': nested_vars(f'global{x}', vars_depth)}
+        for x in range(0, groups)]
+    db.session.bulk_insert_mappings(Group, global_groups)
+    for zone_index in range(0, zones):
+        zone = Zone.create(
+            name=f'zone{zone_index:03d}',
+            vars=nested_vars(f'zone{zone_index}', vars_depth))
+        zone_groups = [
+            {'id': str(uuid.uuid4()), 'name': x['name'], 'zone_id': zone.id,
+             'parent_id': x['id'],
+             'vars': nested_vars(f'{zone.name}{x["name"]}', vars_depth)}
+            for x in global_groups]
+        db.session.bulk_insert_mappings(Group, zone_groups)
+        zone_hosts = [
+            {'id': str(uuid.uuid4()), 'name': f'{zone.name}host{x:06d}',
+             'zone_id': zone.id,
+             'vars': nested_vars(f'{zone.name}host{x}', vars_depth)}
+            for x in range(0, hosts)]
+        db.session.bulk_insert_mappings(Host, zone_hosts)
+        db.session.bulk_insert_mappings(HostGroupMapping, [
+            {'host_id': host['id'],
+             'group_id': zone_groups[(index + x) % len(zone_groups)]['id'],
+             'priority': 100 + x}
+            for index, host in enumerate(zone_hosts)
+            for x in range(0, min(mappings, len(zone_groups)))])
+        db.session.commit()
+    # Bulk inserts skip the flush listener that maintains this.
+    GroupClosure.rebuild()
+    db.session.commit()
+
+
+def seed_admin_user():
+    """Creates an admin user with every permission and returns it."""
+    admin_user = User.create(
+        name='admin', full_name='Benchmark Admin', password='password123')
+    admin_role = Role.create(name='admins')
+    for permission in get_valid_permissions():
+        admin_role.add_permission(permission)
+    admin_role.add_user(admin_user)
+    return admin_user
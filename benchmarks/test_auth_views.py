@@ -0,0 +1,92 @@
+ROLE = 'admins'
+USER = 'admin'
+
+
+###############################################################################
+# Login Views
+###############################################################################
+
+
+def test_login_get(measure):
+    measure(('GET', '/api/v1/login/'))
+
+
+def test_login_post(measure):
+    measure(('POST', '/api/v1/login/', 200,
+             {'user_name': USER, 'password': 'password123'}))
+
+
+def test_login_patch(measure):
+    measure(('PATCH', '/api/v1/login/', 200,
+             {'email': 'admin@example.com'}))
+
+
+###############################################################################
+# User Views
+###############################################################################
+
+
+def test_users_list(measure):
+    measure(('GET', '/api/v1/users/'))
+
+
+def test_users_post_delete(measure):
+    measure(('POST', '/api/v1/users/', 201,
+             {'name': 'benchmark', 'password': 'benchmark'}),
+            ('DELETE', '/api/v1/users/benchmark', 204))
+
+
+def test_users_get(measure):
+    measure(('GET', f'/api/v1/users/{USER}'))
+
+
+def test_users_patch(measure):
+    measure(('PATCH', f'/api/v1/users/{USER}', 200,
+             {'full_name': 'Benchmark Admin'}))
+
+
+###############################################################################
+# Role Views
+###############################################################################
+
+
+def test_roles_list(measure):
+    measure(('GET', '/api/v1/roles/'))
+
+
+def test_roles_post_delete(measure):
+    measure(('POST', '/api/v1/roles/', 201, {'name': 'benchmark'}),
+            ('DELETE', '/api/v1/roles/benchmark', 204))
+
+
+def test_roles_get(measure):
+    measure(('GET', f'/api/v1/roles/{ROLE}'))
+
+
+def test_roles_patch(measure):
+    measure(('PATCH', f'/api/v1/roles/{ROLE}', 200,
+             {'description': 'benchmark'}))
+
+
+###############################################################################
+# Role Permission Views
+###############################################################################
+
+
+def test_role_permissions_list(measure):
+    measure(('GET', f'/api/v1/roles/{ROLE}/permissions/'))
+
+
+def test_role_permissions_post_delete(measure):
+    measure(('POST', f'/api/v1/roles/{ROLE}/permissions/', 201,
+             {'name': 'benchmark'}),
+            ('DELETE', f'/api/v1/roles/{ROLE}/permissions/benchmark', 204))
+
+
+def test_role_permissions_get(measure):
+    measure(('GET', f'/api/v1/roles/{ROLE}/permissions/list_zones'))
+
+
+def test_role_permissions_patch(measure):
+    measure(('PATCH', f'/api/v1/roles/{ROLE}/permissions/list_zones', 200,
+             {'name': 'list_zones'}))
@@ -0,0 +1,173 @@
+import pytest
+from opsy.inventory.models import Zone, Group, Host
+
+ZONE = 'zone000'
+HOST = 'zone000host000000'
+
+
+def zone_group_id(name='group000'):
+    zone = Zone.get_by_id_or_name(ZONE)
+    return Group.query.filter_by(name=name, zone_id=zone.id).first().id
+
+
+###############################################################################
+# Zone Views
+###############################################################################
+
+
+def test_zones_list(measure):
+    measure(('GET', '/api/v1/zones/'))
+
+
+def test_zones_post_delete(measure):
+    measure(('POST', '/api/v1/zones/', 201, {'name': 'benchmark'}),
+            ('DELETE', '/api/v1/zones/benchmark', 204))
+
+
+def test_zones_get(measure):
+    measure(('GET', f'/api/v1/zones/{ZONE}'))
+
+
+def test_zones_patch(measure):
+    measure(('PATCH', f'/api/v1/zones/{ZONE}', 200,
+             {'description': 'benchmark'}))
+
+
+###############################################################################
+# Host Views
+###############################################################################
+
+
+def test_hosts_list(measure):
+    measure(('GET', '/api/v1/hosts/'))
+
+
+def test_hosts_list_page(measure):
+    measure(('GET', '/api/v1/hosts/?limit=100'))
+
+
+def test_hosts_list_filtered(measure):
+    measure(('GET', f'/api/v1/hosts/?zone_name={ZONE}&group_name=group00*'))
+
+
+def test_hosts_list_vars(measure):
+    # Every host has a <host>_value var, so this picks out a single host.
+    measure(('GET', '/api/v1/hosts/?vars.zone000host0_value=zone000host0'))
+
+
+def test_hosts_list_stream(measure):
+    measure(('GET', '/api/v1/hosts/?stream=ndjson'))
+
+
+def test_hosts_post_delete(measure):
+    zone_id = Zone.get_by_id_or_name(ZONE).id
+    measure(('POST', '/api/v1/hosts/', 201,
+             {'name': 'benchmark', 'zone_id': zone_id}),
+            ('DELETE', '/api/v1/hosts/benchmark', 204))
+
+
+def test_hosts_get(measure):
+    measure(('GET', f'/api/v1/hosts/{HOST}'))
+
+
+def test_hosts_patch(measure):
+    measure(('PATCH', f'/api/v1/hosts/{HOST}', 200,
+             {'vars': {'benchmark': True}}))
+
+
+###############################################################################
+# Host Group Mapping Views
+###############################################################################
+
+
+def test_host_group_mappings_list(measure):
+    measure(('GET', f'/api/v1/hosts/{HOST}/group_mappings/'))
+
+
+def test_host_group_mappings_post_delete(measure, inventory):
+    # HOST is mapped to the first mappings groups of its zone, so the next
+    # one is free.
+    size = inventory['size']
+    if size['groups'] <= size['mappings']:
+        pytest.skip('HOST is already mapped to every group.')
+    group_id = zone_group_id(f'group{size["mappings"]:03d}')
+    measure(('POST', f'/api/v1/hosts/{HOST}/group_mappings/', 201,
+             {'group_id': group_id}),
+            ('DELETE', f'/api/v1/hosts/{HOST}/group_mappings/{group_id}',
+             204))
+
+
+def test_host_group_mappings_get(measure):
+    measure(('GET',
+             f'/api/v1/hosts/{HOST}/group_mappings/{zone_group_id()}'))
+
+
+def test_host_group_mappings_patch(measure):
+    measure(('PATCH',
+             f'/api/v1/hosts/{HOST}/group_mappings/{zone_group_id()}', 200,
+             {'priority': 100}))
+
+
+@pytest.fixture(params=[10, 100, 1000])
+def sized_group(request, app, inventory):
+    """A group with param of the zone's hosts, and a host that isn't in it."""
+    size = min(request.param, inventory['size']['hosts'] - 1)
+    with app.app_context():
+        zone = Zone.get_by_id_or_name(ZONE)
+        host_names = [x.name for x in Host.query.filter_by(
+            zone_id=zone.id).order_by(Host.name).limit(size + 1)]
+        group = Group.create(f'benchmark{size}', zone_id=zone.id)
+        group.bulk_add_hosts(host_names[:-1])
+        group_id = group.id
+    yield {'id': group_id, 'host': host_names[-1]}
+    with app.app_context():
+        Group.delete_by_id(group_id)
+
+
+def test_host_group_mappings_by_group_size(measure, sized_group):
+    """Membership changes should cost the same no matter the group size."""
+    url = (f'/api/v1/hosts/{sized_group["host"]}/group_mappings/'
+           f'{sized_group["id"]}')
+    measure(('POST', f'/api/v1/hosts/{sized_group["host"]}/group_mappings/',
+             201, {'group_id': sized_group['id']}),
+            ('GET', url),
+            ('PATCH', url, 200, {'priority': 100}),
+            ('DELETE', url, 204))
+
+
+###############################################################################
+# Group Views
+###############################################################################
+
+
+def test_groups_list(measure):
+    measure(('GET', '/api/v1/groups/'))
+
+
+def test_groups_post_delete(measure):
+
+    def group_url():
+        # Groups are only addressable by id, so look it up after the create.
+        group = Group.query.filter_by(name='benchmark', zone_id=None).first()
+        return f'/api/v1/groups/{group.id}'
+
+    measure(('POST', '/api/v1/groups/', 201, {'name': 'benchmark'}),
+            ('DELETE', group_url, 204))
+
+
+def test_groups_get(measure):
+    measure(('GET', f'/api/v1/groups/{zone_group_id()}'))
+
+
+def test_groups_patch(measure):
+    measure(('PATCH', f'/api/v1/groups/{zone_group_id()}', 200,
+             {'default_priority': 100}))
+
+
+###############################################################################
+# Inventory Export Views
+###############################################################################
+
+
+def test_ansible_inventory_get(measure):
+    measure(('GET', '/api/v1/inventory/ansible'))
@@ -0,0 +1,41 @@
+import os
+import random
+import pytest
+from opsy.monitoring.backends.sensu import SensuBackend
+
+EVENTS = int(os.environ.get('OPSY_BENCHMARK_EVENTS', 100000))
+
+
+@pytest.fixture(scope='module')
+def sensu_payload():
+    """A synthetic Sensu /events response, already parsed."""
+    return [[{
+        'id': str(index),
+        'client': {'name': f'host{index // 20}',
+                   'subscriptions': ['base', 'prometheus']},
+        'check': {'name': f'check{index % 20}',
+                  'status': random.choice([0, 1, 2, 3]),
+                  'command': 'check-thing.rb -w 80 -c 90',
+                  'output': 'Everything is probably fine.',
+                  'interval': 60},
+        'occurrences': random.randint(1, 100),
+        'silenced': index % 50 == 0,
+        'timestamp': 1570000000 + index,
+        'action': 'create'
+    } for index in range(EVENTS)]]
+
+
+###############################################################################
+# Sensu Decoding
+###############################################################################
+
+
+@pytest.mark.parametrize('validate_events', [False, True],
+                         ids=['fast', 'schema'])
+def test_sensu_decode(app, benchmark, sensu_payload, validate_events):
+    backend = SensuBackend(None, validate_events=validate_events)
+    benchmark.group = 'sensu_decode'
+    benchmark.extra_info['events'] = EVENTS
+    with app.app_context():
+        events = benchmark(backend.decode, sensu_payload)
+    assert len(events) == EVENTS - EVENTS // 50
@@ -0,0 +1,31 @@
+"""Add host vars index
+
+Revision ID: e6b1d8f3a29c
+Revises: a47c0e3b9d65
+Create Date: 2026-10-18 19:12:40.381577
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b1d8f3a29c'
+down_revision = 'a47c0e3b9d65'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite can only index json_extract of a given path, see
+    # "opsyctl db index-vars".
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE INDEX hosts_vars_gin_idx ON hosts '
+               'USING gin ((vars::jsonb) jsonb_path_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('hosts_vars_gin_idx', table_name='hosts')
@@ -1,10 +1,12 @@
 from flask import Flask
 from opsy.config import configure_app
 from opsy.flask_extensions import configure_extensions, finalize_extensions
+from opsy.instrumentation import record_sql_metrics
 from opsy.logging import (configure_logging, log_before_request,
                           log_after_request)
 from opsy.auth.views import create_auth_views
 from opsy.inventory.views import create_inventory_views
+from opsy.monitoring.views import create_monitoring_views
 
 
 def create_app(config):
@@ -12,6 +14,7 @@ def create_app(config):
     app = Flask('opsy')
     app.before_request(log_before_request)
     app.after_request(log_after_request)
+    app.after_request(record_sql_metrics)
     configure_app(app, config)
     configure_extensions(app)
     create_views(app)
@@ -22,3 +25,4 @@ def create_app(config):
 def create_views(app):
     create_auth_views(app)
     create_inventory_views(app)
+    create_monitoring_views(app)
@@ -1,6 +1,9 @@
 from flask_login import UserMixin
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
-from opsy.auth.utils import create_token
+from opsy.auth.utils import create_token, get_token_cache
 from opsy.flask_extensions import db
 from opsy.models import AwareDateTime, BaseModel, NamedModel, TimeStampMixin
 
@@ -21,7 +24,7 @@ class User(UserMixin, NamedModel, TimeStampMixin, db.Model):
     enabled = db.Column(db.Boolean, default=False)
     ldap_user = db.Column(db.Boolean, default=False)
     roles = db.relationship('Role', secondary='role_mappings',
-                            lazy='joined', backref='users')
+                            lazy='selectin', backref='users')
 
     __table_args__ = (
         db.UniqueConstraint('session_token', name='sess_uc'),
@@ -45,6 +48,45 @@ class User(UserMixin, NamedModel, TimeStampMixin, db.Model):
                 permissions.append(permission)
         return permissions
 
+    @property
+    def permission_names(self):
+        """The names of the user's permissions, resolved once per instance."""
+        if '_permission_names' not in self.__dict__:
+            self.__dict__['_permission_names'] = frozenset(
+                x.name for x in self.permissions)
+        return self.__dict__['_permission_names']
+
+    @permission_names.setter
+    def permission_names(self, permission_names):
+        self.__dict__['_permission_names'] = frozenset(permission_names)
+
+    def get_columns(self):
+        """The user's column values, for rebuilding it with from_columns."""
+        return {x.key: getattr(self, x.key)
+                for x in db.inspect(self.__class__).column_attrs}
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Rebuild a user from get_columns without a query.
+
+        The user is added to the session as though it had just been loaded.
+        If the session already has it that's returned instead, with anything
+        the session had expired filled in from the columns.
+        """
+        user = db.inspect(cls).class_manager.new_instance()
+        for key, value in columns.items():
+            setattr(user, key, value)
+        make_transient_to_detached(user)
+        existing = db.session.identity_map.get(  # pylint: disable=no-member
+            db.inspect(user).key)
+        if existing is None:
+            db.session.add(user)
+            return user
+        for key in db.inspect(existing).expired_attributes & set(columns):
+            set_committed_value(existing, key, columns[key])
+        return existing
+
     def get_id(self):
         create_token(self)
         return self.session_token
@@ -165,3 +207,39 @@ class Permission(BaseModel, TimeStampMixin, db.Model):
 
     def __repr__(self):
         return f'<{self.__class__.__name__} {self.name}>'
+
+
+###############################################################################
+# Token cache invalidation
+###############################################################################
+
+
+@db.event.listens_for(SignallingSession, 'after_flush')
+def invalidate_token_cache(session, flush_context):
+    """Drop cached tokens and permissions that this flush made stale."""
+    roles_changed = False
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, (Role, RoleMappings, Permission)):
+            roles_changed = True
+        elif isinstance(obj, User):
+            attrs = db.inspect(obj).attrs
+            if obj in session.deleted or attrs.roles.history.has_changes():
+                roles_changed = True
+            token_cache = get_token_cache()
+            # Cached tokens carry the user's columns, so any change to them
+            # (being disabled, a new token) drops the user's entries. The old
+            # token isn't in the history unless it was loaded, but a user
+            # only ever has the one token anyway.
+            columns_changed = any(
+                attrs[x.key].history.has_changes()
+                for x in db.inspect(obj).mapper.column_attrs)
+            if token_cache and (obj in session.deleted or columns_changed):
+                token_cache.invalidate_user(obj.id)
+    if not roles_changed:
+        return
+    token_cache = get_token_cache()
+    if token_cache:
+        token_cache.clear()
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, User):
+            obj.__dict__.pop('_permission_names', None)
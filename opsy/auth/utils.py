@@ -1,6 +1,8 @@
+import threading
+from collections import OrderedDict, namedtuple
 from datetime import datetime, timezone
 from time import time
-from flask import current_app, g
+from flask import current_app, g, has_app_context
 from flask.sessions import SecureCookieSessionInterface
 from flask_ldap3_login import AuthenticationResponseStatus
 from flask_login import login_user, logout_user
@@ -9,6 +11,71 @@ from itsdangerous import (TimedJSONWebSignatureSerializer
 from opsy.flask_extensions import ldap_manager
 
 
+TokenCacheEntry = namedtuple(
+    'TokenCacheEntry',
+    ['user_id', 'expires_at', 'permissions', 'columns', 'cached_at'])
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified session tokens.
+
+    This maps a token to the id of its user, when the token expires (as a
+    timestamp), the names of the user's permissions and the user's column
+    values, so a request with a token we've already verified needs neither a
+    query nor a signature check. Entries are dropped after ttl seconds so
+    changes made by other processes are picked up eventually.
+    """
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            now = time()
+            if entry.cached_at + self.ttl <= now or entry.expires_at <= now:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry
+
+    def set(self, token, user_id, expires_at, permissions, columns=None):
+        with self._lock:
+            self._entries[token] = TokenCacheEntry(
+                user_id, expires_at, frozenset(permissions), columns or {},
+                time())
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for token in [key for key, value in self._entries.items()
+                          if value.user_id == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def get_token_cache():
+    """Returns the app's token cache, or None if it's disabled."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('opsy_token_cache')
+
+
 class APISessionInterface(SecureCookieSessionInterface):
     """Prevent creating session from API requests."""
 
@@ -159,15 +226,34 @@ def verify_token(user):  # pylint: disable=R0911
     return user
 
 
-def load_user(session_token):
+def get_user_by_token(session_token):
+    """Look up and verify the user for a token, using the cache if we can."""
     from opsy.auth.models import User
-    user = User.get_by_token(session_token)
-    return verify_token(user)
+    token_cache = get_token_cache()
+    entry = token_cache.get(session_token) \
+        if (token_cache and session_token) else None
+    if entry:
+        # The flush hooks in opsy.auth.models drop the entries of replaced
+        # tokens and changed roles, so a hit doesn't need to go to the DB.
+        user = User.from_columns(entry.columns)
+        user.permission_names = entry.permissions
+        return user
+    user = verify_token(User.get_by_token(session_token))
+    if user and token_cache:
+        expires_at = user.session_token_expires_at.replace(
+            tzinfo=timezone.utc).timestamp()
+        token_cache.set(
+            session_token, user.id, expires_at, user.permission_names,
+            columns=user.get_columns())
+    return user
+
+
+def load_user(session_token):
+    return get_user_by_token(session_token)
 
 
 def load_user_from_request(request):
-    from opsy.auth.models import User
     session_token = request.headers.get('X-AUTH-TOKEN')
-    user = verify_token(User.get_by_token(session_token))
+    user = get_user_by_token(session_token)
     g.login_via_header = True
     return user
@@ -14,6 +14,10 @@ class ConfigAuthSchema(Schema):
     base_permissions = fields.List(fields.Str(), missing=[])
     logged_in_permissions = fields.List(fields.Str(), missing=[])
     session_token_ttl = fields.Integer(missing=86400)
+    token_cache_ttl = fields.Integer(
+        validate=validate.Range(min=0), missing=60)
+    token_cache_size = fields.Integer(
+        validate=validate.Range(min=1), missing=1024)
     ldap_enabled = fields.Boolean(missing=False)
     ldap_host = fields.Str(missing=None)
     ldap_port = fields.Integer(missing=389)
@@ -51,6 +55,9 @@ class ConfigLoggingSchema(Schema):
         validate=validate.OneOf(
             ['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG']),
         missing='INFO')
+    slow_query_threshold = fields.Float(
+        validate=validate.Range(min=0), missing=None)
+    server_timing_enabled = fields.Boolean(missing=False)
 
 
 class ConfigServerSchema(Schema):
@@ -73,6 +80,32 @@ class ConfigServerSchema(Schema):
                     'required when "ssl_enabled" is set to true.')
 
 
+class ConfigMonitoringSchema(Schema):
+    poller_enabled = fields.Boolean(missing=False)
+    poller_concurrency = fields.Integer(
+        validate=validate.Range(min=1), missing=10)
+    poller_jitter = fields.Float(
+        validate=validate.Range(min=0, max=1), missing=0.1)
+    poller_max_backoff = fields.Integer(
+        validate=validate.Range(min=0), missing=600)
+    poller_refresh_interval = fields.Integer(
+        validate=validate.Range(min=1), missing=30)
+    poller_pool_size = fields.Integer(
+        validate=validate.Range(min=0), missing=10)
+    poller_dns_cache_ttl = fields.Integer(
+        validate=validate.Range(min=0), missing=300)
+    upsert_chunk_size = fields.Integer(
+        validate=validate.Range(min=1), missing=500)
+    event_retention_days = fields.Integer(
+        validate=validate.Range(min=0), missing=7)
+    archive_retention_days = fields.Integer(
+        validate=validate.Range(min=0), missing=0)
+    prune_batch_size = fields.Integer(
+        validate=validate.Range(min=1), missing=1000)
+    prune_interval = fields.Integer(
+        validate=validate.Range(min=0), missing=3600)
+
+
 class ConfigSchema(Schema):
     app = fields.Nested(ConfigAppSchema(), required=True)
     auth = fields.Nested(
@@ -81,6 +114,8 @@ class ConfigSchema(Schema):
         ConfigLoggingSchema(), missing=ConfigLoggingSchema().load({}))
     server = fields.Nested(
         ConfigServerSchema(), missing=ConfigServerSchema().load({}))
+    monitoring = fields.Nested(
+        ConfigMonitoringSchema(), missing=ConfigMonitoringSchema().load({}))
 
 
 def load_config(config_file):
@@ -26,6 +26,7 @@ def configure_extensions(app):
     # Make SQLAlchemy aware of models
     from opsy.auth import models as am  # noqa: F401
     from opsy.inventory import models as im  # noqa: F401
+    from opsy.monitoring import models as mm  # noqa: F401
     from opsy import __version__ as opsy_version  # noqa: F401
     db.init_app(app)
     migrate.init_app(app, db=db)
@@ -51,7 +52,11 @@ def configure_extensions(app):
         'api_key', {'type': 'apiKey', 'in': 'header', 'name': 'X-AUTH-TOKEN'})
     apispec.init_app(app)
     from opsy.auth.utils import (load_user, load_user_from_request,
-                                 APISessionInterface)
+                                 APISessionInterface, TokenCache)
+    if app.config.opsy['auth']['token_cache_ttl']:
+        app.extensions['opsy_token_cache'] = TokenCache(
+            max_size=app.config.opsy['auth']['token_cache_size'],
+            ttl=app.config.opsy['auth']['token_cache_ttl'])
     login_manager.user_loader(load_user)
     login_manager.request_loader(load_user_from_request)
     app.session_interface = APISessionInterface()
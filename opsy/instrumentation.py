@@ -0,0 +1,68 @@
+import logging
+from time import perf_counter
+from flask import (current_app, g, has_app_context, has_request_context,
+                   request)
+from prometheus_client import Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SQL_STATEMENTS = Histogram(
+    'opsy_request_sql_statements',
+    'Number of SQL statements executed per request.',
+    ['endpoint'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000))
+SQL_TIME = Histogram(
+    'opsy_request_sql_seconds',
+    'Total time spent executing SQL statements per request.',
+    ['endpoint'])
+SQL_SLOWEST = Histogram(
+    'opsy_request_sql_slowest_statement_seconds',
+    'Time spent executing the slowest SQL statement of each request.',
+    ['endpoint'])
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('opsy_query_start_time', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    duration = perf_counter() - conn.info['opsy_query_start_time'].pop()
+    # Only Opsy's own apps are configured for this.
+    if not (has_app_context() and hasattr(current_app.config, 'opsy')):
+        return
+    g.sql_statements = g.get('sql_statements', 0) + 1
+    g.sql_time = g.get('sql_time', 0) + duration
+    g.sql_slowest = max(g.get('sql_slowest', 0), duration)
+    threshold = current_app.config.opsy['logging']['slow_query_threshold']
+    if threshold is not None and duration >= threshold:
+        endpoint = request.endpoint if has_request_context() else '-'
+        logging.getLogger('opsy').warning(
+            'Slow query (%.3fs) during %s: %s', duration, endpoint, statement)
+
+
+@event.listens_for(Engine, 'handle_error')
+def handle_error(exception_context):
+    # after_cursor_execute never fires for a failed statement.
+    start_times = exception_context.connection.info.get(
+        'opsy_query_start_time')
+    if start_times:
+        start_times.pop()
+
+
+def record_sql_metrics(response):
+    """Export the SQL stats of the request, and add Server-Timing."""
+    endpoint = request.endpoint or 'none'
+    statements = g.get('sql_statements', 0)
+    sql_time = g.get('sql_time', 0)
+    SQL_STATEMENTS.labels(endpoint).observe(statements)
+    SQL_TIME.labels(endpoint).observe(sql_time)
+    SQL_SLOWEST.labels(endpoint).observe(g.get('sql_slowest', 0))
+    if current_app.config.opsy['logging']['server_timing_enabled']:
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={sql_time * 1000:.2f};desc="{statements} statements"')
+    return response
@@ -1,9 +1,16 @@
-from sqlalchemy.exc import IntegrityError
+import copy
+import hashlib
+import uuid
+from flask import current_app
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.orm import validates
 from opsy.exceptions import DuplicateError
 from opsy.flask_extensions import db
-from opsy.models import BaseModel, NamedModel, OpsyQuery, TimeStampMixin
+from opsy.models import (
+    BaseModel, BulkResult, NamedModel, OpsyQuery, TimeStampMixin, chunks,
+    json_path_extract)
 from opsy.utils import merge_dict
 
 ###############################################################################
@@ -11,18 +18,29 @@ from opsy.utils import merge_dict
 ###############################################################################
 
 
+def merge_vars(*layers):
+    """Merge layers of vars, in order, into a new dict without aliasing."""
+    compiled_dict = {}
+    for layer in layers:
+        if layer:
+            merge_dict(compiled_dict, copy.deepcopy(layer), merge_lists=True)
+    return compiled_dict
+
+
 class Zone(NamedModel, TimeStampMixin, db.Model):
 
     __tablename__ = 'zones'
 
     vars = db.Column(MutableDict.as_mutable(db.JSON))
     description = db.Column(db.Text)
+    # A zone can hold a huge number of hosts and groups, so these are never
+    # loaded implicitly. The database takes care of cascading deletes.
     hosts = db.relationship('Host', cascade='all, delete-orphan',
-                            backref='zone', lazy='joined',
-                            query_class=OpsyQuery)
+                            backref='zone', lazy='raise',
+                            passive_deletes=True, query_class=OpsyQuery)
     groups = db.relationship('Group', cascade='all, delete-orphan',
-                             backref='zone', lazy='joined',
-                             query_class=OpsyQuery)
+                             backref='zone', lazy='raise',
+                             passive_deletes=True, query_class=OpsyQuery)
 
 
 class Host(NamedModel, TimeStampMixin, db.Model):
@@ -33,11 +51,31 @@ class Host(NamedModel, TimeStampMixin, db.Model):
         db.String(36), db.ForeignKey('zones.id', ondelete='CASCADE'),
         index=True, nullable=False)
     vars = db.Column(MutableDict.as_mutable(db.JSON))
-
+    # Materialized output of compile_vars, null when it needs recompiling.
+    # The version is bumped on every invalidation so a compile that raced
+    # with a change to the underlying vars never gets stored.
+    compiled_vars_cache = db.Column(db.JSON)
+    compiled_vars_version = db.Column(
+        db.BigInteger, default=0, server_default='0', nullable=False)
+
+    # Ties on priority are broken by mapping id, the same order the ansible
+    # export merges vars in.
     groups = db.relationship('Group',
-                             order_by='host_group_mappings.c.priority',
+                             order_by='[host_group_mappings.c.priority, '
+                                      'host_group_mappings.c.id]',
                              secondary='host_group_mappings',
-                             lazy='joined', backref='hosts')
+                             lazy='selectin', backref='hosts')
+
+    @classmethod
+    def _bulk_errors(cls, items, objs=None):
+        errors = super()._bulk_errors(items, objs)
+        zone_ids = get_existing_ids(
+            Zone, {x['zone_id'] for x in items if x.get('zone_id')})
+        for index, item in enumerate(items):
+            if item.get('zone_id') and item['zone_id'] not in zone_ids:
+                errors[index] = errors[index] or \
+                    f'No Zone found with id "{item["zone_id"]}".'
+        return errors
 
     def add_group(self, group, priority=None):
         return group.add_host(self, priority=priority)
@@ -53,20 +91,101 @@ class Host(NamedModel, TimeStampMixin, db.Model):
 
     @property
     def compiled_vars(self):
+        # Vars handed to us by precompile_vars are only good for one read so
+        # they can't go stale if the host changes afterwards.
+        precompiled = self.__dict__.pop('_precompiled_vars', None)
+        if precompiled is not None:
+            return precompiled
+        if self.compiled_vars_cache is not None:
+            return self.compiled_vars_cache
         return self.compile_vars()
 
+    def set_precompiled_vars(self, compiled_vars):
+        """Hand compiled_vars the vars to return on its next read."""
+        self.__dict__['_precompiled_vars'] = compiled_vars
+
+    @classmethod
+    def compile_vars_bulk(cls, hosts):
+        """
+        Compile the vars for a list of hosts, returned as a dict keyed on id.
+
+        Each group's vars are only compiled once, and the zone and group
+        layers are only merged once per distinct zone and group combination,
+        so only the host's own vars are merged per host.
+        """
+        group_vars = Group.compile_vars_bulk(
+            {x.id for host in hosts for x in host.groups})
+        base_vars = {}
+        compiled = {}
+        for host in hosts:
+            key = (host.zone_id, tuple(x.id for x in host.groups))
+            if key not in base_vars:
+                base_vars[key] = merge_vars(
+                    host.zone.vars, *[group_vars[x.id] for x in host.groups])
+            compiled[host.id] = merge_vars(base_vars[key], host.vars)
+        return compiled
+
+    @classmethod
+    def precompile_vars(cls, hosts):
+        """
+        Bulk compile vars so serializing these hosts doesn't have to.
+
+        Hosts with a materialized cache are skipped, and the vars compiled
+        for the rest are stored so the next read doesn't have to either.
+        """
+        stale_hosts = [x for x in hosts if x.compiled_vars_cache is None]
+        if not stale_hosts:
+            return hosts
+        compiled = cls.compile_vars_bulk(stale_hosts)
+        for host in stale_hosts:
+            host.set_precompiled_vars(compiled[host.id])
+        cls.store_compiled_vars(stale_hosts, compiled)
+        return hosts
+
+    @classmethod
+    def store_compiled_vars(cls, hosts, compiled):
+        """
+        Queue compiled vars for hosts to be materialized.
+
+        They're written by save_compiled_vars once the request is done with
+        its session, rather than on a second connection that could end up
+        waiting on the request's own locks.
+        """
+        pending = db.session().info.setdefault('compiled_vars', {})
+        for host in hosts:
+            pending[host.id] = (host.compiled_vars_version, compiled[host.id])
+
+    @classmethod
+    def save_compiled_vars(cls):
+        """
+        Write the queued compiled vars through the session and commit.
+
+        Storing is best effort, if it fails we'll simply compile again on the
+        next read. Nothing is stored if the session has other changes
+        pending, since those aren't ours to commit.
+        """
+        session = db.session()
+        pending = session.info.pop('compiled_vars', None)
+        if not pending or session.new or session.dirty or session.deleted:
+            return
+        table = cls.__table__
+        statement = table.update().where(db.and_(
+            table.c.id == db.bindparam('host_id'),
+            table.c.compiled_vars_version == db.bindparam('version'))).values(
+                compiled_vars_cache=db.bindparam('cache'),
+                updated_at=table.c.updated_at)
+        try:
+            session.execute(statement, [
+                {'host_id': host_id, 'version': version, 'cache': cache}
+                for host_id, (version, cache) in pending.items()])
+            session.commit()
+        except SQLAlchemyError as error:
+            session.rollback()
+            current_app.logger.warning(
+                f'Unable to store compiled vars: {error}')
+
     def compile_vars(self):
-        compiled_dict = {}
-        if self.zone.vars:
-            merge_dict(compiled_dict, self.zone.vars, merge_lists=True)
-        for group in self.groups:
-            if group.compiled_vars:
-                merge_dict(
-                    compiled_dict, group.compile_vars(include_zone=False),
-                    merge_lists=True)
-        if self.vars:
-            merge_dict(compiled_dict, self.vars, merge_lists=True)
-        return compiled_dict
+        return self.compile_vars_bulk([self])[self.id]
 
     def __repr__(self):
         return f'<{self.__class__.__name__} {self.zone.name}/{self.name}>'
@@ -112,17 +231,76 @@ class Group(BaseModel, TimeStampMixin, db.Model):
                 f'{cls.__name__} already exists with name "{name}" in '
                 'requested zone.')
 
+    @classmethod
+    def _bulk_errors(cls, items, objs=None):
+        objs = objs or {}
+        errors = super()._bulk_errors(items, objs)
+        # Updates only have the columns that are changing, so fall back to
+        # the current values for the rest.
+        keys = []
+        for item in items:
+            obj = objs.get(item.get('id'))
+            keys.append(tuple(
+                item[x] if x in item else getattr(obj, x, None)
+                for x in ('name', 'zone_id')))
+        taken = {}
+        for chunk in chunks({x[0] for x in keys if x[0]}):
+            taken.update(
+                ((x.name, x.zone_id), x.id) for x in db.session.query(
+                    cls.id, cls.name, cls.zone_id).filter(
+                        cls.name.in_(chunk)))
+        zone_ids = get_existing_ids(
+            Zone, {x['zone_id'] for x in items if x.get('zone_id')})
+        parent_zone_ids = {}
+        for chunk in chunks(
+                {x['parent_id'] for x in items if x.get('parent_id')}):
+            parent_zone_ids.update(db.session.query(
+                cls.id, cls.zone_id).filter(cls.id.in_(chunk)))
+        seen = set()
+        for index, (item, key) in enumerate(zip(items, keys)):
+            obj_id = getattr(objs.get(item.get('id')), 'id', None)
+            parent_id = item.get('parent_id')
+            error = None
+            if item.get('zone_id') and item['zone_id'] not in zone_ids:
+                error = f'No Zone found with id "{item["zone_id"]}".'
+            elif parent_id and parent_id not in parent_zone_ids:
+                error = f'No Group found with id "{parent_id}".'
+            elif parent_id and parent_zone_ids[parent_id] not in (
+                    None, key[1]):
+                error = ('Parent Group must either be in the same Zone as '
+                         'child Group or not in a Zone.')
+            elif ('name' in item or 'zone_id' in item) and (
+                    key in seen or taken.get(key, obj_id) != obj_id):
+                error = (f'{cls.__name__} already exists with name '
+                         f'"{key[0]}" in requested zone.')
+            if 'name' in item or 'zone_id' in item:
+                seen.add(key)
+            errors[index] = errors[index] or error
+        return errors
+
     @validates('parent_id')
     def validate_parent_id(self, key, parent_id):
+        if parent_id is None:
+            return parent_id
         parent = Group.query.filter_by(id=parent_id).first()
-        if not (parent.zone == self.zone or parent.zone is None):
+        if parent is None:
+            raise ValueError(f'No Group found with id "{parent_id}".')
+        # Compared by id, since the zone relationship isn't loaded for new
+        # groups or kept in step with zone_id until a flush.
+        if parent.zone_id not in (None, self.zone_id):
             raise ValueError('Parent Group must either be in the same '
                              'Zone as child Group or not in a Zone.')
+        if self.id and GroupClosure.query.filter_by(
+                ancestor_id=self.id, descendant_id=parent_id).count():
+            raise ValueError('Parent Group cannot be the Group itself or '
+                             'one of its descendants.')
         return parent_id
 
     @validates('zone_id')
     def validate_zone_id(self, key, zone_id):
-        if self.hosts:
+        # New groups can't have hosts yet, and don't have an id to check.
+        if self.id and db.session.query(HostGroupMapping.query.filter_by(
+                group_id=self.id).exists()).scalar():
             raise ValueError('Cannot change the zone of a group with hosts.')
         return zone_id
 
@@ -131,56 +309,296 @@ class Group(BaseModel, TimeStampMixin, db.Model):
         return self.compile_vars()
 
     def compile_vars(self, include_zone=True):
-        compiled_dict = {}
-        if self.zone and include_zone and self.zone.vars:
-            merge_dict(compiled_dict, self.zone.vars, merge_lists=True)
-        if self.parent and self.parent.vars:
-            merge_dict(compiled_dict, self.parent.vars, merge_lists=True)
-        if self.vars:
-            merge_dict(compiled_dict, self.vars, merge_lists=True)
-        return compiled_dict
+        zone_vars = self.zone.vars if self.zone and include_zone else None
+        return merge_vars(zone_vars, *self.get_ancestor_vars())
+
+    def get_ancestor_vars(self):
+        """The vars of every ancestor and then the group's own, in order."""
+        if self.id is None:
+            # Not flushed yet, so it's not in the closure table either.
+            parent_vars = self.parent.get_ancestor_vars() if self.parent \
+                else []
+            return parent_vars + [self.vars]
+        return [x.vars for x in db.session.query(Group.vars).join(
+            GroupClosure, GroupClosure.ancestor_id == Group.id).filter(
+                GroupClosure.descendant_id == self.id).order_by(
+                    GroupClosure.depth.desc())]
+
+    @classmethod
+    def compile_vars_bulk(cls, group_ids):
+        """
+        Compile the vars of many groups without their zone's vars.
+
+        This takes a query per few hundred groups. Returned as a dict keyed
+        on id.
+        """
+        layers = {}
+        for chunk in chunks(set(group_ids)):
+            for group_id, group_vars in db.session.query(
+                    GroupClosure.descendant_id, Group.vars).join(
+                        Group, Group.id == GroupClosure.ancestor_id).filter(
+                            GroupClosure.descendant_id.in_(chunk)).order_by(
+                                GroupClosure.descendant_id,
+                                GroupClosure.depth.desc()):
+                layers.setdefault(group_id, []).append(group_vars)
+        return {x: merge_vars(*layers.get(x, [])) for x in group_ids}
+
+    def has_host(self, host):
+        """Whether the host is in the group, without loading its hosts."""
+        return db.session.query(HostGroupMapping.query.filter_by(
+            host_id=host.id, group_id=self.id).exists()).scalar()
+
+    def get_host_mapping(self, host):
+        """Returns the host's mapping to the group, or raises ValueError."""
+        mapping = HostGroupMapping.query.filter_by(
+            host_id=host.id, group_id=self.id).first()
+        if mapping is None:
+            raise ValueError(
+                f'Host "{host.id}" not in group "{self.id}".')
+        return mapping
 
     def add_host(self, host, priority=None):
-        if host in self.hosts:
+        if self.has_host(host):
             raise DuplicateError(
-                'Host "{host.id}" already added to group "{self.id}".')
-        if host.zone != self.zone:
+                f'Host "{host.id}" already added to group "{self.id}".')
+        if host.zone_id != self.zone_id:
             raise ValueError(
                 f'Host "{host.id}" not in same zone as group '
                 f'"{self.id}".')
         if not priority:
             priority = self.default_priority
-        return HostGroupMapping.create(
-            host_id=host.id, group_id=self.id, priority=priority)
+        try:
+            return HostGroupMapping.create(
+                host_id=host.id, group_id=self.id, priority=priority)
+        except IntegrityError:
+            db.session.rollback()
+            raise DuplicateError(
+                f'Host "{host.id}" already added to group "{self.id}".')
+
+    def bulk_add_hosts(self, host_ids, priority=None):
+        """
+        Add many hosts, by id or name, to the group in a single statement.
+
+        Instead of loading the group's hosts, the hosts' zones and their
+        existing memberships are checked with one query each. Returns a
+        BulkResult for each host, in order.
+        """
+        host_ids = list(host_ids)
+        hosts = self._get_hosts_for_bulk(host_ids)
+        members = self._get_members_for_bulk(
+            {x.id for x in hosts.values()})
+        if not priority:
+            priority = self.default_priority
+        results = []
+        rows = []
+        for host_id in host_ids:
+            host = hosts.get(host_id)
+            if host is None:
+                results.append(BulkResult(
+                    host_id, 'not_found',
+                    f'No Host found with name or id "{host_id}".'))
+            elif host.zone_id != self.zone_id:
+                results.append(BulkResult(
+                    host.id, 'invalid',
+                    f'Host "{host.id}" not in same zone as group '
+                    f'"{self.id}".'))
+            elif host.id in members:
+                results.append(BulkResult(
+                    host.id, 'invalid',
+                    f'Host "{host.id}" already added to group '
+                    f'"{self.id}".'))
+            else:
+                members.add(host.id)
+                row = {'id': str(uuid.uuid4()), 'host_id': host.id,
+                       'group_id': self.id, 'priority': priority}
+                rows.append(row)
+                results.append(BulkResult(row['id'], 'created', None))
+        if rows:
+            try:
+                db.session.execute(HostGroupMapping.__table__.insert(), rows)
+                invalidate_hosts(
+                    db.session, host_ids={x['host_id'] for x in rows})
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                raise DuplicateError(
+                    f'A host in this batch was added to group "{self.id}" '
+                    'by someone else in the meantime.')
+        return results
+
+    def bulk_remove_hosts(self, host_ids):
+        """
+        Remove many hosts from the group in a single statement.
+
+        Hosts can be given by id or name. Returns a BulkResult for each host,
+        in order.
+        """
+        host_ids = list(host_ids)
+        hosts = self._get_hosts_for_bulk(host_ids)
+        members = self._get_members_for_bulk(
+            {x.id for x in hosts.values()})
+        results = []
+        removed = set()
+        for host_id in host_ids:
+            host = hosts.get(host_id)
+            if host is None:
+                results.append(BulkResult(
+                    host_id, 'not_found',
+                    f'No Host found with name or id "{host_id}".'))
+            elif host.id not in members:
+                results.append(BulkResult(
+                    host.id, 'invalid',
+                    f'Host "{host.id}" not in group "{self.id}".'))
+            else:
+                members.discard(host.id)
+                removed.add(host.id)
+                results.append(BulkResult(host.id, 'deleted', None))
+        if removed:
+            mappings = HostGroupMapping.__table__
+            # Invalidate first, the mappings are how the hosts are found.
+            invalidate_hosts(db.session, host_ids=removed)
+            for chunk in chunks(removed):
+                db.session.execute(mappings.delete().where(db.and_(
+                    mappings.c.group_id == self.id,
+                    mappings.c.host_id.in_(chunk))))
+            db.session.commit()
+        return results
+
+    @staticmethod
+    def _get_hosts_for_bulk(host_ids):
+        """Look up the id and zone of hosts, keyed by both id and name."""
+        hosts = {}
+        for chunk in chunks(set(host_ids)):
+            for host in db.session.query(
+                    Host.id, Host.name, Host.zone_id).filter(db.or_(
+                        Host.id.in_(chunk), Host.name.in_(chunk))):
+                hosts[host.id] = hosts[host.name] = host
+        return hosts
+
+    def _get_members_for_bulk(self, host_ids):
+        """Returns which of the given hosts are already in the group."""
+        members = set()
+        for chunk in chunks(host_ids):
+            members.update(x.host_id for x in db.session.query(
+                HostGroupMapping.host_id).filter(
+                    HostGroupMapping.group_id == self.id,
+                    HostGroupMapping.host_id.in_(chunk)))
+        return members
 
     def remove_host(self, host):
-        if host not in self.hosts:
-            raise ValueError(
-                'Host "{host.id}" not in group "{self.id}".')
-        HostGroupMapping.query.filter_by(
-            host_id=host.id, group_id=self.id).first().delete()
+        self.get_host_mapping(host).delete()
 
     def get_host_priority(self, host):
-        if host not in self.hosts:
-            raise ValueError(
-                'Host "{host.id}" not in group "{self.id}".')
-        mapping = HostGroupMapping.query.filter_by(
-            host_id=host.id, group_id=self.id).first()
-        return mapping.priority
+        return self.get_host_mapping(host).priority
 
     def change_host_priority(self, host, priority):
-        if host not in self.hosts:
-            raise ValueError(
-                'Host "{host.id}" not in group "{self.id}".')
-        mapping = HostGroupMapping.query.filter_by(
-            host_id=host.id, group_id=self.id).first()
-        mapping.update(priority=priority)
+        self.get_host_mapping(host).update(priority=priority)
 
     def __repr__(self):
         zone_name = self.zone.name if self.zone else "None"
         return f'<{self.__class__.__name__} {zone_name}/{self.name}>'
 
 
+class GroupClosure(db.Model):
+    """
+    Every ancestor of every group, with the group itself at depth 0.
+
+    Rows are added and moved by a flush listener as groups are created and
+    reparented, and the database deletes them along with their groups. This
+    answers what's above or below a group in one indexed query, however
+    deep the tree goes.
+    """
+
+    __tablename__ = 'group_closure'
+
+    ancestor_id = db.Column(
+        db.String(36), db.ForeignKey('groups.id', ondelete='CASCADE'),
+        primary_key=True)
+    descendant_id = db.Column(
+        db.String(36), db.ForeignKey('groups.id', ondelete='CASCADE'),
+        primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('group_closure_descendant_id_depth_idx',
+                 descendant_id, depth),
+    )
+
+    @classmethod
+    def get_descendant_ids(cls, group_id):
+        """Select the ids of a group and every group under it."""
+        return db.select([cls.descendant_id]).where(
+            cls.ancestor_id == group_id)
+
+    @classmethod
+    def get_descendant_host_ids(cls, group_id):
+        """Select the ids of the hosts in a group or any group under it."""
+        return db.select([HostGroupMapping.host_id]).where(
+            HostGroupMapping.group_id.in_(cls.get_descendant_ids(group_id)))
+
+    @classmethod
+    def insert_groups(cls, session, groups):
+        """
+        Add the rows for new groups, given as (id, parent_id) pairs.
+
+        Groups under other new groups are added a level at a time, each level
+        being a single executemany of INSERT ... SELECT from the parents'
+        rows.
+        """
+        table = cls.__table__
+        pending = dict(groups)
+        if not pending:
+            return
+        session.execute(table.insert(), [
+            {'ancestor_id': x, 'descendant_id': x, 'depth': 0}
+            for x in pending])
+        statement = table.insert().from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            db.select([table.c.ancestor_id,
+                       db.bindparam('group_id', type_=db.String),
+                       table.c.depth + 1]).where(
+                           table.c.descendant_id == db.bindparam('parent_id')))
+        while pending:
+            ready = {x: y for x, y in pending.items() if y not in pending}
+            if not ready:
+                raise ValueError('Groups cannot be their own ancestors.')
+            rows = [{'group_id': x, 'parent_id': y}
+                    for x, y in ready.items() if y]
+            if rows:
+                session.execute(statement, rows)
+            for group_id in ready:
+                del pending[group_id]
+
+    @classmethod
+    def move_group(cls, session, group_id, parent_id):
+        """Move the rows of a group, and everything under it, to a parent."""
+        table = cls.__table__
+        subtree = table.alias()
+        subtree_ids = db.select([subtree.c.descendant_id]).where(
+            subtree.c.ancestor_id == group_id)
+        # Cut the subtree off from everything that used to be above it.
+        session.execute(table.delete().where(db.and_(
+            table.c.descendant_id.in_(subtree_ids),
+            ~table.c.ancestor_id.in_(subtree_ids))))
+        if not parent_id:
+            return
+        above = table.alias()
+        below = table.alias()
+        session.execute(table.insert().from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            db.select([above.c.ancestor_id, below.c.descendant_id,
+                       above.c.depth + below.c.depth + 1]).where(db.and_(
+                           above.c.descendant_id == parent_id,
+                           below.c.ancestor_id == group_id))))
+
+    @classmethod
+    def rebuild(cls):
+        """Rebuild the whole table from the groups' parent ids."""
+        db.session.execute(cls.__table__.delete())
+        cls.insert_groups(
+            db.session, db.session.query(Group.id, Group.parent_id).all())
+
+
 class HostGroupMapping(BaseModel, TimeStampMixin, db.Model):
 
     __tablename__ = 'host_group_mappings'
@@ -196,12 +614,20 @@ class HostGroupMapping(BaseModel, TimeStampMixin, db.Model):
     host = db.relationship(
         'Host',
         backref=db.backref('group_mappings', cascade='all, delete-orphan',
-                           order_by='HostGroupMapping.priority'))
+                           order_by='[HostGroupMapping.priority, '
+                                    'HostGroupMapping.id]'))
     group = db.relationship(
         'Group',
         backref=db.backref('host_mappings', cascade='all, delete-orphan',
                            order_by='HostGroupMapping.priority'))
 
+    __table_args__ = (
+        # A host can only be in a group once, and this is what every
+        # membership check goes through.
+        db.Index('host_group_mappings_host_id_group_id_key',
+                 host_id, group_id, unique=True),
+    )
+
     __mapper_args__ = {
         'confirm_deleted_rows': False
     }
@@ -232,3 +658,149 @@ class HostGroupMapping(BaseModel, TimeStampMixin, db.Model):
                 f'"{host_id_or_name}" and group name or id of '
                 f'"{group_id_or_name}".')
         return obj
+
+
+###############################################################################
+# Bulk helpers
+###############################################################################
+
+
+def get_existing_ids(model, ids):
+    """Returns which of the given ids exist for a model."""
+    existing_ids = set()
+    for chunk in chunks(ids):
+        existing_ids.update(x.id for x in db.session.query(model.id).filter(
+            model.id.in_(chunk)))
+    return existing_ids
+
+
+###############################################################################
+# Vars indexes
+###############################################################################
+
+# One GIN index covers every path into the host vars on Postgres, which is
+# what the containment filters on vars.<path> in filter_in use.
+db.event.listen(Host.__table__, 'after_create', db.DDL(
+    'CREATE INDEX hosts_vars_gin_idx ON hosts '
+    'USING gin ((vars::jsonb) jsonb_path_ops)').execute_if(
+        dialect='postgresql'))
+
+
+def create_vars_path_index(path):
+    """
+    Index a path into the host vars, like role or consul.node, on SQLite.
+
+    SQLite can only index json_extract of a given path, so hot paths get
+    an index each. Returns False if the path was already indexed.
+    """
+    keys = path.split('.')
+    # Paths like a.b and a-b read the same once they're made safe for an
+    # index name, so the name also gets a hash of the path itself.
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]
+    name = f'hosts_vars_{"_".join(keys)}_{digest}_idx'.replace('-', '_')
+    if db.session.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' "
+            "AND name = :name", {'name': name}).first():
+        return False
+    db.Index(name, json_path_extract(Host.__table__.c.vars, keys)).create(
+        db.session.get_bind())  # pylint: disable=no-member
+    return True
+
+
+###############################################################################
+# Compiled vars invalidation
+###############################################################################
+
+
+def _has_changes(obj, *keys):
+    attrs = db.inspect(obj).attrs
+    return any(attrs[key].history.has_changes() for key in keys)
+
+
+@db.event.listens_for(SignallingSession, 'before_flush')
+def invalidate_compiled_vars(session, flush_context, instances):
+    """
+    Invalidate the materialized vars of every host a flush could affect.
+
+    That's hosts whose own vars or zone changed, hosts in zones whose vars
+    changed, hosts mapped to (or mapped to a descendant of) a group whose
+    vars or parent changed, and hosts whose group mappings were added,
+    removed or reprioritized.
+    """
+    host_ids = set()
+    zone_ids = set()
+    group_ids = set()
+    for obj in session.dirty:
+        if isinstance(obj, Host) and _has_changes(obj, 'vars', 'zone_id'):
+            host_ids.add(obj.id)
+        elif isinstance(obj, Zone) and _has_changes(obj, 'vars'):
+            zone_ids.add(obj.id)
+        elif isinstance(obj, Group) and _has_changes(obj, 'vars', 'parent_id'):
+            group_ids.add(obj.id)
+        elif isinstance(obj, HostGroupMapping) and _has_changes(
+                obj, 'priority', 'host_id', 'group_id'):
+            history = db.inspect(obj).attrs.host_id.history
+            host_ids.update(history.deleted)
+            host_ids.add(obj.host_id)
+    for obj in session.deleted:
+        if isinstance(obj, Group):
+            group_ids.add(obj.id)
+        elif isinstance(obj, HostGroupMapping):
+            host_ids.add(obj.host_id)
+    for obj in session.new:
+        if isinstance(obj, HostGroupMapping):
+            host_ids.add(obj.host_id)
+    invalidate_hosts(session, host_ids, zone_ids, group_ids)
+
+
+def invalidate_hosts(session, host_ids=(), zone_ids=(), group_ids=()):
+    """
+    Invalidate the materialized vars of the hosts affected by a change.
+
+    That's the given hosts, the hosts in the given zones and the hosts mapped
+    to the given groups or their descendants. The flush listener takes care
+    of this for changes made through the ORM, anything changing vars or
+    mappings with bulk statements has to call it.
+    """
+    host_ids = set(host_ids)
+    host_ids.discard(None)
+    if not (host_ids or zone_ids or group_ids):
+        return
+    hosts = Host.__table__
+    closure = GroupClosure.__table__
+    mappings = HostGroupMapping.__table__
+    conditions = []
+    if host_ids:
+        conditions.append(hosts.c.id.in_(host_ids))
+    if zone_ids:
+        conditions.append(hosts.c.zone_id.in_(zone_ids))
+    if group_ids:
+        affected_groups = db.select([closure.c.descendant_id]).where(
+            closure.c.ancestor_id.in_(group_ids))
+        conditions.append(hosts.c.id.in_(
+            db.select([mappings.c.host_id]).where(
+                mappings.c.group_id.in_(affected_groups))))
+    session.execute(hosts.update().where(db.or_(*conditions)).values(
+        compiled_vars_cache=None,
+        compiled_vars_version=hosts.c.compiled_vars_version + 1,
+        updated_at=hosts.c.updated_at))
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Host):
+            session.expire(obj, ['compiled_vars_cache',
+                                 'compiled_vars_version'])
+
+
+###############################################################################
+# Group closure maintenance
+###############################################################################
+
+
+@db.event.listens_for(SignallingSession, 'after_flush')
+def update_group_closure(session, flush_context):
+    """Add closure rows for new groups and move them for reparented ones."""
+    GroupClosure.insert_groups(session, [
+        (x.id, x.parent_id) for x in session.new if isinstance(x, Group)])
+    for obj in session.dirty:
+        if isinstance(obj, Group) and obj not in session.deleted and \
+                _has_changes(obj, 'parent_id'):
+            GroupClosure.move_group(session, obj.id, obj.parent_id)
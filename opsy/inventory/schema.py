@@ -1,9 +1,10 @@
-from marshmallow import RAISE
+from marshmallow import RAISE, validate
 from marshmallow import fields as ma_fields
 from marshmallow_sqlalchemy import field_for
 from opsy.inventory.models import Zone, Host, Group, HostGroupMapping
 from opsy.flask_extensions import ma
-from opsy.schema import BaseSchema, Hyperlinks
+from opsy.schema import (BaseSchema, Hyperlinks, PaginationMixin,
+                         StreamingMixin)
 
 ###############################################################################
 # Sqlalchemy schemas
@@ -45,11 +46,12 @@ class ZoneUpdateSchema(ZoneSchema):
                      description='The name of the zone.')
 
 
-class ZoneQuerySchema(ZoneSchema):
+class ZoneQuerySchema(PaginationMixin, ZoneSchema):
 
     class Meta:
         model = Zone
-        fields = ('id', 'name', 'description')
+        fields = ('id', 'name', 'description', 'limit', 'after',
+                  'include_total')
         ordered = True
         unknown = RAISE
 
@@ -115,12 +117,13 @@ class HostUpdateSchema(HostSchema):
     name = field_for(Host, 'name', required=False)
 
 
-class HostQuerySchema(HostSchema):
+class HostQuerySchema(PaginationMixin, StreamingMixin, HostSchema):
 
     class Meta:
         model = Host
         fields = ('id', 'zone_id', 'zone_name', 'group_id', 'group_name',
-                  'name')
+                  'descendant_of', 'name', 'limit', 'after', 'include_total',
+                  'stream')
         ordered = True
         unknown = RAISE
 
@@ -130,6 +133,9 @@ class HostQuerySchema(HostSchema):
     zone_name = ma_fields.String(attribute='zone___name')
     group_id = ma_fields.String(attribute='groups___id')
     group_name = ma_fields.String(attribute='groups___name')
+    descendant_of = ma_fields.String(
+        description='Only hosts in the group with this ID or any group '
+                    'under it.')
 
 
 class HostRefSchema(HostSchema):
@@ -182,12 +188,14 @@ class GroupUpdateSchema(GroupSchema):
     name = field_for(Group, 'name', required=False)
 
 
-class GroupQuerySchema(GroupSchema):
+class GroupQuerySchema(PaginationMixin, StreamingMixin, GroupSchema):
 
     class Meta:
         model = Group
         fields = ('id', 'name', 'zone_id', 'zone_name', 'parent_id',
-                  'parent_name', 'host_id', 'host_name', 'default_priority')
+                  'parent_name', 'host_id', 'host_name', 'default_priority',
+                  'descendant_of', 'limit', 'after', 'include_total',
+                  'stream')
         ordered = True
         unknown = RAISE
 
@@ -198,6 +206,21 @@ class GroupQuerySchema(GroupSchema):
     parent_name = ma_fields.String(attribute='parent___name')
     host_id = ma_fields.String(attribute='hosts___id')
     host_name = ma_fields.String(attribute='hosts___name')
+    descendant_of = ma_fields.String(
+        description='Only the group with this ID and the groups under it.')
+
+
+class GroupHostsBulkSchema(ma.Schema):
+
+    class Meta:
+        ordered = True
+
+    items = ma_fields.List(
+        ma_fields.String(), required=True, validate=validate.Length(min=1),
+        description='The IDs or names of the hosts.')
+    priority = ma_fields.Integer(
+        description="The priority of the group for the added hosts. "
+                    "Defaults to the group's default priority.")
 
 
 class GroupRefSchema(GroupSchema):
@@ -244,11 +267,12 @@ class HostGroupMappingUpdateSchema(HostGroupMappingSchema):
         unknown = RAISE
 
 
-class HostGroupMappingQuerySchema(HostGroupMappingSchema):
+class HostGroupMappingQuerySchema(PaginationMixin, HostGroupMappingSchema):
 
     class Meta:
         model = HostGroupMapping
-        fields = ('id', 'group_id', 'group_name', 'priority')
+        fields = ('id', 'group_id', 'group_name', 'priority', 'limit',
+                  'after', 'include_total')
         ordered = True
         unknown = RAISE
 
@@ -0,0 +1,105 @@
+import hashlib
+from opsy.flask_extensions import db
+from opsy.inventory.models import (
+    Zone, Host, Group, HostGroupMapping, merge_vars)
+
+
+def get_ansible_inventory():
+    """
+    Build an Ansible dynamic inventory of everything in Opsy.
+
+    This is done with four queries no matter how big the inventory is. Every
+    zone and group becomes an Ansible group of the same name, and groups with
+    the same name in different zones are merged. Vars are fully compiled
+    into the hostvars so Ansible's own group precedence can never override
+    Opsy's priorities, which leaves the group vars empty.
+
+    Returns a tuple of the inventory and an ETag for it. The ETag is derived
+    from the rows themselves, and since any change to vars bumps the
+    compiled vars version of the affected hosts, it changes whenever the
+    inventory does. Since the ETag can only be known once the inventory is
+    built, conditional requests save bandwidth but not database work.
+    """
+    etag = hashlib.sha1()
+    zones = db.session.query(Zone.id, Zone.name, Zone.vars).order_by(
+        Zone.id).all()
+    groups = db.session.query(
+        Group.id, Group.name, Group.parent_id, Group.vars).order_by(
+            Group.id).all()
+    hosts = db.session.query(
+        Host.id, Host.name, Host.zone_id, Host.vars, Host.compiled_vars_cache,
+        Host.compiled_vars_version).order_by(Host.id).all()
+    mappings = db.session.query(
+        HostGroupMapping.host_id, HostGroupMapping.group_id,
+        HostGroupMapping.priority).order_by(
+            HostGroupMapping.priority, HostGroupMapping.id).all()
+    inventory = {'_meta': {'hostvars': {}}}
+
+    def ansible_group(name):
+        return inventory.setdefault(
+            name, {'hosts': [], 'vars': {}, 'children': []})
+
+    zones_by_id = {}
+    for zone in zones:
+        etag.update(repr((zone.id, zone.name)).encode('utf-8'))
+        zones_by_id[zone.id] = zone
+        ansible_group(zone.name)
+    groups_by_id = {}
+    for group in groups:
+        etag.update(repr((group.id, group.name, group.parent_id)).encode(
+            'utf-8'))
+        groups_by_id[group.id] = group
+        ansible_group(group.name)
+    for group in groups:
+        if group.parent_id in groups_by_id:
+            parent_name = groups_by_id[group.parent_id].name
+            children = ansible_group(parent_name)['children']
+            if group.name != parent_name and group.name not in children:
+                children.append(group.name)
+    host_groups = {}
+    for mapping in mappings:
+        etag.update(repr(tuple(mapping)).encode('utf-8'))
+        host_groups.setdefault(mapping.host_id, []).append(
+            groups_by_id[mapping.group_id])
+    group_vars = {}
+    stale_hosts = []
+    compiled = {}
+    for host in hosts:
+        etag.update(repr((host.id, host.name, host.zone_id,
+                          host.compiled_vars_version)).encode('utf-8'))
+        zone = zones_by_id[host.zone_id]
+        ansible_group(zone.name)['hosts'].append(host.name)
+        for group in host_groups.get(host.id, []):
+            ansible_group(group.name)['hosts'].append(host.name)
+        if host.compiled_vars_cache is not None:
+            hostvars = host.compiled_vars_cache
+        else:
+            hostvars = _compile_host_vars(
+                host, zone, host_groups.get(host.id, []), groups_by_id,
+                group_vars)
+            stale_hosts.append(host)
+            compiled[host.id] = hostvars
+        inventory['_meta']['hostvars'][host.name] = hostvars
+    if stale_hosts:
+        Host.store_compiled_vars(stale_hosts, compiled)
+    return inventory, etag.hexdigest()
+
+
+def _compile_host_vars(host, zone, host_groups, groups_by_id, group_vars):
+    """
+    Compile the vars of a host from the raw rows.
+
+    Same layering as Host.compile_vars. Every group is already loaded, so
+    ancestors are walked here rather than looked up in the closure table.
+    The merged vars of each group are kept in group_vars for the next host.
+    """
+    for group in host_groups:
+        if group.id not in group_vars:
+            layers = []
+            ancestor = group
+            while ancestor is not None:
+                layers.insert(0, ancestor.vars)
+                ancestor = groups_by_id.get(ancestor.parent_id)
+            group_vars[group.id] = merge_vars(*layers)
+    return merge_vars(zone.vars, *[group_vars[x.id] for x in host_groups],
+                      host.vars)
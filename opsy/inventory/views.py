@@ -1,32 +1,43 @@
-from flask import abort, Blueprint
+from flask import abort, request, Blueprint, Response
 from flask_apispec import marshal_with, doc
-from opsy.flask_extensions import apispec
+from marshmallow import ValidationError
+from opsy.flask_extensions import apispec, db
+from opsy.models import BulkResult
 from opsy.rbac import need_permission
-from opsy.schema import use_kwargs, EmptySchema
+from opsy.schema import (use_kwargs, EmptySchema, BulkSchema,
+                         BulkDeleteSchema, BulkResultSchema)
 from opsy.inventory.schema import (
     ZoneSchema, ZoneUpdateSchema, ZoneQuerySchema,
     HostSchema, HostUpdateSchema, HostQuerySchema,
-    GroupSchema, GroupUpdateSchema, GroupQuerySchema,
+    GroupSchema, GroupUpdateSchema, GroupQuerySchema, GroupHostsBulkSchema,
     HostGroupMappingSchema, HostGroupMappingUpdateSchema,
     HostGroupMappingQuerySchema)
-from opsy.inventory.models import Zone, Host, Group, HostGroupMapping
+from opsy.inventory.models import (
+    Zone, Host, Group, GroupClosure, HostGroupMapping)
 from opsy.exceptions import DuplicateError
+from opsy.inventory.utils import get_ansible_inventory
+from opsy.utils import (get_pagination_headers, get_streaming_response,
+                        get_vars_filters, iterencode_chunks)
 
 
 def create_inventory_views(app):
     app.register_blueprint(zones_blueprint, url_prefix='/api/v1/zones')
     app.register_blueprint(hosts_blueprint, url_prefix='/api/v1/hosts')
     app.register_blueprint(groups_blueprint, url_prefix='/api/v1/groups')
+    app.register_blueprint(
+        inventory_export_blueprint, url_prefix='/api/v1/inventory')
     apispec.spec.tag(
         {'name': 'zones',
          'description': 'Zones are the base grouping for inventory in Opsy.'})
     for view in [zones_list, zones_post, zones_get, zones_patch,
-                 zones_delete]:
+                 zones_delete, zones_bulk_post, zones_bulk_patch,
+                 zones_bulk_delete]:
         apispec.register(view, blueprint='inventory_zones')
     apispec.spec.tag(
         {'name': 'hosts',
          'description': 'Hosts are your servers.'})
     for view in [hosts_list, hosts_post, hosts_get, hosts_patch, hosts_delete,
+                 hosts_bulk_post, hosts_bulk_patch, hosts_bulk_delete,
                  host_group_mappings_list, host_group_mappings_post,
                  host_group_mappings_get, host_group_mappings_patch,
                  host_group_mappings_delete]:
@@ -35,8 +46,76 @@ def create_inventory_views(app):
         {'name': 'groups',
          'description': 'Groups are logical groupings of your hosts.'})
     for view in [groups_list, groups_post, groups_get, groups_patch,
-                 groups_delete]:
+                 groups_delete, groups_bulk_post, groups_bulk_patch,
+                 groups_bulk_delete, group_hosts_bulk_post,
+                 group_hosts_bulk_delete]:
         apispec.register(view, blueprint='inventory_groups')
+    apispec.spec.tag(
+        {'name': 'inventory',
+         'description': 'Exports of the whole inventory.'})
+    apispec.register(ansible_inventory_get, blueprint='inventory_export')
+    app.teardown_request(save_compiled_vars)
+
+
+def save_compiled_vars(exc):
+    """Materialize the vars compiled while handling the request."""
+    if exc is None:
+        Host.save_compiled_vars()
+
+
+###############################################################################
+# Eager loads
+###############################################################################
+
+# These are exactly what each schema touches when serializing, so listing
+# things never falls back to lazy loading row by row.
+ZONE_SCHEMA_LOADS = ()  # ZoneSchema doesn't touch any relationships.
+HOST_SCHEMA_LOADS = (
+    db.joinedload(Host.zone),
+    db.selectinload(Host.group_mappings).joinedload(HostGroupMapping.group),
+    db.selectinload(Host.groups).joinedload(Group.parent))
+GROUP_SCHEMA_LOADS = (
+    db.joinedload(Group.zone),
+    db.joinedload(Group.parent))
+HOST_GROUP_MAPPING_SCHEMA_LOADS = (
+    db.joinedload(HostGroupMapping.host),
+    db.joinedload(HostGroupMapping.group))
+
+
+###############################################################################
+# Bulk helpers
+###############################################################################
+
+
+def run_bulk(schema, items, operation, with_id=False):
+    """
+    Deserialize the items of a bulk request and run operation on them.
+
+    Operation only gets the items that loaded. Returns a BulkResult for every
+    item, in order. With with_id, each item's id is kept aside for the
+    operation, since the update schemas don't accept one.
+    """
+    results = [None] * len(items)
+    loaded = []
+    for index, item in enumerate(items):
+        item = dict(item)
+        obj_id = item.pop('id', None) if with_id else None
+        try:
+            data = schema.load(item)
+        except ValidationError as error:
+            results[index] = BulkResult(obj_id, 'invalid', error.messages)
+            continue
+        if with_id:
+            data['id'] = obj_id
+        loaded.append((index, data))
+    try:
+        outcomes = operation([x for _, x in loaded])
+    except DuplicateError as error:
+        abort(409, str(error))
+    for (index, _), result in zip(loaded, outcomes):
+        results[index] = result
+    return results
+
 
 ###############################################################################
 # Blueprints
@@ -49,6 +128,8 @@ zones_blueprint = Blueprint('inventory_zones', __name__)
 hosts_blueprint = Blueprint('inventory_hosts', __name__)
 # pylint: disable=invalid-name
 groups_blueprint = Blueprint('inventory_groups', __name__)
+# pylint: disable=invalid-name
+inventory_export_blueprint = Blueprint('inventory_export', __name__)
 
 ###############################################################################
 # Zone Views
@@ -65,8 +146,14 @@ groups_blueprint = Blueprint('inventory_groups', __name__)
     tags=['zones'],
     security=[{'api_key': []}])
 @need_permission('list_zones')
-def zones_list(**kwargs):
-    return Zone.query.filter_in(**kwargs).all()
+def zones_list(limit=None, after=None, include_total=False, **kwargs):
+    query = Zone.query.options(*ZONE_SCHEMA_LOADS).filter_in(**kwargs)
+    try:
+        page = query.keyset_paginate(
+            limit=limit, after=after, include_total=include_total)
+    except ValueError as error:
+        abort(400, str(error))
+    return page.items, 200, get_pagination_headers(page)
 
 
 @zones_blueprint.route('/', methods=['POST'])
@@ -135,6 +222,53 @@ def zones_delete(id_or_name):
     except ValueError as error:
         abort(404, str(error))
 
+
+@zones_blueprint.route('/_bulk', methods=['POST'])
+@use_kwargs(BulkSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_create_zones',
+    summary='Create many zones.',
+    description='All zones that are valid are created in a single '
+                'transaction. The result of each item is returned in the '
+                'same order as the request.',
+    tags=['zones'],
+    security=[{'api_key': []}])
+@need_permission('create_zone')
+def zones_bulk_post(items):
+    return run_bulk(ZoneSchema(), items, Zone.bulk_create)
+
+
+@zones_blueprint.route('/_bulk', methods=['PATCH'])
+@use_kwargs(BulkSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_update_zones',
+    summary='Update many zones.',
+    description='Each item needs the ID or name of the zone to update. '
+                'All valid updates are made in a single transaction.',
+    tags=['zones'],
+    security=[{'api_key': []}])
+@need_permission('update_zone')
+def zones_bulk_patch(items):
+    return run_bulk(ZoneUpdateSchema(partial=True), items,
+                    Zone.bulk_update, with_id=True)
+
+
+@zones_blueprint.route('/_bulk', methods=['DELETE'])
+@use_kwargs(BulkDeleteSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_delete_zones',
+    summary='Delete many zones.',
+    description='The items are the ID or names of the zones to delete, '
+                'which are all deleted in a single transaction.',
+    tags=['zones'],
+    security=[{'api_key': []}])
+@need_permission('delete_zone')
+def zones_bulk_delete(items):
+    return Zone.bulk_delete(items)
+
 ###############################################################################
 # Host Views
 ###############################################################################
@@ -146,12 +280,29 @@ def zones_delete(id_or_name):
 @doc(
     operationId='list_hosts',
     summary='List hosts.',
-    description='',
+    description='Hosts can also be filtered on their vars with a vars.<path> '
+                'parameter, like vars.role=db,cache or vars.consul.node=*01.',
     tags=['hosts'],
     security=[{'api_key': []}])
 @need_permission('list_hosts')
-def hosts_list(**kwargs):
-    return Host.query.filter_in(**kwargs).all()
+def hosts_list(limit=None, after=None, include_total=False, stream=None,
+               descendant_of=None, **kwargs):
+    kwargs.update(get_vars_filters())
+    try:
+        query = Host.query.options(*HOST_SCHEMA_LOADS).filter_in(**kwargs)
+        if descendant_of:
+            query = query.filter(Host.id.in_(
+                GroupClosure.get_descendant_host_ids(descendant_of)))
+        if stream:
+            return get_streaming_response(
+                query, HostSchema(), stream, after=after,
+                prepare=Host.precompile_vars)
+        page = query.keyset_paginate(
+            limit=limit, after=after, include_total=include_total)
+    except ValueError as error:
+        abort(400, str(error))
+    Host.precompile_vars(page.items)
+    return page.items, 200, get_pagination_headers(page)
 
 
 @hosts_blueprint.route('/', methods=['POST'])
@@ -182,9 +333,10 @@ def hosts_post(**kwargs):
 @need_permission('show_host')
 def hosts_get(id_or_name):
     try:
-        return Host.get_by_id_or_name(id_or_name)
+        host = Host.get_by_id_or_name(id_or_name)
     except ValueError as error:
         abort(404, str(error))
+    return Host.precompile_vars([host])[0]
 
 
 @hosts_blueprint.route('/<id_or_name>', methods=['PATCH'])
@@ -221,6 +373,53 @@ def hosts_delete(id_or_name):
         abort(404, str(error))
 
 
+@hosts_blueprint.route('/_bulk', methods=['POST'])
+@use_kwargs(BulkSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_create_hosts',
+    summary='Create many hosts.',
+    description='All hosts that are valid are created in a single '
+                'transaction. The result of each item is returned in the '
+                'same order as the request.',
+    tags=['hosts'],
+    security=[{'api_key': []}])
+@need_permission('create_host')
+def hosts_bulk_post(items):
+    return run_bulk(HostSchema(), items, Host.bulk_create)
+
+
+@hosts_blueprint.route('/_bulk', methods=['PATCH'])
+@use_kwargs(BulkSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_update_hosts',
+    summary='Update many hosts.',
+    description='Each item needs the ID or name of the host to update. '
+                'All valid updates are made in a single transaction.',
+    tags=['hosts'],
+    security=[{'api_key': []}])
+@need_permission('update_host')
+def hosts_bulk_patch(items):
+    return run_bulk(HostUpdateSchema(partial=True), items,
+                    Host.bulk_update, with_id=True)
+
+
+@hosts_blueprint.route('/_bulk', methods=['DELETE'])
+@use_kwargs(BulkDeleteSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_delete_hosts',
+    summary='Delete many hosts.',
+    description='The items are the ID or names of the hosts to delete, '
+                'which are all deleted in a single transaction.',
+    tags=['hosts'],
+    security=[{'api_key': []}])
+@need_permission('delete_host')
+def hosts_bulk_delete(items):
+    return Host.bulk_delete(items)
+
+
 ###############################################################################
 # Host Group Mapping Views
 ###############################################################################
@@ -236,13 +435,22 @@ def hosts_delete(id_or_name):
     tags=['hosts'],
     security=[{'api_key': []}])
 @need_permission('show_host')
-def host_group_mappings_list(id_or_name, **kwargs):
+def host_group_mappings_list(id_or_name, limit=None, after=None,
+                             include_total=False, **kwargs):
     try:
         host = Host.get_by_id_or_name(id_or_name)
     except ValueError as error:
         abort(404, str(error))
-    return HostGroupMapping.query.filter_by(
-        host_id=host.id).filter_in(**kwargs).all()
+    query = HostGroupMapping.query.options(
+        *HOST_GROUP_MAPPING_SCHEMA_LOADS).filter_by(
+            host_id=host.id).filter_in(**kwargs)
+    try:
+        page = query.keyset_paginate(
+            limit=limit, after=after, include_total=include_total,
+            keys=[HostGroupMapping.priority, HostGroupMapping.id])
+    except ValueError as error:
+        abort(400, str(error))
+    return page.items, 200, get_pagination_headers(page)
 
 
 @hosts_blueprint.route('/<id_or_name>/group_mappings/', methods=['POST'])
@@ -341,8 +549,21 @@ def host_group_mappings_delete(id_or_name, group_id_or_name):
     tags=['groups'],
     security=[{'api_key': []}])
 @need_permission('list_groups')
-def groups_list(**kwargs):
-    return Group.query.filter_in(**kwargs).all()
+def groups_list(limit=None, after=None, include_total=False, stream=None,
+                descendant_of=None, **kwargs):
+    query = Group.query.options(*GROUP_SCHEMA_LOADS).filter_in(**kwargs)
+    if descendant_of:
+        query = query.filter(Group.id.in_(
+            GroupClosure.get_descendant_ids(descendant_of)))
+    try:
+        if stream:
+            return get_streaming_response(
+                query, GroupSchema(), stream, after=after)
+        page = query.keyset_paginate(
+            limit=limit, after=after, include_total=include_total)
+    except ValueError as error:
+        abort(400, str(error))
+    return page.items, 200, get_pagination_headers(page)
 
 
 @groups_blueprint.route('/', methods=['POST'])
@@ -410,3 +631,113 @@ def groups_delete(group_id):
         return ('', 204)
     except ValueError as error:
         abort(404, str(error))
+
+
+@groups_blueprint.route('/_bulk', methods=['POST'])
+@use_kwargs(BulkSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_create_groups',
+    summary='Create many groups.',
+    description='All groups that are valid are created in a single '
+                'transaction. The result of each item is returned in the '
+                'same order as the request.',
+    tags=['groups'],
+    security=[{'api_key': []}])
+@need_permission('create_group')
+def groups_bulk_post(items):
+    return run_bulk(GroupSchema(), items, Group.bulk_create)
+
+
+@groups_blueprint.route('/_bulk', methods=['PATCH'])
+@use_kwargs(BulkSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_update_groups',
+    summary='Update many groups.',
+    description='Each item needs the ID of the group to update. '
+                'All valid updates are made in a single transaction.',
+    tags=['groups'],
+    security=[{'api_key': []}])
+@need_permission('update_group')
+def groups_bulk_patch(items):
+    return run_bulk(GroupUpdateSchema(partial=True), items,
+                    Group.bulk_update, with_id=True)
+
+
+@groups_blueprint.route('/_bulk', methods=['DELETE'])
+@use_kwargs(BulkDeleteSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_delete_groups',
+    summary='Delete many groups.',
+    description='The items are the IDs of the groups to delete, '
+                'which are all deleted in a single transaction.',
+    tags=['groups'],
+    security=[{'api_key': []}])
+@need_permission('delete_group')
+def groups_bulk_delete(items):
+    return Group.bulk_delete(items)
+
+
+@groups_blueprint.route('/<group_id>/hosts/_bulk', methods=['POST'])
+@use_kwargs(GroupHostsBulkSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_add_group_hosts',
+    summary='Add many hosts to a group.',
+    description='All hosts that can be added are added in a single '
+                'statement. The result of each host is returned in the '
+                'same order as the request.',
+    tags=['groups'],
+    security=[{'api_key': []}])
+@need_permission('update_group')
+def group_hosts_bulk_post(group_id, items, priority=None):
+    try:
+        group = Group.get_by_id(group_id)
+    except ValueError as error:
+        abort(404, str(error))
+    try:
+        return group.bulk_add_hosts(items, priority=priority)
+    except DuplicateError as error:
+        abort(409, str(error))
+
+
+@groups_blueprint.route('/<group_id>/hosts/_bulk', methods=['DELETE'])
+@use_kwargs(BulkDeleteSchema)
+@marshal_with(BulkResultSchema(many=True), code=200)
+@doc(
+    operationId='bulk_remove_group_hosts',
+    summary='Remove many hosts from a group.',
+    description='The items are the IDs or names of the hosts to remove, '
+                'which are all removed in a single statement.',
+    tags=['groups'],
+    security=[{'api_key': []}])
+@need_permission('update_group')
+def group_hosts_bulk_delete(group_id, items):
+    try:
+        group = Group.get_by_id(group_id)
+    except ValueError as error:
+        abort(404, str(error))
+    return group.bulk_remove_hosts(items)
+
+
+###############################################################################
+# Inventory Export Views
+###############################################################################
+
+
+@inventory_export_blueprint.route('/ansible', methods=['GET'])
+@doc(
+    operationId='export_ansible_inventory',
+    summary='Export the inventory in Ansible dynamic inventory format.',
+    description='',
+    tags=['inventory'],
+    security=[{'api_key': []}])
+@need_permission('export_inventory')
+def ansible_inventory_get():
+    inventory, etag = get_ansible_inventory()
+    response = Response(iterencode_chunks(inventory),
+                        mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
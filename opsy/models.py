@@ -1,7 +1,16 @@
+import base64
+import binascii
+import json
+import re
+import sqlite3
 import uuid
+from collections import namedtuple
 from datetime import datetime, timezone
 from flask_sqlalchemy import BaseQuery
-from sqlalchemy import or_
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.attributes import CollectionAttributeImpl
 from sqlalchemy.orm.base import _entity_descriptor
 from opsy.flask_extensions import db
@@ -11,6 +20,43 @@ from opsy.exceptions import DuplicateError
 # Base models
 ###############################################################################
 
+# The outcome of one item of a bulk operation. Status is one of created,
+# updated, deleted, invalid or not_found, and error says what went wrong.
+BulkResult = namedtuple('BulkResult', ['id', 'status', 'error'])
+
+
+# Keys allowed in a path into a JSON column, see json_path_extract.
+JSON_PATH_KEY = re.compile(r'^[\w-]+$')
+
+
+def chunks(items, size=500):
+    """Split items into lists small enough to use in an IN clause."""
+    items = list(items)
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def json_path_extract(column, path):
+    """
+    Extract path, a list of keys, from column with SQLite's json_extract.
+
+    The path is inlined rather than bound so queries match expression indexes
+    on the same path, which is why keys are limited to word characters.
+    """
+    if not path or not all(JSON_PATH_KEY.match(x) for x in path):
+        raise ValueError(f'Invalid JSON path "{".".join(path)}".')
+    return db.func.json_extract(
+        column, db.literal_column(f"'$.{'.'.join(path)}'"))
+
+
+@db.event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """Turn on SQLite's foreign keys for the ON DELETE CASCADE we rely on."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
 
 class AwareDateTime(db.TypeDecorator):
     """Results returned as aware datetimes, not naive ones."""
@@ -31,6 +77,31 @@ class TimeStampMixin:
                            onupdate=datetime.now(timezone.utc))
 
 
+class KeysetPage:
+    """A single page of results from a keyset paginated query."""
+
+    def __init__(self, items, next_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.total = total
+
+    @staticmethod
+    def encode_cursor(values):
+        return base64.urlsafe_b64encode(
+            json.dumps(values).encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor, length):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(
+                cursor.encode('ascii')).decode('utf-8'))
+        except (binascii.Error, UnicodeError, ValueError):
+            raise ValueError(f'Invalid pagination cursor "{cursor}".')
+        if not isinstance(values, list) or len(values) != length:
+            raise ValueError(f'Invalid pagination cursor "{cursor}".')
+        return values
+
+
 class OpsyQuery(BaseQuery):
 
     def filter_in(self, ignore_none=False, **kwargs):
@@ -38,6 +109,13 @@ class OpsyQuery(BaseQuery):
         joins = []
         for key, value in kwargs.items():
             local_descriptor = None  # for joins this is the local attribute
+            if '.' in key:
+                # A path into a JSON column, like vars.role.
+                key, path = key.split('.', 1)
+                filters.extend(self._get_json_filters(
+                    _entity_descriptor(self._joinpoint_zero(), key),
+                    path.split('.'), value))
+                continue
             if '___' in key:
                 key, relationship_attr = key.split('___', 1)
             else:
@@ -86,6 +164,57 @@ class OpsyQuery(BaseQuery):
                     filters_list.append(~or_(*exclude_list))
         return filters_list
 
+    def _get_json_filters(self, descriptor, path, items):
+        """
+        Filters on the value at path, a list of keys, in a JSON column.
+
+        Exact matches compile to JSONB containment on Postgres, which a GIN
+        index covers, and to json_extract on SQLite, which an expression
+        index on the path covers. Values that parse as JSON scalars match
+        those too, so role=1 finds both 1 and "1".
+        """
+        filters_list = []
+        if not items:
+            return filters_list
+        # Keys are checked on every database so the same paths are valid
+        # whichever one we're on.
+        if not path or not all(JSON_PATH_KEY.match(x) for x in path):
+            raise ValueError(f'Invalid JSON path "{".".join(path)}".')
+        include, exclude, like, not_like = self._parse_filters(items)
+        postgres = db.session.bind.dialect.name == 'postgresql'
+        if postgres:
+            document = db.cast(descriptor, postgresql.JSONB)
+            text = document[tuple(path)].astext
+        else:
+            text = json_path_extract(descriptor, path)
+
+        def matches(values):
+            values = [y for x in values for y in self._json_values(x)]
+            if not postgres:
+                return [text.in_(values)] if values else []
+            for key in reversed(path):
+                values = [{key: x} for x in values]
+            return [document.contains(x) for x in values]
+
+        include_list = matches(include) + [text.like(x) for x in like]
+        if include_list:
+            filters_list.append(or_(*include_list))
+        exclude_list = matches(exclude) + [text.like(x) for x in not_like]
+        if exclude_list:
+            # Things without the path at all don't match, so keep them.
+            filters_list.append(or_(text.is_(None), ~or_(*exclude_list)))
+        return filters_list
+
+    @staticmethod
+    def _json_values(value):
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            return [value]
+        if parsed is None or isinstance(parsed, (str, dict, list)):
+            return [value]
+        return [value, parsed]
+
     def _parse_filters(self, items):
         item_list = items.split(',')
         # Wrap in a set to remove duplicates
@@ -99,6 +228,39 @@ class OpsyQuery(BaseQuery):
                          if x.startswith('!') and '*' in x})
         return include, exclude, like, not_like
 
+    def keyset_paginate(self, limit=None, after=None, include_total=False,
+                        keys=None):
+        """
+        Paginate on a unique ordered set of keys rather than an offset.
+
+        The keys default to (name, id) for named models and to just id for
+        everything else. The cursor for the next page is opaque to clients
+        and only handed out when there are more results to fetch.
+        """
+        model = self._mapper_zero().class_
+        if keys is None:
+            keys = [model.name, model.id] if hasattr(model, 'name') \
+                else [model.id]
+        total = self.order_by(None).count() if include_total else None
+        query = self
+        if after:
+            values = KeysetPage.decode_cursor(after, len(keys))
+            query = query.filter(or_(*[
+                and_(*[keys[x] == values[x] for x in range(index)],
+                     key > values[index])
+                for index, key in enumerate(keys)]))
+        query = query.order_by(*keys)
+        if not limit:
+            return KeysetPage(query.all(), total=total)
+        # We grab one extra row so we know if there's another page.
+        items = query.limit(limit + 1).all()
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = KeysetPage.encode_cursor(
+                [getattr(items[-1], key.key) for key in keys])
+        return KeysetPage(items, next_cursor=next_cursor, total=total)
+
     def get_or_fail(self, ident):
         obj = self.get(ident)
         if obj is None:
@@ -155,6 +317,129 @@ class BaseModel:
         if commit:
             db.session.commit()
 
+    @classmethod
+    def bulk_create(cls, items):
+        """
+        Create many objects in a single transaction.
+
+        Items are dicts of column values. They're all checked up front with
+        _bulk_errors, then the objects for the ones that passed are added and
+        flushed together, so validators, defaults and flush listeners still
+        apply, and the inserts are batched by the ORM. Returns a BulkResult
+        for each item, in order.
+        """
+        results = []
+        # Validators can query, which mustn't flush half built objects.
+        with db.session.no_autoflush:  # pylint: disable=no-member
+            for item, error in zip(items, cls._bulk_errors(items)):
+                if error:
+                    results.append(BulkResult(None, 'invalid', error))
+                    continue
+                # Ids are set up front so the results don't need them loaded
+                # back after the commit.
+                try:
+                    obj = cls(**dict(item, id=str(uuid.uuid4())))
+                except ValueError as exc:
+                    results.append(BulkResult(None, 'invalid', str(exc)))
+                    continue
+                db.session.add(obj)
+                results.append(BulkResult(obj.id, 'created', None))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise DuplicateError(
+                f'A {cls.__name__} in this batch was created by someone '
+                'else in the meantime.')
+        return results
+
+    @classmethod
+    def bulk_update(cls, items):
+        """
+        Update many objects in a single transaction.
+
+        Each item needs the id of the object to update. The objects are
+        loaded a few hundred at a time and flushed together, so validators
+        and flush listeners still apply. Returns a BulkResult for each item,
+        in order.
+        """
+        objs = cls._bulk_get(x.get('id') for x in items)
+        results = []
+        # Validators can query, which mustn't flush half updated objects.
+        with db.session.no_autoflush:  # pylint: disable=no-member
+            for item, error in zip(items, cls._bulk_errors(items, objs)):
+                obj = objs.get(item.get('id'))
+                if obj is None:
+                    results.append(BulkResult(
+                        item.get('id'), 'not_found',
+                        f'No {cls.__name__} found with id '
+                        f'"{item.get("id")}".'))
+                    continue
+                if error:
+                    results.append(BulkResult(obj.id, 'invalid', error))
+                    continue
+                try:
+                    for key, value in item.items():
+                        if key != 'id':
+                            setattr(obj, key, value)
+                except ValueError as exc:
+                    db.session.expire(obj)  # pylint: disable=no-member
+                    results.append(BulkResult(obj.id, 'invalid', str(exc)))
+                    continue
+                results.append(BulkResult(obj.id, 'updated', None))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise DuplicateError(
+                f'A {cls.__name__} in this batch was changed by someone '
+                'else in the meantime.')
+        return results
+
+    @classmethod
+    def bulk_delete(cls, ids):
+        """
+        Delete many objects in a single transaction.
+
+        Returns a BulkResult for each id, in order.
+        """
+        ids = list(ids)
+        objs = cls._bulk_get(ids)
+        results = []
+        for obj_id in ids:
+            obj = objs.get(obj_id)
+            if obj is None:
+                results.append(BulkResult(
+                    obj_id, 'not_found',
+                    f'No {cls.__name__} found with id "{obj_id}".'))
+                continue
+            if obj not in db.session.deleted:
+                db.session.delete(obj)
+            results.append(BulkResult(obj.id, 'deleted', None))
+        db.session.commit()
+        return results
+
+    @classmethod
+    def _bulk_get(cls, ids):
+        """Load the objects with the given ids, keyed by id."""
+        objs = {}
+        for chunk in chunks({x for x in ids if x}):
+            for obj in cls.query.filter(cls.id.in_(chunk)):
+                objs[obj.id] = obj
+        return objs
+
+    @classmethod
+    def _bulk_errors(cls, items, objs=None):
+        """
+        Check a batch of items before it's created or updated.
+
+        Objs are the objects being updated keyed by id, or None when
+        creating. Returns what's wrong with each item, or None when it's
+        fine, in order. Models override this to check with a handful of
+        set-based queries what they'd otherwise check row by row.
+        """
+        return [None] * len(items)
+
     def __repr__(self):
         return f'<{self.__class__.__name__} {self.id}>'
 
@@ -175,6 +460,37 @@ class NamedModel(BaseModel):
                 cls.__name__, name))
         return cls(name, *args, **kwargs).save()
 
+    @classmethod
+    def _bulk_get(cls, ids):
+        """Load the objects with the given ids or names, keyed by both."""
+        objs = {}
+        for chunk in chunks({x for x in ids if x}):
+            for obj in cls.query.filter(
+                    db.or_(cls.id.in_(chunk), cls.name.in_(chunk))):
+                objs[obj.id] = objs[obj.name] = obj
+        return objs
+
+    @classmethod
+    def _bulk_errors(cls, items, objs=None):
+        objs = objs or {}
+        errors = super()._bulk_errors(items, objs)
+        names = {x['name'] for x in items if x.get('name')}
+        taken = {}
+        for chunk in chunks(names):
+            taken.update(db.session.query(cls.name, cls.id).filter(
+                cls.name.in_(chunk)))
+        seen = set()
+        for index, item in enumerate(items):
+            name = item.get('name')
+            if not name:
+                continue
+            obj_id = getattr(objs.get(item.get('id')), 'id', None)
+            if name in seen or taken.get(name, obj_id) != obj_id:
+                errors[index] = errors[index] or \
+                    f'{cls.__name__} already exists with name "{name}".'
+            seen.add(name)
+        return errors
+
     @classmethod
     def get_by_id_or_name(cls, obj_id_or_name):
         obj = cls.query.filter(db.or_(
@@ -1,21 +1,188 @@
 import asyncio
+import codecs
+import hashlib
+import json
+import uuid
 from abc import abstractmethod, ABCMeta
+from datetime import datetime
 import aiohttp
 from flask import current_app
-from sqlalchemy import and_, tuple_
 from werkzeug.urls import url_join
 import opsy
 from opsy.flask_extensions import db
 from opsy.inventory.models import Host
-from opsy.monitoring.models import Event
+from opsy.monitoring.models import Event, MonitoringService
 from opsy.monitoring.exceptions import PollFailure
 
 
+# Returned by get when a URL hasn't changed since the last poll.
+NOT_MODIFIED = object()
+
+
+class JSONArrayParser:
+    """
+    Incrementally parses the items of a top level JSON array.
+
+    Bytes are fed in as they arrive and every item that's complete so far is
+    returned with its source text, so only the unfinished tail of the array
+    is ever buffered.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._started = False
+        self._finished = False
+
+    def feed(self, chunk, final=False):
+        """Returns a list of (item, text) tuples for the complete items."""
+        buffer = self._buffer + self._text_decoder.decode(chunk, final=final)
+        items = []
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\n\r,':
+                position += 1
+            if position >= len(buffer) or self._finished:
+                break
+            if not self._started:
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array.')
+                self._started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                self._finished = True
+                position += 1
+                continue
+            try:
+                item, end = self._decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break  # We don't have the whole item yet.
+            if not final and not isinstance(item, (dict, list, str)) and (
+                    end == len(buffer) or buffer[end] not in ' \t\n\r,]'):
+                break  # This could be a number that isn't finished.
+            items.append((item, buffer[position:end]))
+            position = end
+        self._buffer = buffer[position:]
+        return items
+
+    def close(self):
+        """Returns any items left and makes sure the array was finished."""
+        items = self.feed(b'', final=True)
+        if not self._finished or self._buffer.strip():
+            raise ValueError('Incomplete JSON array.')
+        return items
+
+
+class EventBatcher:
+    """
+    Groups decoded events into batches of batch_size.
+
+    A running hash of the items is kept at every batch boundary. While those
+    match the ones from the last poll the batches are dropped, so if the
+    whole payload turns out to be the same nothing needs to be reconciled.
+    Only the batch being filled is ever held. If the payload changes after
+    some batches were dropped, replay is set and nothing more is returned,
+    since the dropped events have to be read again to be reconciled.
+    Otherwise batches are returned as soon as they're full.
+    """
+
+    def __init__(self, decode_item, batch_size, last_digests=None):
+        self.decode_item = decode_item
+        self.batch_size = batch_size
+        self.last_digests = last_digests or []
+        self.digests = []
+        self.replay = False
+        self._digest = hashlib.sha1()
+        self._batch = []
+        self._matching = bool(self.last_digests)
+        self._dropped = 0
+
+    def _end_batch(self):
+        self.digests.append(self._digest.hexdigest())
+        index = len(self.digests) - 1
+        batch, self._batch = self._batch, []
+        if self._matching and index < len(self.last_digests) and \
+                self.last_digests[index] == self.digests[index]:
+            self._dropped += 1
+            return []
+        self._matching = False
+        if self._dropped:
+            self.replay = True
+            return []
+        return [batch]
+
+    def add(self, items):
+        """Returns the batches that are ready to be reconciled."""
+        batches = []
+        for item, text in items:
+            if self.replay:
+                break
+            self._digest.update(text.encode('utf-8'))
+            event = self.decode_item(item)
+            if event is not None:
+                self._batch.append(event)
+            if len(self._batch) >= self.batch_size:
+                batches.extend(self._end_batch())
+        return batches
+
+    def finish(self, items=()):
+        """Returns the remaining batches, or none if nothing changed."""
+        batches = self.add(items)
+        if self.replay:
+            return batches
+        batches.extend(self._end_batch())
+        if self._matching and len(self.digests) != len(self.last_digests):
+            # Everything matched, but there were more batches last time.
+            self._matching = False
+            self.replay = True
+        return batches
+
+
+class SessionPool:
+    """
+    Long-lived aiohttp sessions, shared by backends polling the same server.
+
+    The sessions keep connections alive and cache DNS lookups between polls,
+    so a poll doesn't pay for new TCP and TLS handshakes every time. A pool
+    belongs to the event loop it's used on and has to be closed before the
+    loop is.
+    """
+
+    def __init__(self, limit=10, dns_cache_ttl=300, keepalive_timeout=75):
+        self.limit = limit
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._sessions = {}
+
+    def get(self, backend):
+        session = self._sessions.get(backend.session_key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=None if backend.verify_ssl else False)
+            # pylint: disable=protected-access
+            session = backend._create_session(connector=connector)
+            self._sessions[backend.session_key] = session
+        return session
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+
 class HttpPollerBackend(metaclass=ABCMeta):
 
     def __init__(self, monitoring_service, host='localhost', protocol='http',
                  port=80, path='/', interval=60, timeout=30, username=None,
                  password=None, verify_ssl=False):
+        self.monitoring_service_id = None
+        self._monitoring_service = None
         self.monitoring_service = monitoring_service
         self.host = host
         self.protocol = protocol
@@ -27,6 +194,24 @@ class HttpPollerBackend(metaclass=ABCMeta):
         self.password = password
         self.verify_ssl = verify_ssl
 
+    @property
+    def monitoring_service(self):
+        """
+        The service this backend polls, from the current session.
+
+        Backends are cached and shared between sessions and threads, so they
+        only keep the service's id once it has one.
+        """
+        if self.monitoring_service_id is None:
+            return self._monitoring_service
+        return MonitoringService.query.get(self.monitoring_service_id)
+
+    @monitoring_service.setter
+    def monitoring_service(self, monitoring_service):
+        self.monitoring_service_id = getattr(monitoring_service, 'id', None)
+        self._monitoring_service = monitoring_service \
+            if self.monitoring_service_id is None else None
+
     @property
     @abstractmethod
     def urls(self):
@@ -36,6 +221,15 @@ class HttpPollerBackend(metaclass=ABCMeta):
     def decode(self, data):
         """This performs the data decoding. Returns list of raw events."""
 
+    @abstractmethod
+    def decode_item(self, item):
+        """
+        This decodes one item of a streamed response into an event.
+
+        Returns None if the item should be skipped. It's only used when the
+        streaming property is True.
+        """
+
     @property
     def base_url(self):
         return url_join(
@@ -56,24 +250,58 @@ class HttpPollerBackend(metaclass=ABCMeta):
             'verify_ssl': self.verify_ssl
         }
 
-    def _create_session(self):
+    @property
+    def session_key(self):
+        """Backends with the same key can share a session."""
+        return (self.protocol, self.host, self.port, self.username,
+                self.password, self.verify_ssl, self.timeout)
+
+    def _create_session(self, connector=None):
         auth = aiohttp.BasicAuth(self.username, self.password) \
             if (self.username and self.password) else None
-        conn = aiohttp.TCPConnector(verify_ssl=False) \
-            if not self.verify_ssl else None
+        if connector is None and not self.verify_ssl:
+            connector = aiohttp.TCPConnector(ssl=False)
         headers = {'User-Agent': 'Opsy/%s' % opsy.__version__}
         timeout = aiohttp.ClientTimeout(self.timeout)
-        return aiohttp.ClientSession(auth=auth, connector=conn,
+        return aiohttp.ClientSession(auth=auth, connector=connector,
                                      headers=headers, timeout=timeout)
 
-    async def fetch(self, urls, expected_status=None):
-        """This performs the data retrival."""
-        async with self._create_session() as session:
-            tasks = [
-                asyncio.ensure_future(
-                    self.get(session, url, expected_status=expected_status))
-                for url in urls]
-            return await asyncio.gather(*tasks)
+    async def fetch(self, urls, expected_status=None, session_pool=None,
+                    validators=None):
+        """
+        This performs the data retrival.
+
+        When a validators dict is given, it's used to make conditional
+        requests against the ETags and payload hashes from the last poll and
+        is updated with the ones from this poll. If nothing changed since
+        then, this returns None.
+        """
+        try:
+            if session_pool is not None:
+                return await self._fetch(session_pool.get(self), urls,
+                                         expected_status, validators)
+            async with self._create_session() as session:
+                return await self._fetch(
+                    session, urls, expected_status, validators)
+        except (aiohttp.ClientError, ValueError) as error:
+            raise PollFailure(str(error)) from error
+
+    async def _fetch(self, session, urls, expected_status=None,
+                     validators=None):
+        tasks = [
+            asyncio.ensure_future(self.get(
+                session, url, expected_status=expected_status,
+                validators=validators))
+            for url in urls]
+        results = await asyncio.gather(*tasks)
+        if all(x is NOT_MODIFIED for x in results):
+            return None
+        # Something changed, so we need the full data for every URL again.
+        for index, url in enumerate(urls):
+            if results[index] is NOT_MODIFIED:
+                results[index] = await self.get(
+                    session, url, expected_status=expected_status)
+        return results
 
     def update(self):
         """This triggers the work needed to update."""
@@ -86,77 +314,141 @@ class HttpPollerBackend(metaclass=ABCMeta):
             current_app.logger.error(  # pylint: disable=no-member
                 'Failed to update events on monitoring service %s: %s',
                 self.monitoring_service.name, error.__class__.__name__)
+            return
+        self.reconcile(self.decode(data))
+        current_app.logger.info(
+            f'Updated monitoring service {self.monitoring_service.name}.')
 
+    def reconcile(self, new_events):
+        """Brings the stored events in line with a list of decoded events."""
+        polled_at = datetime.utcnow()
+        self.upsert_events(new_events, polled_at)
+        self.resolve_events(polled_at)
+
+    def upsert_events(self, new_events, polled_at):
+        """Stores decoded events as seen by the poll at polled_at."""
+        monitoring_service = self.monitoring_service
+        chunk_size = current_app.config.opsy['monitoring']['upsert_chunk_size']
+        zone_name = getattr(monitoring_service.zone, 'name', None)
         # So basic idea of what we're doing in this next section:
-        # 1) We get the list of all events from the API.
-        new_events = self.decode(data)
-        # 2) We create a key tuple of all the events in a list.
-        event_keys = [(self.monitoring_service.id,
-                       x['host_name'],
-                       x['check_name']) for x in new_events]
-        # 3) We get a list of all the hosts with names matching the events.
-        hosts = Host.query.filter(
-            Host.name.in_([x['host_name'] for x in new_events])).all()
-        # 4) We compare this to all unresolved events to find the ones that
-        #    resolved since we last polled and mark them as such.
-        for resolved_event in Event.query.filter(and_(
-                Event.monitoring_service_id == self.monitoring_service.id,
-                ~Event.resolved,
-                ~tuple_(
-                    Event.monitoring_service_id,
-                    Event.host_name,
-                    Event.check_name).in_(event_keys))).all():
-            resolved_event.resolve(commit=False)
-            db.session.add(resolved_event)
-        # 5) We compare this to all the events we currently know about and mark
-        #    those for update so we don't get duplicates. We also add the
-        #    host_id if the host exists.
-        existing_events = []
-        for existing_event in Event.query.filter(and_(
-                Event.monitoring_service_id == self.monitoring_service.id,
-                ~Event.resolved,
-                tuple_(
-                    Event.monitoring_service_id,
-                    Event.host_name,
-                    Event.check_name).in_(event_keys))).all():
-            for new_event in new_events:
-                if new_event['host_name'] == existing_event.host_name and \
-                        new_event['check_name'] == existing_event.check_name:
-                    host_id = None
-                    for host in hosts:
-                        if new_event['host_name'] == host.name:
-                            host_id = host.id
-                            break
-                    existing_events.append(new_event)
-                    db.session.add(
-                        existing_event.update(commit=False, host_id=host_id,
-                                              **new_event))
-                    break
-        # 6) We eliminate the existing events from the new list.
-        new_events = [x for x in new_events if x not in existing_events]
-        # 7) We create the new events, adding the host_id if the host exists.
-        for new_event in new_events:
-            current_app.logger.debug(f'Adding new event: {new_event}')
-            host_id = None
-            for host in hosts:
-                if new_event['host_name'] == host.name:
-                    host_id = host.id
-                    break
-            db.session.add(
-                Event(self.monitoring_service, host_id=host_id, **new_event))
-        # 8) And commit the changes.
+        # 1) We key all the events from the API by host and check name. If
+        #    the API gives us the same check twice the last one wins.
+        new_events = list({(x['host_name'], x['check_name']): x
+                           for x in new_events}.values())
+        for index in range(0, len(new_events), chunk_size):
+            chunk = new_events[index:index + chunk_size]
+            # 2) We map the names of the hosts in this chunk to their ids.
+            host_ids = {}
+            for host_name, host_id in db.session.query(
+                    Host.name, Host.id).filter(
+                        Host.name.in_({x['host_name'] for x in chunk})):
+                host_ids.setdefault(host_name, host_id)
+            # 3) We insert the events we don't know about and update the ones
+            #    we do, marking them all as seen in this poll.
+            Event.upsert([
+                dict(x, id=str(uuid.uuid4()),
+                     monitoring_service_id=monitoring_service.id,
+                     monitoring_service_name=monitoring_service.name,
+                     zone_name=zone_name, host_id=host_ids.get(x['host_name']),
+                     state='new', resolved=False, polled_at=polled_at)
+                for x in chunk])
+
+    def resolve_events(self, polled_at):
+        """Resolves the events the poll at polled_at didn't see and commits."""
+        # 4) Anything unresolved we didn't see in this poll has resolved since
+        #    we last polled.
+        Event.resolve_unpolled(self.monitoring_service.id, polled_at)
+        # 5) And commit the changes.
+        self.monitoring_service.last_poll_time = polled_at
         db.session.commit()
-        current_app.logger.info(
-            f'Updated monitoring service {self.monitoring_service.name}.')
 
-    async def get(self, session, url, expected_status=None):
+    async def _request(self, session, url, expected_status=None,
+                       last_poll=None):
+        """Returns the response for url, or None if it wasn't modified."""
         expected_status = expected_status or [200]
+        headers = {}
+        if last_poll and last_poll['etag']:
+            headers['If-None-Match'] = last_poll['etag']
         try:
-            response = await session.get(url)
+            response = await session.get(url, headers=headers)
         except asyncio.TimeoutError:
             raise aiohttp.ClientError('Timeout exceeded')
+        if response.status == 304 and last_poll:
+            response.release()
+            return None
         if response.status not in expected_status:
             response.close()
             raise aiohttp.ClientError('Unexpected response from %s, got'
                                       ' %s' % (url, response.status))
-        return await response.json()
+        return response
+
+    async def get(self, session, url, expected_status=None, validators=None):
+        last_poll = validators.get(url) if validators is not None else None
+        response = await self._request(
+            session, url, expected_status=expected_status, last_poll=last_poll)
+        if response is None:
+            return NOT_MODIFIED
+        body = await response.read()
+        if validators is not None:
+            digest = hashlib.sha1(body).hexdigest()
+            validators[url] = {
+                'etag': response.headers.get('ETag'), 'digest': digest}
+            if last_poll and last_poll.get('digest') == digest:
+                return NOT_MODIFIED
+        return json.loads(body)
+
+    async def stream(self, session, url, batch_size, expected_status=None,
+                     validators=None):
+        """
+        Yields batches of decoded events from url as the response arrives.
+
+        The response is parsed incrementally with decode_item, so neither the
+        body nor the raw events are ever held in memory whole. Nothing is
+        yielded if the response is unchanged since the last poll, otherwise
+        the last batch is always yielded, even when it's empty. If the start
+        of the response matched the last poll but the rest didn't, it's
+        requested again so the start can be reconciled too.
+        """
+        last_poll = validators.get(url) if validators is not None else None
+        response = await self._request(
+            session, url, expected_status=expected_status, last_poll=last_poll)
+        if response is None:
+            return
+        batcher = EventBatcher(self.decode_item, batch_size,
+                               (last_poll or {}).get('digests'))
+        async for batch in self._stream_batches(response, batcher):
+            yield batch
+        if batcher.replay:
+            response = await self._request(
+                session, url, expected_status=expected_status)
+            batcher = EventBatcher(self.decode_item, batch_size)
+            async for batch in self._stream_batches(response, batcher):
+                yield batch
+        if validators is not None:
+            validators[url] = {
+                'etag': response.headers.get('ETag'),
+                'digests': batcher.digests}
+
+    @staticmethod
+    async def _stream_batches(response, batcher):
+        parser = JSONArrayParser()
+        try:
+            async for chunk in response.content.iter_any():
+                for batch in batcher.add(parser.feed(chunk)):
+                    yield batch
+                if batcher.replay:
+                    return
+            for batch in batcher.finish(parser.close()):
+                yield batch
+        finally:
+            if batcher.replay:
+                # We stopped reading part way, so the connection can't be
+                # reused.
+                response.close()
+            else:
+                response.release()
+
+    @property
+    def streaming(self):
+        """Whether this backend's responses can be parsed incrementally."""
+        return False
@@ -1,8 +1,12 @@
+import hashlib
+import json
+import threading
 from datetime import datetime
 from flask import current_app
+from flask_sqlalchemy import SignallingSession
 from stevedore import driver
 from stevedore.exception import NoMatches
-from sqlalchemy.orm import reconstructor
+from sqlalchemy.dialects import postgresql
 from opsy.flask_extensions import db
 from opsy.models import TimeStampMixin, OpsyQuery, NamedModel, BaseModel
 from opsy.monitoring.exceptions import BackendNotFound
@@ -41,8 +45,9 @@ class Event(BaseModel, TimeStampMixin, db.Model):
     occurrences = db.Column(db.BigInteger)
     command = db.Column(db.Text)
     output = db.Column(db.Text)
-    resolved = db.Column(db.Boolean(), default=False)
+    resolved = db.Column(db.Boolean(), default=False, nullable=False)
     resolved_at = db.Column(db.DateTime, default=None)
+    polled_at = db.Column(db.DateTime, default=None)
     extra = db.Column(db.JSON)
 
     monitoring_service = db.relationship('MonitoringService', backref='events',
@@ -56,7 +61,19 @@ class Event(BaseModel, TimeStampMixin, db.Model):
         db.CheckConstraint(status.in_(
             ['ok', 'warning', 'critical', 'unknown'])),
         db.CheckConstraint(state.in_(
-            ['new', 'acknowledged', 'resolved']))
+            ['new', 'acknowledged', 'resolved'])),
+        # A service can only have one unresolved event per host and check.
+        db.Index('monitoring_events_unresolved_uc',
+                 monitoring_service_id, host_name, check_name, unique=True,
+                 postgresql_where=~resolved, sqlite_where=~resolved),
+        # These back the events API and dashboards.
+        db.Index('monitoring_events_resolved_status_zone_name_idx',
+                 resolved, status, zone_name),
+        db.Index('monitoring_events_service_host_check_idx',
+                 monitoring_service_id, host_name, check_name),
+        # This backs archiving old resolved events.
+        db.Index('monitoring_events_resolved_resolved_at_idx',
+                 resolved, resolved_at)
     )
 
     def __init__(self, monitoring_service, **kwargs):
@@ -65,14 +82,179 @@ class Event(BaseModel, TimeStampMixin, db.Model):
         self.zone_name = getattr(monitoring_service.zone, 'name', None)
         super().__init__(**kwargs)
 
+    @classmethod
+    def upsert(cls, rows):
+        """
+        Insert or update a batch of unresolved events in bulk.
+
+        Every row needs the same keys. Rows are matched to unresolved events
+        by monitoring_service_id, host_name and check_name. On Postgres this
+        is one INSERT ... ON CONFLICT, otherwise it's an executemany UPDATE
+        for the events that exist and an executemany INSERT for the rest.
+        """
+        if not rows:
+            return
+        table = cls.__table__
+        # The key and anything an operator may have changed since the event
+        # was created are only set when the event is inserted.
+        update_columns = [x for x in rows[0] if x not in (
+            'id', 'monitoring_service_id', 'host_name', 'check_name',
+            'created_at', 'state', 'resolved', 'assignee_name')]
+        if db.session.bind.dialect.name == 'postgresql':
+            statement = postgresql.insert(table).values(rows)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.monitoring_service_id,
+                                table.c.host_name, table.c.check_name],
+                index_where=~table.c.resolved,
+                set_={x: statement.excluded[x] for x in update_columns})
+            db.session.execute(statement)
+            return
+        monitoring_service_ids = {x['monitoring_service_id'] for x in rows}
+        existing_ids = {
+            (x.monitoring_service_id, x.host_name, x.check_name): x.id
+            for x in db.session.query(
+                table.c.id, table.c.monitoring_service_id, table.c.host_name,
+                table.c.check_name).filter(
+                    table.c.monitoring_service_id.in_(monitoring_service_ids),
+                    table.c.host_name.in_({x['host_name'] for x in rows}),
+                    ~table.c.resolved)}
+        updates = []
+        inserts = []
+        for row in rows:
+            event_id = existing_ids.get(
+                (row['monitoring_service_id'], row['host_name'],
+                 row['check_name']))
+            if event_id is None:
+                inserts.append(row)
+            else:
+                updates.append(dict(
+                    {f'_{x}': row[x] for x in update_columns}, _id=event_id))
+        if updates:
+            db.session.execute(
+                table.update().where(table.c.id == db.bindparam('_id')).values(
+                    {x: db.bindparam(f'_{x}') for x in update_columns}),
+                updates)
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+
+    @classmethod
+    def resolve_unpolled(cls, monitoring_service_id, polled_at):
+        """
+        Resolve a service's unresolved events not seen since polled_at.
+
+        They're resolved as of polled_at, so resolved_at and polled_at are
+        both UTC.
+        """
+        return cls.query.filter(
+            cls.monitoring_service_id == monitoring_service_id,
+            ~cls.resolved,
+            db.or_(cls.polled_at.is_(None), cls.polled_at < polled_at)
+        ).update({'state': 'resolved', 'resolved': True,
+                  'resolved_at': polled_at}, synchronize_session=False)
+
+    @classmethod
+    def get_facets(cls, query):
+        """Counts the events in query by status, state and resolved."""
+        facets = {'status': {}, 'state': {}, 'resolved': {}}
+        for status, state, resolved, count in query.with_entities(
+                cls.status, cls.state, cls.resolved,
+                db.func.count(cls.id)).order_by(None).group_by(
+                    cls.status, cls.state, cls.resolved):
+            for name, value in [('status', status), ('state', state),
+                                ('resolved', str(resolved).lower())]:
+                facets[name][value] = facets[name].get(value, 0) + count
+        return facets
+
+    @classmethod
+    def archive_resolved(cls, before, batch_size=1000):
+        """
+        Move events resolved before the given time to the archive.
+
+        Events are moved batch_size at a time with each batch committed on
+        its own, so locks are only ever held on a small part of the table.
+        Returns how many events were archived.
+        """
+        table = cls.__table__
+        columns = [x.name for x in EventArchive.__table__.columns]
+        archived = 0
+        while True:
+            event_ids = [x.id for x in db.session.query(table.c.id).filter(
+                table.c.resolved, table.c.resolved_at < before).order_by(
+                    table.c.resolved_at).limit(batch_size)]
+            if not event_ids:
+                return archived
+            db.session.execute(EventArchive.__table__.insert().from_select(
+                columns, db.select([table.c[x] for x in columns]).where(
+                    table.c.id.in_(event_ids))))
+            db.session.execute(
+                table.delete().where(table.c.id.in_(event_ids)))
+            db.session.commit()
+            archived += len(event_ids)
+            if len(event_ids) < batch_size:
+                return archived
+
     def resolve(self, commit=True):
         current_app.logger.debug(f'Resolving event: {self}')
         self.state = 'resolved'
         self.resolved = True
-        self.resolved_at = datetime.now()
+        self.resolved_at = datetime.utcnow()
         return self.save() if commit else self
 
 
+class EventArchive(BaseModel, TimeStampMixin, db.Model):
+    """
+    Resolved events that have aged out of monitoring_events.
+
+    This has the same columns as monitoring_events but no foreign keys, so
+    history outlives the services, zones and hosts it's about. Rows are only
+    ever added and removed by resolved_at, which keeps it easy to partition
+    by time on Postgres.
+    """
+
+    __tablename__ = 'monitoring_events_archive'
+
+    monitoring_service_id = db.Column(db.String(36))
+    monitoring_service_name = db.Column(db.String(128))
+    zone_name = db.Column(db.String(128))
+    assignee_name = db.Column(db.String(36))
+    host_id = db.Column(db.String(36))
+    host_name = db.Column(db.String(128), index=True)
+    check_name = db.Column(db.String(128), index=True)
+    state = db.Column(db.String(16))
+    status = db.Column(db.String(16), nullable=False)
+    interval = db.Column(db.BigInteger)
+    occurrences = db.Column(db.BigInteger)
+    command = db.Column(db.Text)
+    output = db.Column(db.Text)
+    resolved = db.Column(db.Boolean(), default=True, nullable=False)
+    resolved_at = db.Column(db.DateTime, index=True)
+    polled_at = db.Column(db.DateTime)
+    extra = db.Column(db.JSON)
+
+    @classmethod
+    def prune(cls, before, batch_size=1000):
+        """
+        Delete archived events resolved before the given time.
+
+        Like Event.archive_resolved this works batch_size events at a time.
+        Returns how many events were deleted.
+        """
+        table = cls.__table__
+        deleted = 0
+        while True:
+            event_ids = [x.id for x in db.session.query(table.c.id).filter(
+                table.c.resolved_at < before).order_by(
+                    table.c.resolved_at).limit(batch_size)]
+            if not event_ids:
+                return deleted
+            db.session.execute(
+                table.delete().where(table.c.id.in_(event_ids)))
+            db.session.commit()
+            deleted += len(event_ids)
+            if len(event_ids) < batch_size:
+                return deleted
+
+
 class MonitoringService(NamedModel, TimeStampMixin, db.Model):
 
     __tablename__ = 'monitoring_services'
@@ -95,43 +277,93 @@ class MonitoringService(NamedModel, TimeStampMixin, db.Model):
         if zone:
             self.zone_id = zone.id
         if backend_name:
-            try:
-                self.backend = driver.DriverManager(
-                    namespace='opsy.monitoring.backend',
-                    name=backend_name, invoke_on_load=True,
-                    invoke_args=(self,),
-                    invoke_kwds=backend_config).driver
-                self.backend_config = self.backend.config
-            except NoMatches:
-                raise BackendNotFound(f'Unable to load backend {backend_name}')
+            # Let the backend fill in its defaults.
+            backend_config = backend_registry.get_class(backend_name)(
+                self, **(backend_config or {})).config
         else:
-            self.backend = None
-            self.backend_config = None
+            backend_config = None
         super().__init__(name, backend_name=backend_name,
                          backend_config=backend_config, **kwargs)
 
-    @reconstructor
-    def init_on_load(self):
+    @property
+    def backend(self):
         """
-        Load instance of backend manager here.
+        The backend instance for this service.
 
-        The idea is to have the args for creating the manager stored in the
-        backend_config column in the db. That way backends have quite a bit of
-        flexibility in defining their connection method.
+        The args for creating the backend are stored in the backend_config
+        column in the db. That way backends have quite a bit of flexibility in
+        defining their connection method. The backend is only created when
+        this is accessed, so loading services (or events) stays cheap.
         """
-        if self.backend_name:
+        if not self.backend_name:
+            return None
+        return backend_registry.get_backend(self)
+
+
+class BackendRegistry:
+    """
+    Process wide cache of monitoring backends.
+
+    Backend classes are resolved from the opsy.monitoring.backend entry
+    points once per name. One instance is cached per service, along with a
+    hash of the backend config it was created from, so it's replaced when
+    the config changes and dropped when the service is deleted.
+    """
+
+    namespace = 'opsy.monitoring.backend'
+
+    def __init__(self):
+        self._classes = {}
+        self._backends = {}
+        self._lock = threading.Lock()
+
+    def get_class(self, backend_name):
+        backend_class = self._classes.get(backend_name)
+        if backend_class is None:
             try:
-                self.backend = driver.DriverManager(
-                    namespace='opsy.monitoring.backend',
-                    name=self.backend_name, invoke_on_load=True,
-                    invoke_args=(self,),
-                    invoke_kwds=self.backend_config).driver
-                self.backend_config = self.backend.config
+                backend_class = driver.DriverManager(
+                    namespace=self.namespace, name=backend_name).driver
             except NoMatches:
-                raise BackendNotFound(
-                    f'Unable to load backend {self.backend_name}')
-        else:
-            self.backend = None
+                raise BackendNotFound(f'Unable to load backend {backend_name}')
+            with self._lock:
+                self._classes[backend_name] = backend_class
+        return backend_class
+
+    def get_backend(self, monitoring_service):
+        backend_config = monitoring_service.backend_config or {}
+        config_hash = hashlib.sha1(json.dumps(
+            [monitoring_service.backend_name, backend_config],
+            sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        cached = self._backends.get(monitoring_service.id)
+        if cached is not None and cached[0] == config_hash:
+            return cached[1]
+        backend = self.get_class(monitoring_service.backend_name)(
+            monitoring_service, **backend_config)
+        # Services that haven't been saved yet don't have an id to cache by.
+        if monitoring_service.id is not None:
+            with self._lock:
+                self._backends[monitoring_service.id] = (config_hash, backend)
+        return backend
+
+    def evict(self, monitoring_service_id):
+        with self._lock:
+            self._backends.pop(monitoring_service_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._classes.clear()
+            self._backends.clear()
+
+
+backend_registry = BackendRegistry()  # pylint: disable=invalid-name
+
+
+@db.event.listens_for(SignallingSession, 'after_flush')
+def evict_deleted_backends(session, flush_context):
+    """Drop the cached backends of services this flush deleted."""
+    for obj in session.deleted:
+        if isinstance(obj, MonitoringService):
+            backend_registry.evict(obj.id)
 
 
 class Dashboard(NamedModel, TimeStampMixin, db.Model):
@@ -149,3 +381,15 @@ class Dashboard(NamedModel, TimeStampMixin, db.Model):
 
     user = db.relationship('User', backref='monitoring_services',
                            query_class=OpsyQuery)
+
+    @classmethod
+    def get_events_query(cls, id_or_name):
+        """Returns a query for the events matching a dashboard's filters."""
+        dashboard = cls.get_by_id_or_name(id_or_name)
+        filters = {
+            'zone_name': dashboard.zone_filter,
+            'monitoring_service_name': dashboard.monitoring_service_filter,
+            'host_name': dashboard.host_filter,
+            'check_name': dashboard.check_filter}
+        return Event.query.filter_in(
+            **{key: value for key, value in filters.items() if value})
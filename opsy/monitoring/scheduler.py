@@ -0,0 +1,282 @@
+import asyncio
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import monotonic
+import aiohttp
+from opsy.flask_extensions import db
+from opsy.monitoring.backends.base import SessionPool
+from opsy.monitoring.exceptions import OpsyMonitoringError, PollFailure
+from opsy.monitoring.models import MonitoringService
+from opsy.monitoring.utils import prune_events
+
+DEFAULT_INTERVAL = 60
+
+
+class ScheduledService:
+    """The scheduler's view of a single monitoring service."""
+
+    def __init__(self, service_id, name, interval, next_poll):
+        self.id = service_id  # pylint: disable=invalid-name
+        self.name = name
+        self.interval = interval
+        self.next_poll = next_poll
+        self.failures = 0
+        self.polling = False
+        self.validators = {}
+
+
+class MonitoringScheduler:
+    """
+    Polls every enabled monitoring service on its own interval.
+
+    Fetching happens concurrently on a single asyncio loop, while decoding and
+    reconciling run in a thread pool inside an app context since they need
+    the database. A service is never polled again while a poll of it is still
+    running, and failed polls back off exponentially up to max_backoff. Old
+    resolved events are pruned every prune_interval seconds.
+    """
+
+    def __init__(self, app, concurrency=10, jitter=0.1, max_backoff=600,
+                 refresh_interval=30, pool_size=10, dns_cache_ttl=300,
+                 prune_interval=3600):
+        self.app = app
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.dns_cache_ttl = dns_cache_ttl
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.refresh_interval = refresh_interval
+        self.prune_interval = prune_interval
+        self.services = {}
+        self._loop = None
+        self._executor = None
+        self._semaphore = None
+        self._session_pool = None
+        self._stopping = None
+        self._thread = None
+
+    @classmethod
+    def from_app(cls, app):
+        config = app.config.opsy['monitoring']
+        return cls(app, concurrency=config['poller_concurrency'],
+                   jitter=config['poller_jitter'],
+                   max_backoff=config['poller_max_backoff'],
+                   refresh_interval=config['poller_refresh_interval'],
+                   pool_size=config['poller_pool_size'],
+                   dns_cache_ttl=config['poller_dns_cache_ttl'],
+                   prune_interval=config['prune_interval'])
+
+    def run(self):
+        """Run the scheduler in this thread until stop() is called."""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        main = self._loop.create_task(self._run())
+        try:
+            self._loop.run_until_complete(main)
+        finally:
+            # If we were interrupted _run never got to close the sessions, so
+            # stop it and close them while the loop is still open.
+            if not main.done():
+                main.cancel()
+                self._loop.run_until_complete(
+                    asyncio.gather(main, return_exceptions=True))
+            if self._session_pool is not None:
+                self._loop.run_until_complete(self._session_pool.close())
+            self._executor.shutdown(wait=True)
+            self._loop.close()
+
+    def start(self):
+        """Run the scheduler in a background thread."""
+        self._thread = threading.Thread(
+            target=self.run, name='opsy-monitoring-scheduler', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Ask the scheduler to stop once running polls finish."""
+        if self._loop and self._stopping:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        if self._thread:
+            self._thread.join()
+
+    async def _run(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._session_pool = SessionPool(
+            limit=self.pool_size, dns_cache_ttl=self.dns_cache_ttl)
+        self._stopping = asyncio.Event()
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        polls = set()
+        pruning = None
+        next_refresh = 0
+        next_prune = 0
+        while not stopping.done():
+            now = monotonic()
+            if now >= next_refresh:
+                try:
+                    await self._run_in_app(self._refresh_services)
+                except Exception:  # pylint: disable=broad-except
+                    self.app.logger.exception(
+                        'Unable to load monitoring services.')
+                next_refresh = now + self.refresh_interval
+            if self.prune_interval and now >= next_prune and (
+                    pruning is None or pruning.done()):
+                pruning = asyncio.ensure_future(self._prune())
+                next_prune = now + self.prune_interval
+            for service in self.services.values():
+                if not service.polling and service.next_poll <= now:
+                    service.polling = True
+                    polls.add(asyncio.ensure_future(self._poll(service)))
+            polls = {x for x in polls if not x.done()}
+            wake_times = [x.next_poll for x in self.services.values()
+                          if not x.polling]
+            wake_times.append(next_refresh)
+            if self.prune_interval:
+                wake_times.append(next_prune)
+            wake_at = min(wake_times)
+            # Finished polls wake us up too, so they're rescheduled on time.
+            await asyncio.wait(
+                polls | {stopping}, timeout=max(wake_at - monotonic(), 0.1),
+                return_when=asyncio.FIRST_COMPLETED)
+        if pruning and not pruning.done():
+            polls.add(pruning)
+        if polls:
+            await asyncio.wait(polls)
+        await self._session_pool.close()
+
+    async def _run_in_app(self, func, *args):
+        def run_in_app():
+            with self.app.app_context():
+                return func(*args)
+        return await self._loop.run_in_executor(self._executor, run_in_app)
+
+    async def _prune(self):
+        config = self.app.config.opsy['monitoring']
+        try:
+            await self._run_in_app(
+                prune_events, config['event_retention_days'],
+                config['archive_retention_days'], config['prune_batch_size'])
+        except Exception:  # pylint: disable=broad-except
+            self.app.logger.exception('Unable to prune monitoring events.')
+
+    def _refresh_services(self):
+        """Pick up services that were added, changed or disabled."""
+        now = monotonic()
+        services = {}
+        for service in MonitoringService.query.filter(
+                MonitoringService.enabled):
+            interval = service.interval or \
+                (service.backend_config or {}).get('interval') or \
+                DEFAULT_INTERVAL
+            scheduled = self.services.get(service.id)
+            if scheduled is None:
+                # Spread out the first polls so a restart doesn't poll
+                # everything at once.
+                if service.last_poll_time:
+                    since_poll = (
+                        datetime.utcnow() - service.last_poll_time
+                    ).total_seconds()
+                else:
+                    since_poll = interval
+                delay = max(interval - since_poll, 0)
+                scheduled = ScheduledService(
+                    service.id, service.name, interval,
+                    now + delay + random.uniform(0, interval * self.jitter))
+            scheduled.name = service.name
+            scheduled.interval = interval
+            services[service.id] = scheduled
+        self.services = services
+
+    def _mark_polled(self, service_id):
+        """Record a poll that found nothing had changed."""
+        service = MonitoringService.query.get(service_id)
+        if service is not None:
+            service.last_poll_time = datetime.utcnow()
+            db.session.commit()
+
+    def _reconcile(self, service_id, data):
+        service = MonitoringService.query.get(service_id)
+        if service is None or service.backend is None:
+            return
+        service.backend.reconcile(service.backend.decode(data))
+
+    def _upsert(self, service_id, events, polled_at):
+        service = MonitoringService.query.get(service_id)
+        service.backend.upsert_events(events, polled_at)
+        db.session.commit()
+
+    def _resolve(self, service_id, polled_at):
+        MonitoringService.query.get(service_id).backend.resolve_events(
+            polled_at)
+
+    async def _stream(self, service, backend, validators):
+        """
+        Reconcile a poll in batches as its response arrives.
+
+        Returns whether anything changed since the last poll.
+        """
+        polled_at = datetime.utcnow()
+        changed = False
+        batches = backend.stream(
+            self._session_pool.get(backend), backend.urls[0],
+            self.app.config.opsy['monitoring']['upsert_chunk_size'],
+            validators=validators)
+        try:
+            async for batch in batches:
+                changed = True
+                await self._run_in_app(
+                    self._upsert, service.id, batch, polled_at)
+        except (aiohttp.ClientError, ValueError) as error:
+            raise PollFailure(str(error)) from error
+        if changed:
+            await self._run_in_app(self._resolve, service.id, polled_at)
+        return changed
+
+    def _get_backend(self, service_id):
+        service = MonitoringService.query.get(service_id)
+        return service.backend if service else None
+
+    async def _poll(self, service):
+        delay = service.interval
+        try:
+            async with self._semaphore:
+                backend = await self._run_in_app(
+                    self._get_backend, service.id)
+                if backend is not None:
+                    # Only keep the new validators once the poll made it to
+                    # the database, otherwise we'd skip it next time.
+                    validators = dict(service.validators)
+                    if backend.streaming and len(backend.urls) == 1:
+                        changed = await self._stream(
+                            service, backend, validators)
+                    else:
+                        data = await backend.fetch(
+                            backend.urls, session_pool=self._session_pool,
+                            validators=validators)
+                        changed = data is not None
+                        if changed:
+                            await self._run_in_app(
+                                self._reconcile, service.id, data)
+                    if not changed:
+                        await self._run_in_app(
+                            self._mark_polled, service.id)
+                    service.validators = validators
+            service.failures = 0
+        except Exception as error:  # pylint: disable=broad-except
+            service.failures += 1
+            delay = min(service.interval * 2 ** service.failures,
+                        max(self.max_backoff, service.interval))
+            if isinstance(error, OpsyMonitoringError):
+                self.app.logger.error(
+                    'Failed to poll monitoring service %s, retrying in %ds: '
+                    '%s', service.name, delay, error)
+            else:
+                self.app.logger.exception(
+                    'Failed to poll monitoring service %s, retrying in %ds.',
+                    service.name, delay)
+        finally:
+            service.next_poll = monotonic() + delay * (
+                1 + random.uniform(-self.jitter, self.jitter))
+            service.polling = False
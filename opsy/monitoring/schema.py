@@ -1,6 +1,8 @@
 from marshmallow import RAISE
+from marshmallow import fields as ma_fields
+from marshmallow_sqlalchemy import field_for
 from opsy.flask_extensions import ma
-from opsy.schema import BaseSchema, Password
+from opsy.schema import BaseSchema, Hyperlinks, Password, PaginationMixin
 from opsy.monitoring.models import Dashboard, Event, MonitoringService
 
 
@@ -11,7 +13,7 @@ from opsy.monitoring.models import Dashboard, Event, MonitoringService
 class HttpPollerBackendSchema(BaseSchema):
     class Meta:
         fields = ('host', 'protocol', 'port', 'path', 'interval', 'timeout',
-                  'username', 'password', 'verify_ssl')
+                  'username', 'password', 'verify_ssl', 'validate_events')
         ordered = True
         unknown = RAISE
 
@@ -24,6 +26,7 @@ class HttpPollerBackendSchema(BaseSchema):
     username = ma.String()
     password = Password()
     verify_ssl = ma.Boolean()
+    validate_events = ma.Boolean()
 
 ###############################################################################
 # Sqlalchemy schemas
@@ -48,22 +51,78 @@ class EventSchema(BaseSchema):
     class Meta:
         model = Event
         fields = ('id', 'monitoring_service_id', 'monitoring_service_name',
-                  'zone_name', 'assignee_name', 'host_id'
-                  'host_name', 'check_name', 'state', 'status', 'interval',
-                  'interval', 'occurrences', 'command', 'output', 'resolved',
-                  'resolved_at', 'extra')
+                  'zone_name', 'assignee_name', 'host_id', 'host_name',
+                  'check_name', 'state', 'status', 'interval', 'occurrences',
+                  'command', 'output', 'resolved', 'resolved_at', 'extra',
+                  'created_at', 'updated_at', '_links')
         ordered = True
         unknown = RAISE
 
+    id = field_for(Event, 'id', dump_only=True,
+                   description='The ID of the event.')
+    created_at = field_for(Event, 'created_at', dump_only=True)
+    updated_at = field_for(Event, 'updated_at', dump_only=True)
+    _links = Hyperlinks(
+        {"self": ma.URLFor("monitoring_events.events_get", event_id="<id>"),
+         "collection": ma.URLFor("monitoring_events.events_list")},
+        dump_only=True
+    )
+
+
+class EventFacetsQuerySchema(EventSchema):
+
+    class Meta:
+        model = Event
+        fields = ('id', 'monitoring_service_id', 'monitoring_service_name',
+                  'zone_name', 'assignee_name', 'host_id', 'host_name',
+                  'check_name', 'state', 'status', 'resolved')
+        ordered = True
+        unknown = RAISE
+
+    id = field_for(Event, 'id', description='The ID of the event.')
+    status = ma_fields.String(
+        description='The status of the event: ok, warning, critical or '
+                    'unknown.')
+    state = ma_fields.String(
+        description='The state of the event: new, acknowledged or '
+                    'resolved.')
+    resolved = ma_fields.Boolean(
+        description='Whether the event has resolved.')
+
+
+class EventQuerySchema(PaginationMixin, EventFacetsQuerySchema):
+
+    class Meta:
+        model = Event
+        fields = ('id', 'monitoring_service_id', 'monitoring_service_name',
+                  'zone_name', 'assignee_name', 'host_id', 'host_name',
+                  'check_name', 'state', 'status', 'resolved', 'limit',
+                  'after', 'include_total')
+        ordered = True
+        unknown = RAISE
+
+
+class EventFacetsSchema(BaseSchema):
+
+    class Meta:
+        fields = ('status', 'state', 'resolved')
+        ordered = True
+
+    status = ma_fields.Dict(
+        description='The number of matching events with each status.')
+    state = ma_fields.Dict(
+        description='The number of matching events in each state.')
+    resolved = ma_fields.Dict(
+        description='The number of matching events that have and haven\'t '
+                    'resolved.')
+
 
 class DashboardSchema(BaseSchema):
 
     class Meta:
         model = Dashboard
-        fields = ('id', 'client_name', 'check_name', 'zone_name', 'zone_id',
-                  'backend', 'client_subscriptions', 'check_subscribers',
-                  'occurrences_threshold', 'occurrences', 'status', 'interval',
-                  'command', 'output', 'last_poll_time', 'updated_at',
-                  'silences')
+        fields = ('id', 'name', 'description', 'enabled', 'owner',
+                  'zone_filter', 'monitoring_service_filter', 'host_filter',
+                  'check_filter', 'created_at', 'updated_at')
         ordered = True
         unknown = RAISE
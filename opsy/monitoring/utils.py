@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from opsy.monitoring.models import Event, EventArchive
+
+
+def prune_events(retention_days, archive_retention_days=0, batch_size=1000):
+    """
+    Archive old resolved events and delete old archived ones.
+
+    Events resolved more than retention_days ago are archived, then archived
+    events older than archive_retention_days are deleted. Either step is
+    skipped when its retention is 0. Returns a tuple of how many events were
+    archived and deleted.
+    """
+    now = datetime.utcnow()
+    archived = deleted = 0
+    if retention_days:
+        archived = Event.archive_resolved(
+            now - timedelta(days=retention_days), batch_size=batch_size)
+    if archive_retention_days:
+        deleted = EventArchive.prune(
+            now - timedelta(days=archive_retention_days),
+            batch_size=batch_size)
+    current_app.logger.info(
+        f'Archived {archived} and deleted {deleted} monitoring events.')
+    return archived, deleted
@@ -0,0 +1,114 @@
+from flask import abort, Blueprint
+from flask_apispec import marshal_with, doc
+from opsy.flask_extensions import apispec
+from opsy.rbac import need_permission
+from opsy.schema import use_kwargs
+from opsy.monitoring.schema import (
+    EventSchema, EventQuerySchema, EventFacetsQuerySchema, EventFacetsSchema)
+from opsy.monitoring.models import Dashboard, Event
+from opsy.utils import get_pagination_headers
+
+
+def create_monitoring_views(app):
+    app.register_blueprint(
+        events_blueprint, url_prefix='/api/v1/monitoring/events')
+    app.register_blueprint(
+        dashboards_blueprint, url_prefix='/api/v1/monitoring/dashboards')
+    apispec.spec.tag(
+        {'name': 'monitoring',
+         'description': 'Events from your monitoring services.'})
+    for view in [events_list, events_facets, events_get]:
+        apispec.register(view, blueprint='monitoring_events')
+    apispec.register(dashboard_events_list, blueprint='monitoring_dashboards')
+
+###############################################################################
+# Blueprints
+###############################################################################
+
+
+# pylint: disable=invalid-name
+events_blueprint = Blueprint('monitoring_events', __name__)
+# pylint: disable=invalid-name
+dashboards_blueprint = Blueprint('monitoring_dashboards', __name__)
+
+###############################################################################
+# Event Views
+###############################################################################
+
+
+@events_blueprint.route('/', methods=['GET'])
+@use_kwargs(EventQuerySchema, locations=['query'])
+@marshal_with(EventSchema(many=True), code=200)
+@doc(
+    operationId='list_events',
+    summary='List events.',
+    description='',
+    tags=['monitoring'],
+    security=[{'api_key': []}])
+@need_permission('list_events')
+def events_list(limit=None, after=None, include_total=False, **kwargs):
+    query = Event.query.filter_in(**kwargs)
+    try:
+        page = query.keyset_paginate(
+            limit=limit, after=after, include_total=include_total)
+    except ValueError as error:
+        abort(400, str(error))
+    return page.items, 200, get_pagination_headers(page)
+
+
+@events_blueprint.route('/facets', methods=['GET'])
+@use_kwargs(EventFacetsQuerySchema, locations=['query'])
+@marshal_with(EventFacetsSchema(), code=200)
+@doc(
+    operationId='list_event_facets',
+    summary='Count events by status, state and resolved.',
+    description='',
+    tags=['monitoring'],
+    security=[{'api_key': []}])
+@need_permission('list_events')
+def events_facets(**kwargs):
+    return Event.get_facets(Event.query.filter_in(**kwargs))
+
+
+@events_blueprint.route('/<event_id>', methods=['GET'])
+@marshal_with(EventSchema(), code=200)
+@doc(
+    operationId='show_event',
+    summary='Show an event.',
+    description='',
+    tags=['monitoring'],
+    security=[{'api_key': []}])
+@need_permission('show_event')
+def events_get(event_id):
+    try:
+        return Event.get_by_id(event_id)
+    except ValueError as error:
+        abort(404, str(error))
+
+###############################################################################
+# Dashboard Views
+###############################################################################
+
+
+@dashboards_blueprint.route('/<id_or_name>/events', methods=['GET'])
+@use_kwargs(EventQuerySchema, locations=['query'])
+@marshal_with(EventSchema(many=True), code=200)
+@doc(
+    operationId='list_dashboard_events',
+    summary="List the events matching a dashboard's filters.",
+    description='',
+    tags=['monitoring'],
+    security=[{'api_key': []}])
+@need_permission('list_events')
+def dashboard_events_list(id_or_name, limit=None, after=None,
+                          include_total=False, **kwargs):
+    try:
+        query = Dashboard.get_events_query(id_or_name)
+    except ValueError as error:
+        abort(404, str(error))
+    try:
+        page = query.filter_in(**kwargs).keyset_paginate(
+            limit=limit, after=after, include_total=include_total)
+    except ValueError as error:
+        abort(400, str(error))
+    return page.items, 200, get_pagination_headers(page)
@@ -22,21 +22,28 @@ def has_permission(permission):
     def permission_checker(user):
         if current_app.config.get('LOGIN_DISABLED'):
             return True
-        permissions = []
+        auth_config = current_app.config.opsy['auth']
         # Everyone gets base permissions
-        permissions.extend(current_app.config.opsy['auth']['base_permissions'])
-        if user.is_authenticated and user.is_active:
-            # Logged in users get logged in permissions
-            permissions.extend(
-                current_app.config.opsy['auth']['logged_in_permissions'])
-            # And a user gets their own permissions from their roles
-            if hasattr(user, 'permissions'):
-                permissions.extend([x.name for x in user.permissions])
-        return permission in permissions
+        if permission in auth_config['base_permissions']:
+            return True
+        if not (user.is_authenticated and user.is_active):
+            return False
+        # Logged in users get logged in permissions
+        if permission in auth_config['logged_in_permissions']:
+            return True
+        # And a user gets their own permissions from their roles. These are
+        # resolved into a set once per user and kept with their cached token,
+        # so this doesn't depend on how many roles the user has.
+        return permission in getattr(user, 'permission_names', ())
 
     return permission_checker
 
 
+# Compiled requirements for every view decorated with need_permission, keyed
+# by the view's module and qualified name. Built once at decoration time.
+REQUIREMENT_TABLE = {}
+
+
 def need_permission(permission_name, *requirements, identity=None,
                     on_fail=None, throws=None):
     """Modified version of flask_allows requires decorator to tie into RBAC."""
@@ -48,11 +55,30 @@ def need_permission(permission_name, *requirements, identity=None,
             new_requirements = (Or(permission, *requirements),)
         else:
             new_requirements = (permission,)
+        rbac_info = {
+            'permission_needed': permission_name,
+            'requirements': new_requirements,
+            'checker': permission,
+            'permission_only': not requirements
+        }
+        REQUIREMENT_TABLE[
+            '{}.{}'.format(func.__module__, func.__qualname__)] = rbac_info
 
         @wraps(func)
         def allower(*args, **kwargs):
+            # Most views only need their permission, so when flask_allows has
+            # nothing extra to check we can go straight to the permission
+            # set. The identity comes from flask_allows' identity loader so
+            # both paths check the same user. Failures still go through
+            # flask_allows to be handled.
+            if rbac_info['permission_only'] and \
+                    not allows.additional.current and \
+                    allows.overrides.current is None:
+                user = identity or allows._identity_loader()  # pylint: disable=protected-access
+                if rbac_info['checker'](user):
+                    return func(*args, **kwargs)
             result = allows.run(
-                new_requirements,
+                rbac_info['requirements'],
                 identity=identity,
                 on_fail=on_fail,
                 throws=throws,
@@ -64,10 +90,6 @@ def need_permission(permission_name, *requirements, identity=None,
                 return result
             return func(*args, **kwargs)
 
-        rbac_info = {
-            'permission_needed': permission_name,
-            'requirements': new_requirements
-        }
         allower.__rbac__ = rbac_info
         return allower
     return decorator
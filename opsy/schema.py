@@ -1,6 +1,6 @@
 from flask_apispec import use_kwargs as api_spec_use_kwargs
 from flask_marshmallow.fields import _rapply, _url_val
-from marshmallow import post_load
+from marshmallow import post_load, validate
 from marshmallow import fields as ma_fields
 from opsy.flask_extensions import ma
 
@@ -51,6 +51,58 @@ class EmptySchema(ma.Schema):
     pass
 
 
+class PaginationMixin:
+    """Keyset pagination query parameters shared by the query schemas."""
+
+    limit = ma_fields.Integer(
+        validate=validate.Range(min=1),
+        description='The maximum number of results to return.')
+    after = ma_fields.String(
+        description='The cursor from the "next" link of the previous page.')
+    include_total = ma_fields.Boolean(
+        description='Return the total number of results in the '
+                    'X-Total-Count header.')
+
+
+class StreamingMixin:
+    """Query parameter to stream a list view instead of paginating it."""
+
+    stream = ma_fields.String(
+        validate=validate.OneOf(['ndjson', 'json']),
+        description='Stream every result as newline delimited JSON objects '
+                    '(ndjson) or as a chunked JSON array (json).')
+
+
+class BulkSchema(ma.Schema):
+    """A batch of objects to create or update."""
+
+    items = ma_fields.List(
+        ma_fields.Dict(), required=True, validate=validate.Length(min=1),
+        description='The objects, each the same as for a single request. '
+                    'Updates need the id of each object.')
+
+
+class BulkDeleteSchema(ma.Schema):
+    """A batch of objects to delete."""
+
+    items = ma_fields.List(
+        ma_fields.String(), required=True, validate=validate.Length(min=1),
+        description='The ids of the objects to delete.')
+
+
+class BulkResultSchema(ma.Schema):
+    """The outcome of one item of a bulk request."""
+
+    class Meta:
+        ordered = True
+
+    id = ma_fields.String(description='The ID of the object.')
+    status = ma_fields.String(
+        description='One of created, updated, deleted, invalid or '
+                    'not_found.')
+    error = ma_fields.Raw(description='Why the item failed, if it did.')
+
+
 ###############################################################################
 # Base schemas
 ###############################################################################
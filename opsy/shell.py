@@ -1,3 +1,4 @@
+import json
 import os
 from functools import partial
 import click
@@ -13,7 +14,11 @@ from opsy.auth.schema import AppPermissionSchema, UserSchema, RoleSchema
 from opsy.utils import (
     print_error, print_notice, get_protected_routes, get_valid_permissions)
 from opsy.auth.models import Role, User, Permission
-from opsy.inventory.models import Zone, Host, Group, HostGroupMapping
+from opsy.inventory.models import (
+    Zone, Host, Group, HostGroupMapping, create_vars_path_index)
+from opsy.inventory.utils import get_ansible_inventory
+from opsy.monitoring.scheduler import MonitoringScheduler
+from opsy.monitoring.utils import prune_events
 
 
 DEFAULT_CONFIG = os.environ.get(
@@ -58,6 +63,11 @@ def run(script_info, host, port, threads, ssl_enabled, certificate,
         app.config.opsy['server']['ca_certificate']
     server = create_server(app, host, port, threads, ssl_enabled, certificate,
                            private_key, ca_certificate)
+    scheduler = None
+    if app.config.opsy['monitoring']['poller_enabled']:
+        scheduler = MonitoringScheduler.from_app(app)
+        app.logger.info('Starting monitoring poller...')
+        scheduler.start()
     try:
         proto = 'https' if server.ssl_adapter else 'http'
         app.logger.info(f'Starting Opsy server at {proto}://{host}:{port}/...')
@@ -67,6 +77,42 @@ def run(script_info, host, port, threads, ssl_enabled, certificate,
         app.logger.info('Stopping Opsy server...')
     finally:
         server.stop()
+        if scheduler:
+            scheduler.stop()
+
+
+@cli.command('monitoring-poller')
+@pass_script_info
+def monitoring_poller(script_info):
+    """Poll monitoring services until stopped."""
+    app = script_info.load_app()
+    scheduler = MonitoringScheduler.from_app(app)
+    try:
+        app.logger.info('Starting monitoring poller...')
+        scheduler.run()
+    except KeyboardInterrupt:
+        app.logger.info('Stopping monitoring poller...')
+
+
+@cli.command('monitoring-prune')
+@click_option('--retention-days', type=click.INT,
+              help='Archive events resolved more than this many days ago.')
+@click_option('--archive-retention-days', type=click.INT,
+              help='Delete archived events older than this many days.')
+@click_option('--batch-size', type=click.INT,
+              help='Events to move or delete per transaction.')
+def monitoring_prune(retention_days, archive_retention_days, batch_size):
+    """Archive old resolved events and delete old archived ones."""
+    config = current_app.config.opsy['monitoring']
+    if retention_days is None:
+        retention_days = config['event_retention_days']
+    if archive_retention_days is None:
+        archive_retention_days = config['archive_retention_days']
+    archived, deleted = prune_events(
+        retention_days, archive_retention_days,
+        batch_size or config['prune_batch_size'])
+    print_notice(f'Archived {archived} events and deleted {deleted} '
+                 'archived events.')
 
 
 @cli.command('shell')
@@ -106,6 +152,25 @@ def init_db():
     db.session.commit()
 
 
+@db_command.command('index-vars')
+@click.argument('path')
+@with_appcontext
+def index_vars(path):
+    """Index a path into the host vars, like role, for filtering on it."""
+    if db.engine.dialect.name == 'postgresql':
+        print_notice('Postgres already indexes every path into the host '
+                     'vars.')
+        return
+    try:
+        created = create_vars_path_index(path)
+    except ValueError as error:
+        print_error(str(error))
+    if created:
+        print_notice(f'Indexed the "{path}" vars path.')
+    else:
+        print_notice(f'The "{path}" vars path is already indexed.')
+
+
 @cli.command('permission-list')
 @click_option('--resource', type=click.STRING)
 @click_option('--method', type=click.STRING)
@@ -152,6 +217,16 @@ def create_admin_user(password, force):
     print(RoleSchema().dumps(admin_role, indent=4))
 
 
+@cli.command('inventory-export')
+@click_option('--indent', type=click.INT, default=None,
+              help='Indent level for the JSON output.')
+def inventory_export(indent):
+    """Export the inventory in Ansible dynamic inventory format."""
+    inventory, _ = get_ansible_inventory()
+    Host.save_compiled_vars()
+    print(json.dumps(inventory, indent=indent))
+
+
 def main():
 
     def create_opsy_app(script_info):
@@ -2,7 +2,8 @@ import copy
 import sys
 from collections.abc import Mapping
 from operator import attrgetter
-from flask import current_app
+from flask import current_app, json, request, stream_with_context, Response
+from werkzeug.urls import url_encode
 
 
 def gwrap(some_string):
@@ -65,7 +66,12 @@ def merge_dict(dest, upd, recursive_update=True, merge_lists=False):
             elif isinstance(dest_subkey, list) and isinstance(val, list):
                 if merge_lists:
                     merged = copy.deepcopy(dest_subkey)
-                    merged.extend([x for x in val if x not in merged])
+                    try:
+                        seen = set(merged)
+                        merged.extend([x for x in val if x not in seen])
+                    except TypeError:
+                        # Unhashable items, fall back to a linear scan.
+                        merged.extend([x for x in val if x not in merged])
                     dest[key] = merged
                 else:
                     dest[key] = upd[key]
@@ -77,6 +83,84 @@ def merge_dict(dest, upd, recursive_update=True, merge_lists=False):
     return dest
 
 
+def get_pagination_headers(page):
+    """Returns the Link and X-Total-Count headers for a KeysetPage."""
+    headers = {}
+    if page.next_cursor:
+        args = request.args.copy()
+        args['after'] = page.next_cursor
+        headers['Link'] = \
+            f'<{request.base_url}?{url_encode(args)}>; rel="next"'
+    if page.total is not None:
+        headers['X-Total-Count'] = str(page.total)
+    return headers
+
+
+def get_vars_filters():
+    """
+    Returns the vars.<path> query args as filter_in kwargs.
+
+    Webargs only parses the fields a schema declares, so these are read from
+    the request.
+    """
+    return {key: ','.join(request.args.getlist(key))
+            for key in request.args if key.startswith('vars.')}
+
+
+def get_streaming_response(query, schema, stream_format, after=None,
+                           prepare=None, batch_size=500):
+    """
+    Stream a query's results one serialized row at a time.
+
+    Rows are fetched in keyset paginated batches so only a single batch is
+    ever held in memory, no matter how many rows the query matches. The
+    first batch is fetched up front so a bad cursor can still be reported
+    before the response starts. If given, prepare is called with each batch
+    before it is serialized.
+    """
+    page = query.keyset_paginate(limit=batch_size, after=after)
+
+    def generate(page):
+        first = True
+        if stream_format == 'json':
+            yield '['
+        while True:
+            if prepare:
+                prepare(page.items)
+            for item in page.items:
+                row = json.dumps(schema.dump(item))
+                if stream_format == 'json':
+                    yield row if first else f',{row}'
+                else:
+                    yield f'{row}\n'
+                first = False
+            if not page.next_cursor:
+                break
+            page = query.keyset_paginate(
+                limit=batch_size, after=page.next_cursor)
+        if stream_format == 'json':
+            yield ']'
+
+    mimetype = 'application/json' if stream_format == 'json' \
+        else 'application/x-ndjson'
+    return Response(stream_with_context(generate(page)), mimetype=mimetype)
+
+
+def iterencode_chunks(obj, chunk_size=65536):
+    """Encode obj as JSON, yielding chunks of roughly chunk_size."""
+    buffer = []
+    size = 0
+    for fragment in json.JSONEncoder().iterencode(obj):
+        buffer.append(fragment)
+        size += len(fragment)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
 def get_protected_routes(ignored_methods=None):
     if not ignored_methods:
         ignored_methods = []
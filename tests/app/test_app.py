@@ -4,6 +4,8 @@ import pytest
 import requests
 from flask import Flask
 from marshmallow import ValidationError
+from prometheus_client import REGISTRY
+from opsy.auth.utils import create_token
 from opsy.config import load_config
 from opsy.exceptions import NoConfigFile
 
@@ -85,3 +87,29 @@ def test_server(test_server):
     response = requests.get(f'http://{host}:{port}/docs/swagger.json')
     assert response.status_code == 200
     assert "It's Opsy!" in response.text
+
+
+def test_sql_instrumentation(app, client, admin_user, caplog):
+    """Make sure SQL statements are tracked per request."""
+    create_token(admin_user)
+    app.config.opsy['logging']['server_timing_enabled'] = True
+    app.config.opsy['logging']['slow_query_threshold'] = 0
+    labels = {'endpoint': 'inventory_zones.zones_list'}
+    before = REGISTRY.get_sample_value(
+        'opsy_request_sql_statements_count', labels) or 0
+    response = client.get(
+        '/api/v1/zones/',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    # Reset these since it's a session fixture.
+    app.config.opsy['logging']['server_timing_enabled'] = False
+    app.config.opsy['logging']['slow_query_threshold'] = None
+    assert response.status_code == 200
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert REGISTRY.get_sample_value(
+        'opsy_request_sql_statements_count', labels) == before + 1
+    assert REGISTRY.get_sample_value(
+        'opsy_request_sql_statements_sum', labels) > 0
+    # With a threshold of 0 every statement is a slow one.
+    assert 'Slow query' in caplog.text
+    assert 'inventory_zones.zones_list' in caplog.text
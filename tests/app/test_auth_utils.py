@@ -1,8 +1,10 @@
 from opsy.auth.utils import (login, logout, create_token, verify_token,
-                             load_user, load_user_from_request)
+                             load_user, load_user_from_request,
+                             get_token_cache, TokenCache)
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app
 from datetime import datetime
+from time import sleep, time
 
 
 def test_login(test_user, disabled_user):
@@ -104,3 +106,52 @@ def test_load_user_from_request(test_user):
     create_token(test_user)
     req = testRequest(headers={'X-AUTH-TOKEN': test_user.session_token})
     assert load_user_from_request(req) == test_user
+
+
+def test_token_cache(test_user, sql_statements):
+    token_cache = get_token_cache()
+    create_token(test_user)
+    token = test_user.session_token
+    assert load_user(token) == test_user
+    entry = token_cache.get(token)
+    assert entry.user_id == test_user.id
+    assert entry.permissions == test_user.permission_names
+    assert entry.columns['session_token'] == token
+    # A cached token doesn't need the database at all.
+    sql_statements.clear()
+    assert load_user(token) == test_user
+    assert not sql_statements
+    # Renewing the token drops the old one. Tokens issued in the same second
+    # are identical, so wait for the next one.
+    sleep(1)
+    create_token(test_user, force_renew=True)
+    assert test_user.session_token != token
+    assert token_cache.get(token) is None
+    assert load_user(token) is None
+    # So does logging out.
+    token = test_user.session_token
+    assert load_user(token) == test_user
+    logout(test_user)
+    assert token_cache.get(token) is None
+    assert load_user(token) is None
+    # Entries don't outlive the cache's size.
+    small_cache = TokenCache(max_size=1)
+    small_cache.set('token1', 'user1', time() + 60, [])
+    small_cache.set('token2', 'user2', time() + 60, [])
+    assert small_cache.get('token1') is None
+    assert small_cache.get('token2').user_id == 'user2'
+    # Or the token's own expiry.
+    small_cache.set('token3', 'user3', time() - 1, [])
+    assert small_cache.get('token3') is None
+
+
+def test_token_cache_disabled_user(test_user):
+    create_token(test_user)
+    token = test_user.session_token
+    assert load_user(token).is_active
+    assert get_token_cache().get(token)
+    # Disabling a user has to take effect right away, not when the cached
+    # token expires.
+    test_user.update(enabled=False)
+    assert get_token_cache().get(token) is None
+    assert not load_user(token).is_active
@@ -0,0 +1,308 @@
+import asyncio
+import json
+from datetime import datetime
+import pytest
+from aiohttp import web
+from marshmallow import ValidationError
+from aiohttp.test_utils import TestServer
+from opsy.monitoring.backends.base import (EventBatcher, JSONArrayParser,
+                                           SessionPool)
+from opsy.monitoring.backends.sensu import SensuBackend
+
+
+def run(coroutine):
+    """Run coroutine on its own event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def sensu_event(host_name, check_name, status=0, **kwargs):
+    """Returns a raw Sensu event."""
+    return dict({
+        'client': {'name': host_name},
+        'check': {'name': check_name, 'status': status,
+                  'command': check_name, 'output': 'OK'},
+        'occurrences': 1, 'timestamp': 1500000000}, **kwargs)
+
+
+async def serve_events(server_state):
+    """
+    Start a fake Sensu API serving server_state['events'].
+
+    The ETag in server_state is sent when it's set, and If-None-Match is
+    honoured. Every request is recorded in server_state['requests'].
+    """
+
+    async def events(request):
+        server_state['requests'].append(dict(request.headers))
+        etag = server_state.get('etag')
+        if etag and request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304)
+        return web.Response(
+            body=json.dumps(server_state['events']).encode('utf-8'),
+            content_type='application/json',
+            headers={'ETag': etag} if etag else {})
+
+    app = web.Application()
+    app.router.add_get('/events', events)
+    server = TestServer(app, host='127.0.0.1')
+    await server.start_server()
+    return server
+
+
+###############################################################################
+# Conditional Fetch Tests
+###############################################################################
+
+
+def test_fetch_not_modified():
+    """Make sure polls are skipped on a 304 or an unchanged payload."""
+    server_state = {'events': [sensu_event('host1', 'check_cpu')],
+                    'etag': '"1"', 'requests': []}
+
+    async def fetch_all():
+        server = await serve_events(server_state)
+        backend = SensuBackend(None, host=server.host, port=server.port)
+        validators = {}
+        results = []
+        try:
+            # The first poll gets everything and remembers the ETag.
+            results.append(await backend.fetch(
+                backend.urls, validators=validators))
+            results.append(dict(validators[backend.urls[0]]))
+            # Then the server says nothing changed.
+            results.append(await backend.fetch(
+                backend.urls, validators=validators))
+            # Without ETags the payload hash tells us nothing changed.
+            server_state['etag'] = None
+            results.append(await backend.fetch(
+                backend.urls, validators=validators))
+            # But we still see changes.
+            server_state['events'].append(sensu_event('host1', 'check_mem'))
+            results.append(await backend.fetch(
+                backend.urls, validators=validators))
+        finally:
+            await server.close()
+        return results
+
+    data, validator, not_modified, unchanged, changed = run(fetch_all())
+    assert data == [server_state['events'][:1]]
+    assert validator['etag'] == '"1"'
+    assert validator['digest']
+    assert not_modified is None
+    assert server_state['requests'][1]['If-None-Match'] == '"1"'
+    assert unchanged is None
+    assert changed == [server_state['events']]
+    assert len(server_state['requests']) == 4
+
+
+###############################################################################
+# Streaming Tests
+###############################################################################
+
+
+def test_json_array_parser():
+    """Make sure arrays are parsed the same however they're split up."""
+    items = [{'name': 'quote "[]" \\', 'list': [1, {'a': ']'}]}, 'a,b',
+             12345, -1.5e3, True, None, [], {'\u00e9': 'caf\u00e9'}]
+    payload = json.dumps(items).encode('utf-8')
+    for size in [1, 2, 3, 7, len(payload)]:
+        parser = JSONArrayParser()
+        parsed = []
+        for index in range(0, len(payload), size):
+            parsed.extend(parser.feed(payload[index:index + size]))
+        parsed.extend(parser.close())
+        assert [x[0] for x in parsed] == items
+        # The source text of each item is kept for hashing.
+        assert [json.loads(x[1]) for x in parsed] == items
+    # Multi-byte characters split between chunks are fine.
+    parser = JSONArrayParser()
+    payload = '["caf\u00e9"]'.encode('utf-8')
+    assert parser.feed(payload[:5]) == []
+    assert parser.feed(payload[5:]) == [('caf\u00e9', '"caf\u00e9"')]
+    assert parser.close() == []
+    assert JSONArrayParser().feed(b' [ ] ', final=True) == []
+
+
+def test_json_array_parser_invalid():
+    """Make sure truncated or invalid payloads raise ValueError."""
+    for payload in [b'[{"a": 1}, {"a": ', b'[1, 2', b'["a]', b'{"a": 1}', b'',
+                    b'[1] 2']:
+        parser = JSONArrayParser()
+        with pytest.raises(ValueError):
+            parser.feed(payload)
+            parser.close()
+
+
+def batch_events(items, batch_size=2, last_digests=None, chunk_size=1):
+    """Run items through an EventBatcher a few at a time."""
+    batcher = EventBatcher(lambda x: x if x != 'skip' else None, batch_size,
+                           last_digests)
+    batches = []
+    for index in range(0, len(items), chunk_size):
+        batches.extend(batcher.add(
+            [(x, json.dumps(x)) for x in items[index:index + chunk_size]]))
+    batches.extend(batcher.finish())
+    return batcher, batches
+
+
+def test_event_batcher():
+    """Make sure batches are only returned when the events changed."""
+    items = ['a', 'b', 'skip', 'c', 'd', 'e']
+    batcher, batches = batch_events(items)
+    assert batches == [['a', 'b'], ['c', 'd'], ['e']]
+    assert len(batcher.digests) == 3
+    assert not batcher.replay
+    last_digests = batcher.digests
+    # Nothing is returned when every batch matches.
+    batcher, batches = batch_events(items, last_digests=last_digests)
+    assert batches == []
+    assert batcher.digests == last_digests
+    assert not batcher.replay
+    # When only the last batch differs the dropped ones have to be read
+    # again.
+    batcher, batches = batch_events(
+        items[:-1] + ['f'], last_digests=last_digests)
+    assert batches == []
+    assert batcher.replay
+    # Same when there are fewer batches than last time.
+    batcher, batches = batch_events(items[:4], last_digests=last_digests)
+    assert batches == []
+    assert batcher.replay
+    # And when there are more.
+    batcher, batches = batch_events(
+        items + ['f', 'g'], last_digests=last_digests)
+    assert batches == []
+    assert batcher.replay
+    # If the first batch differs nothing was dropped, so batches are
+    # returned as soon as they're full.
+    batcher = EventBatcher(lambda x: x, 2, last_digests)
+    assert batcher.add([('z', '"z"'), ('b', '"b"')]) == [['z', 'b']]
+    assert batcher.add([('c', '"c"'), ('d', '"d"')]) == [['c', 'd']]
+    assert batcher.finish([('e', '"e"')]) == [['e']]
+    assert not batcher.replay
+    # Items after a replay is needed aren't even decoded.
+    decoded = []
+
+    def decode_item(item):
+        decoded.append(item)
+        return item if item != 'skip' else None
+
+    batcher = EventBatcher(decode_item, 2, last_digests)
+    assert batcher.add([(x, json.dumps(x)) for x in [
+        'a', 'b', 'skip', 'x', 'd', 'e']]) == []
+    assert batcher.replay
+    assert decoded == ['a', 'b', 'skip', 'x', 'd']
+
+
+def test_stream(app):
+    """Make sure streamed polls reconcile everything that changed."""
+    server_state = {'events': [sensu_event('host1', f'check_{x}')
+                               for x in range(5)], 'requests': []}
+
+    async def stream_all(backend, validators):
+        batches = []
+        async with backend._create_session() as session:
+            async for batch in backend.stream(
+                    session, backend.urls[0], 2, validators=validators):
+                batches.append([x['check_name'] for x in batch])
+        return batches
+
+    async def poll_all():
+        server = await serve_events(server_state)
+        backend = SensuBackend(None, host=server.host, port=server.port)
+        validators = {}
+        polls = []
+        try:
+            polls.append(await stream_all(backend, validators))
+            # Nothing changed, so nothing's reconciled.
+            polls.append(await stream_all(backend, validators))
+            # The last event changed, so everything's read again.
+            server_state['events'][-1]['check']['status'] = 2
+            polls.append(await stream_all(backend, validators))
+            # The first event changed, so it's all reconciled in one read.
+            server_state['events'][0]['check']['status'] = 2
+            polls.append(await stream_all(backend, validators))
+        finally:
+            await server.close()
+        return polls
+
+    checks = [['check_0', 'check_1'], ['check_2', 'check_3'], ['check_4']]
+    assert run(poll_all()) == [checks, [], checks, checks]
+    assert len(server_state['requests']) == 5
+
+
+###############################################################################
+# Sensu Decoding Tests
+###############################################################################
+
+
+def test_sensu_decode_parity(app):
+    """Make sure decode_event gives the same events as SensuEventSchema."""
+    raw_events = [
+        sensu_event('host1', 'check_cpu'),
+        sensu_event('host1', 'check_disk', status=1),
+        sensu_event('host1', 'check_mem', status=2),
+        sensu_event('host1', 'check_load', status=3),
+        sensu_event('host1', 'check_silenced', silenced=True),
+        sensu_event('host1', 'check_not_silenced', silenced=False),
+        sensu_event('host1', 'check_string_timestamp', timestamp='1500000000'),
+        sensu_event('host1', 'check_no_timestamp', timestamp=None),
+        sensu_event('host1', 'check_bad_timestamp', timestamp='soon'),
+        {'client': {'name': 'host2'},
+         'check': {'name': 'check_bare', 'status': 0}}]
+    events = SensuBackend(None).decode([raw_events])
+    validated_events = SensuBackend(None, validate_events=True).decode(
+        [raw_events])
+    assert events == validated_events
+    assert [x['check_name'] for x in events] == [
+        'check_cpu', 'check_disk', 'check_mem', 'check_load',
+        'check_not_silenced', 'check_string_timestamp', 'check_no_timestamp',
+        'check_bad_timestamp', 'check_bare']
+    assert [x['status'] for x in events[:4]] == [
+        'ok', 'warning', 'critical', 'unknown']
+    assert events[0]['updated_at'] == events[5]['updated_at'] == \
+        datetime(2017, 7, 14, 2, 40)
+    # Missing keys still come back, so every event has the same ones.
+    assert events[-1] == {
+        'host_name': 'host2', 'check_name': 'check_bare',
+        'status': 'ok', 'command': None, 'output': None,
+        'occurrences': None, 'updated_at': None}
+    assert all(set(x) == set(events[-1]) for x in events)
+    # Events without a status are unknown, but only when not validating.
+    raw_events = [{'client': {'name': 'host2'},
+                   'check': {'name': 'check_no_status'}}]
+    assert SensuBackend(None).decode([raw_events])[0]['status'] == 'unknown'
+    with pytest.raises(ValidationError):
+        SensuBackend(None, validate_events=True).decode([raw_events])
+
+
+###############################################################################
+# SessionPool Tests
+###############################################################################
+
+
+def test_session_pool():
+    """Make sure backends for the same server share a session."""
+
+    async def get_sessions():
+        pool = SessionPool()
+        sessions = [pool.get(SensuBackend(None, host='sensu1')),
+                    pool.get(SensuBackend(None, host='sensu1')),
+                    pool.get(SensuBackend(None, host='sensu2')),
+                    pool.get(SensuBackend(None, host='sensu1', timeout=5))]
+        await pool.close()
+        # Closed sessions are replaced the next time they're asked for.
+        new_session = pool.get(SensuBackend(None, host='sensu1'))
+        await pool.close()
+        return sessions, new_session
+
+    sessions, new_session = run(get_sessions())
+    assert sessions[0] is sessions[1]
+    assert len({id(x) for x in sessions}) == 3
+    assert all(x.closed for x in sessions)
+    assert new_session is not sessions[0]
+    assert new_session.closed
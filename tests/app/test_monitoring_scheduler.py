@@ -0,0 +1,136 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from time import monotonic, sleep
+import pytest
+from opsy.monitoring.backends.base import SessionPool
+from opsy.monitoring.exceptions import PollFailure
+from opsy.monitoring.models import MonitoringService
+from opsy.monitoring.scheduler import MonitoringScheduler, ScheduledService
+
+
+class FakeBackend:
+    """Stands in for a backend, counting its fetches."""
+
+    streaming = False
+    urls = ['http://localhost/events']
+
+    def __init__(self, fail=False, delay=0, data=None):
+        self.fail = fail
+        self.delay = delay
+        self.data = data
+        self.fetches = 0
+        self.running = 0
+        self.max_running = 0
+
+    async def fetch(self, urls, session_pool=None, validators=None):
+        self.fetches += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise PollFailure('Unable to connect.')
+            if validators is not None:
+                validators[self.urls[0]] = {'etag': str(self.fetches)}
+            return self.data
+        finally:
+            self.running -= 1
+
+
+def poll(scheduler, service):
+    """Run a single poll of service."""
+
+    async def run_poll():
+        scheduler._semaphore = asyncio.Semaphore(1)
+        await scheduler._poll(service)
+
+    scheduler._loop = asyncio.new_event_loop()
+    scheduler._executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        scheduler._loop.run_until_complete(run_poll())
+    finally:
+        scheduler._executor.shutdown(wait=True)
+        scheduler._loop.close()
+
+
+def test_scheduler_backoff(app, mocker):
+    """Make sure failed polls back off up to max_backoff."""
+    backend = FakeBackend(fail=True)
+    mocker.patch.object(MonitoringScheduler, '_get_backend',
+                        return_value=backend)
+    mark_polled = mocker.patch.object(MonitoringScheduler, '_mark_polled')
+    scheduler = MonitoringScheduler(app, jitter=0, max_backoff=40)
+    service = ScheduledService('fake', 'fake', 10, 0)
+    # Each failure doubles the delay until it hits max_backoff.
+    for failures, delay in [(1, 20), (2, 40), (3, 40)]:
+        poll(scheduler, service)
+        assert service.failures == failures
+        assert service.next_poll - monotonic() == pytest.approx(delay, abs=1)
+        assert service.polling is False
+    mark_polled.assert_not_called()
+    # Once the backend is back we go back to the normal interval.
+    backend.fail = False
+    poll(scheduler, service)
+    assert service.failures == 0
+    assert service.next_poll - monotonic() == pytest.approx(10, abs=1)
+    # Nothing changed, but the poll still counts as one.
+    mark_polled.assert_called_once_with('fake')
+
+
+def test_scheduler_validators(app, mocker):
+    """Make sure validators are only kept once a poll is stored."""
+    mocker.patch.object(MonitoringScheduler, '_get_backend',
+                        return_value=FakeBackend(data=[[]]))
+    reconcile = mocker.patch.object(
+        MonitoringScheduler, '_reconcile', side_effect=Exception('No DB'))
+    scheduler = MonitoringScheduler(app, jitter=0)
+    service = ScheduledService('fake', 'fake', 10, 0)
+    # If we kept these the next poll would think nothing changed, and the
+    # events would never be stored.
+    poll(scheduler, service)
+    assert service.failures == 1
+    assert service.validators == {}
+    reconcile.side_effect = None
+    poll(scheduler, service)
+    assert service.failures == 0
+    assert service.validators == {FakeBackend.urls[0]: {'etag': '2'}}
+    reconcile.assert_called_with('fake', [[]])
+
+
+def test_scheduler_no_overlap(app, mocker):
+    """Make sure a service isn't polled again while it's still polling."""
+    backend = FakeBackend(delay=0.2)
+    mocker.patch.object(MonitoringScheduler, '_get_backend',
+                        return_value=backend)
+    mocker.patch.object(MonitoringScheduler, '_mark_polled')
+    mocker.patch.object(MonitoringScheduler, '_refresh_services')
+    scheduler = MonitoringScheduler(app, jitter=0, prune_interval=0)
+    # The interval is much shorter than a poll takes.
+    scheduler.services = {'fake': ScheduledService('fake', 'fake', 0.01, 0)}
+    scheduler.start()
+    sleep(1)
+    scheduler.stop()
+    assert backend.fetches >= 3
+    assert backend.max_running == 1
+
+
+def test_scheduler_interrupted(app, mocker):
+    """Make sure the sessions are closed when the scheduler is interrupted."""
+    close = mocker.patch.object(SessionPool, 'close',
+                                new_callable=mocker.AsyncMock)
+    mocker.patch.object(MonitoringScheduler, '_refresh_services',
+                        side_effect=KeyboardInterrupt)
+    scheduler = MonitoringScheduler(app, prune_interval=0)
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run()
+    close.assert_awaited_once()
+    assert scheduler._loop.is_closed()
+
+
+def test_scheduler_mark_polled(app, db_session):
+    """Make sure polls that found nothing changed update last_poll_time."""
+    service = MonitoringService.create('fakesensu')
+    assert service.last_poll_time is None
+    MonitoringScheduler(app)._mark_polled(service.id)
+    assert datetime.utcnow() - service.last_poll_time < timedelta(minutes=1)
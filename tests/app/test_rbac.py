@@ -2,8 +2,9 @@ import flask
 import pytest
 from flask_login import AnonymousUserMixin
 from werkzeug.exceptions import Forbidden
+from opsy.flask_extensions import allows
 from opsy.rbac import (is_logged_in, is_same_user, has_permission,
-                       need_permission)
+                       need_permission, REQUIREMENT_TABLE)
 
 
 def test_is_logged_in(app, test_user):
@@ -72,6 +73,13 @@ def test_has_permission(app, test_user, test_role):
     test_role.add_permission('test')
     # This should pass since the user is in a role with this permission
     assert test_permission(test_user) is True
+    assert 'test' in test_user.permission_names
+    # The user's permission set should follow changes to their roles
+    test_role.remove_permission('test')
+    assert test_permission(test_user) is False
+    test_role.add_permission('test')
+    test_role.remove_user(test_user)
+    assert test_permission(test_user) is False
 
 
 def test_need_permission(app, test_user, test_role):
@@ -113,3 +121,35 @@ def test_need_permission(app, test_user, test_role):
     assert test_decorated() == 'test function'
     # That last one will throw deprecation warnings until this is merged:
     # https://github.com/justanr/flask-allows/pull/45
+
+
+def test_need_permission_identity_loader(app, test_user, test_role, mocker):
+    """Make sure need_permission checks the identity loader's user."""
+
+    def test_func():
+        return 'test function'
+
+    test_decorated = need_permission('test')(test_func)
+    # The compiled requirements should be in the table as soon as the
+    # function is decorated.
+    assert REQUIREMENT_TABLE[
+        '{}.{}'.format(test_func.__module__, test_func.__qualname__)] is \
+        test_decorated.__rbac__
+    assert test_decorated.__rbac__['permission_only'] is True
+    test_role.add_user(test_user)
+    test_role.add_permission('test')
+    # current_user is anonymous here, so this only passes if the identity
+    # loader's user is the one checked.
+    mocker.patch.object(allows, '_identity_loader', return_value=test_user)
+    assert test_decorated() == 'test function'
+    # The same user should be checked when there are extra requirements.
+    test_decorated = need_permission('test2', is_logged_in)(test_func)
+    assert test_decorated.__rbac__['permission_only'] is False
+    assert test_decorated() == 'test function'
+    # And both paths should deny an identity without the permission.
+    mocker.patch.object(allows, '_identity_loader',
+                        return_value=AnonymousUserMixin())
+    with pytest.raises(Forbidden):
+        need_permission('test')(test_func)()
+    with pytest.raises(Forbidden):
+        test_decorated()
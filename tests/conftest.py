@@ -1,10 +1,12 @@
 import threading
 import time
 import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from opsy.app import create_app
 from opsy.config import load_config
 from opsy.server import create_server
-from tests.data import auth, inventory
+from tests.data import auth, inventory, monitoring
 from opsy.flask_extensions import db as opsy_db
 
 
@@ -45,6 +47,19 @@ def test_server(app):
     server.stop()
 
 
+@pytest.fixture(scope='function')
+def sql_statements():
+    """Records every SQL statement executed while the test runs."""
+    statements = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', record_statement)
+    yield statements
+    event.remove(Engine, 'before_cursor_execute', record_statement)
+
+
 ###############################################################################
 # Auth Fixtures
 ###############################################################################
@@ -127,6 +142,12 @@ def test_hosts(db_session):
     return inventory.test_hosts()
 
 
+@pytest.fixture(scope='function')
+def test_large_zone(db_session):
+    """Creates a zone with 10k hosts."""
+    return inventory.test_large_zone()
+
+
 @pytest.fixture(scope='function')
 def test_inventory_bootstrap(db_session, mocker):
     """Creates a test inventory environment."""
@@ -137,3 +158,14 @@ def test_inventory_bootstrap(db_session, mocker):
     # here.
     mocker.patch.object(db_session, 'remove', lambda: None)
     return inventory.test_inventory_bootstrap()
+
+
+###############################################################################
+# Monitoring Fixtures
+###############################################################################
+
+
+@pytest.fixture(scope='function')
+def test_monitoring_bootstrap(test_inventory_bootstrap):
+    """Creates test events for the test inventory."""
+    return monitoring.test_monitoring_bootstrap()
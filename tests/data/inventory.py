@@ -1,4 +1,5 @@
 from faker import Faker
+from opsy.flask_extensions import db
 from opsy.inventory.models import Zone, Group, Host
 
 
@@ -84,3 +85,13 @@ def test_inventory_bootstrap():
             prom.add_group(west_default)
             consul.add_group(west_default)
     return True
+
+
+def test_large_zone(name='large', number=10000):
+    """Creates a zone with a lot of hosts in it, skipping the ORM."""
+    zone = Zone.create(name=name)
+    db.session.bulk_insert_mappings(
+        Host, [{'name': f'{name}{x:05d}', 'zone_id': zone.id}
+               for x in range(0, number)])
+    db.session.commit()
+    return zone
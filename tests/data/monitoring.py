@@ -0,0 +1,22 @@
+from opsy.flask_extensions import db
+from opsy.inventory.models import Host, Zone
+from opsy.monitoring.models import Dashboard, Event, MonitoringService
+
+
+def test_monitoring_bootstrap():
+    """Populates the DB with events for the test inventory's hosts."""
+    checks = [('check_cpu', 'ok'), ('check_disk', 'warning'),
+              ('check_mem', 'critical')]
+    for zone in Zone.query.filter(Zone.name.in_(['west', 'central', 'east'])):
+        service = MonitoringService.create(f'{zone.name}sensu', zone=zone)
+        for host in Host.query.filter_by(zone_id=zone.id):
+            for check_name, status in checks:
+                db.session.add(Event(
+                    service, host_id=host.id, host_name=host.name,
+                    check_name=check_name, status=status))
+    db.session.commit()
+    Event.query.filter_by(
+        host_name='eastconsul', check_name='check_mem').first().resolve()
+    Dashboard.create(
+        'west_dashboard', zone_filter='west',
+        check_filter='check_cpu,check_disk')
@@ -94,6 +94,30 @@ def test_opsy_query(test_user, test_users, test_inventory_bootstrap):
         assert isinstance(node, Host)
         assert node not in [westprom, centralprom, eastprom]
 
+    # Test keyset_paginate walks every host exactly once.
+    page = Host.query.keyset_paginate(limit=4, include_total=True)
+    assert page.total == 6
+    assert len(page.items) == 4
+    assert page.next_cursor is not None
+    next_page = Host.query.keyset_paginate(limit=4, after=page.next_cursor)
+    assert len(next_page.items) == 2
+    assert next_page.next_cursor is None
+    assert [x.name for x in page.items + next_page.items] == sorted(
+        x.name for x in Host.query.all())
+    # Groups share names across zones, so id has to break the tie.
+    group_ids = []
+    cursor = None
+    while True:
+        page = Group.query.filter_in(name='prom_nodes').keyset_paginate(
+            limit=1, after=cursor)
+        group_ids.extend([x.id for x in page.items])
+        cursor = page.next_cursor
+        if not cursor:
+            break
+    assert len(group_ids) == len(set(group_ids)) == 4
+    with pytest.raises(ValueError):
+        Host.query.keyset_paginate(after='notacursor')
+
 
 ###############################################################################
 # BaseModel
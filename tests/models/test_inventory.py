@@ -1,5 +1,9 @@
 import pytest
-from opsy.inventory.models import Host, Group, Zone, HostGroupMapping
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from opsy.flask_extensions import db
+from opsy.inventory.models import (
+    Host, Group, GroupClosure, Zone, HostGroupMapping, create_vars_path_index)
 from opsy.exceptions import DuplicateError
 
 
@@ -126,11 +130,12 @@ def test_host_model(test_host, test_group, test_inventory_bootstrap):
                                        'shutup': 'sam',
                                        'default': True}
     # Let's add a parent group in the same zone and check that the variables
-    # get applied
+    # get applied, along with those of the parent's own parent
     west_default_group.update(parent_id=west_prom_group.id)
     assert test_host.compiled_vars == {'datacenter': 'west',
                                        'prom_node': 'truewestprom',
                                        'prom_region': 'west',
+                                       'thanos': True,
                                        'test': True,
                                        'shutup': 'sam',
                                        'default': True}
@@ -166,6 +171,120 @@ def test_host_model(test_host, test_group, test_inventory_bootstrap):
         test_host.change_group_priority(west_default_group, 100)
 
 
+def test_host_compile_vars_bulk(test_inventory_bootstrap):
+    """Make sure bulk compiled vars match compiling each host by itself."""
+    hosts = Host.query.all()
+    compiled = Host.compile_vars_bulk(hosts)
+    assert len(compiled) == 6
+    for host in hosts:
+        assert compiled[host.id] == host.compile_vars()
+    # Precompiled vars should be used for exactly one read.
+    westprom = Host.query.filter_by(name='westprom').first()
+    Host.precompile_vars([westprom])
+    assert westprom.compiled_vars == westprom.compile_vars()
+    assert '_precompiled_vars' not in westprom.__dict__
+    # They're only materialized once the session is done with.
+    assert westprom.compiled_vars_cache is None
+    Host.save_compiled_vars()
+    assert westprom.compiled_vars_cache == westprom.compile_vars()
+    westprom.update(vars={'consul_node': 'somewhere_else'})
+    assert westprom.compiled_vars['consul_node'] == 'somewhere_else'
+
+
+def test_host_compiled_vars_cache(test_inventory_bootstrap):
+    """Make sure the materialized vars are invalidated when they should be."""
+    westprom = Host.query.filter_by(name='westprom').first()
+    eastprom = Host.query.filter_by(name='eastprom').first()
+
+    def cache_vars():
+        for host in [westprom, eastprom]:
+            host.update(compiled_vars_cache=host.compile_vars())
+        assert westprom.compiled_vars_cache is not None
+        assert eastprom.compiled_vars_cache is not None
+
+    # Storing the cache shouldn't invalidate itself, and should be used.
+    cache_vars()
+    westprom.update(compiled_vars_cache={'cached': True})
+    assert westprom.compiled_vars == {'cached': True}
+    # Changing the zone vars only invalidates hosts in that zone.
+    cache_vars()
+    Zone.get_by_id_or_name('west').update(vars={'datacenter': 'elsewhere'})
+    assert westprom.compiled_vars_cache is None
+    assert eastprom.compiled_vars_cache is not None
+    assert westprom.compiled_vars['datacenter'] == 'elsewhere'
+    # Changing a group's vars invalidates its hosts.
+    cache_vars()
+    west_prom_group = Group.query.filter_by(
+        name='prom_nodes', zone_id=westprom.zone_id).first()
+    west_prom_group.update(vars={'prom_region': 'nowhere'})
+    assert westprom.compiled_vars_cache is None
+    assert eastprom.compiled_vars_cache is not None
+    # So does changing the parent group's vars.
+    cache_vars()
+    Group.query.filter_by(name='prom_nodes', zone_id=None).first().update(
+        vars={'thanos': 'maybe'})
+    assert westprom.compiled_vars_cache is None
+    assert eastprom.compiled_vars_cache is None
+    # And so does changing a mapping's priority.
+    cache_vars()
+    westprom.change_group_priority(west_prom_group, 50)
+    assert westprom.compiled_vars_cache is None
+    assert eastprom.compiled_vars_cache is not None
+    # And of course the host's own vars.
+    cache_vars()
+    eastprom.update(vars={'test': True})
+    assert eastprom.compiled_vars_cache is None
+    assert eastprom.compiled_vars['test'] is True
+
+
+def test_group_closure(test_inventory_bootstrap):
+    """Make sure the closure table follows the group tree."""
+    west_zone = Zone.get_by_id_or_name('west')
+    global_prom = Group.query.filter_by(
+        name='prom_nodes', zone_id=None).first()
+    west_prom = Group.query.filter_by(
+        name='prom_nodes', zone_id=west_zone.id).first()
+    westconsul = Host.get_by_id_or_name('westconsul')
+
+    def descendant_host_names(group):
+        return {x.name for x in Host.query.filter(Host.id.in_(
+            GroupClosure.get_descendant_host_ids(group.id)))}
+
+    # Vars are inherited from every ancestor, not just the parent.
+    prom_db = Group.create(
+        'prom_db', zone=west_zone, parent=west_prom, vars={'role': 'db'})
+    assert prom_db.get_ancestor_vars() == [
+        global_prom.vars, west_prom.vars, {'role': 'db'}]
+    assert prom_db.compile_vars(include_zone=False) == {
+        'thanos': True, 'prom_region': 'west', 'shutup': 'sam',
+        'role': 'db'}
+    westconsul.add_group(prom_db)
+    assert westconsul.compiled_vars['thanos'] is True
+    assert Host.compile_vars_bulk([westconsul])[westconsul.id][
+        'prom_region'] == 'west'
+    # Hosts in any descendant are found in a single query.
+    assert descendant_host_names(global_prom) == {
+        'westprom', 'centralprom', 'eastprom', 'westconsul'}
+    assert descendant_host_names(prom_db) == {'westconsul'}
+    # Moving a group moves everything under it.
+    prom_db.update(parent_id=None)
+    assert descendant_host_names(global_prom) == {
+        'westprom', 'centralprom', 'eastprom'}
+    assert prom_db.get_ancestor_vars() == [{'role': 'db'}]
+    assert 'thanos' not in westconsul.compiled_vars
+    prom_db.update(parent_id=west_prom.id)
+    assert 'westconsul' in descendant_host_names(global_prom)
+    # A group can't end up under itself.
+    with pytest.raises(ValueError):
+        west_prom.update(parent_id=prom_db.id)
+    # Deleting a group cuts its children loose.
+    west_prom.delete()
+    assert GroupClosure.query.filter_by(
+        descendant_id=prom_db.id).count() == 1
+    assert descendant_host_names(global_prom) == {
+        'centralprom', 'eastprom'}
+
+
 def test_group_model(test_host, test_group, test_inventory_bootstrap):
     """Test Group to make sure it works correctly.
 
@@ -181,6 +300,10 @@ def test_group_model(test_host, test_group, test_inventory_bootstrap):
     assert test_group.__repr__() == (
         f'<{test_group.__class__.__name__} {test_group.zone.name}/'
         f'{test_group.name}>')
+    # Test has_host
+    assert test_group.has_host(test_host) is False
+    test_group.add_host(test_host)
+    assert test_group.has_host(test_host) is True
     # This should work
     Group.create('my_very_own_new_group')
     # This should throw a DuplicateError
@@ -189,3 +312,27 @@ def test_group_model(test_host, test_group, test_inventory_bootstrap):
     # But this should work
     zone = Zone.create('my_very_own_new_zone')
     Group.create('my_very_own_new_group', zone=zone)
+
+
+def test_create_vars_path_index(app, mocker):
+    """Test the expression indexes used to filter on vars on SQLite."""
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    mocker.patch.object(db, 'session', session)
+
+    def index_names():
+        return {x for x, in session.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND name LIKE 'hosts_vars_%'")}
+
+    assert create_vars_path_index('consul.node') is True
+    assert create_vars_path_index('consul.node') is False
+    # These all look the same once they're made safe for an index name, but
+    # they're different paths so they each get their own index.
+    assert create_vars_path_index('a.b') is True
+    assert create_vars_path_index('a_b') is True
+    assert create_vars_path_index('a-b') is True
+    assert len(index_names()) == 4
+    with pytest.raises(ValueError):
+        create_vars_path_index('a.b c')
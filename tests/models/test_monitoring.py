@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from opsy.flask_extensions import db
+from opsy.inventory.models import Host
+from opsy.monitoring.backends.sensu import SensuBackend
+from opsy.monitoring.models import (BackendRegistry, Event, EventArchive,
+                                    MonitoringService)
+from opsy.monitoring.utils import prune_events
+
+
+def test_event_archive(test_monitoring_bootstrap):
+    """Test archiving and pruning resolved events."""
+    old_event = Event.query.filter_by(
+        host_name='eastconsul', check_name='check_mem').first()
+    old_event.update(resolved_at=datetime.utcnow() - timedelta(days=30))
+    # The event is gone once it's archived, so hold on to its id.
+    old_event_id = old_event.id
+    Event.query.filter_by(
+        host_name='westconsul', check_name='check_mem').first().resolve()
+    # Only the event resolved before the retention gets archived.
+    assert prune_events(7, batch_size=1) == (1, 0)
+    assert Event.query.count() == 17
+    assert Event.query.get(old_event_id) is None
+    archived_event = EventArchive.query.get(old_event_id)
+    assert archived_event.host_name == 'eastconsul'
+    assert archived_event.status == 'critical'
+    assert archived_event.resolved is True
+    # Nothing's left to archive the second time around.
+    assert prune_events(7) == (0, 0)
+    # Archived events are kept until they're older than their own retention.
+    assert prune_events(7, archive_retention_days=60) == (0, 0)
+    assert prune_events(7, archive_retention_days=14) == (0, 1)
+    assert EventArchive.query.count() == 0
+
+
+def test_event_reconcile(test_monitoring_bootstrap):
+    """Test reconciling a poll's events against the stored ones."""
+    service = MonitoringService.get_by_id_or_name('westsensu')
+    changed_event = Event.query.filter_by(
+        host_name='westconsul', check_name='check_cpu').first()
+    changed_event_id = changed_event.id
+
+    def event(host_name, check_name, status, output=None):
+        return {'host_name': host_name, 'check_name': check_name,
+                'status': status, 'command': check_name, 'output': output,
+                'occurrences': 1, 'updated_at': None}
+
+    SensuBackend(service).reconcile([
+        # This one changed...
+        event('westconsul', 'check_cpu', 'critical', output='CPU high'),
+        # ...this one didn't...
+        event('westconsul', 'check_disk', 'warning'),
+        # ...and these are new, one for a host we don't know about.
+        event('westprom', 'check_load', 'warning'),
+        event('westunknown', 'check_cpu', 'critical')])
+    unresolved = {(x.host_name, x.check_name): x for x in Event.query.filter(
+        Event.monitoring_service_id == service.id, ~Event.resolved)}
+    assert set(unresolved) == {
+        ('westconsul', 'check_cpu'), ('westconsul', 'check_disk'),
+        ('westprom', 'check_load'), ('westunknown', 'check_cpu')}
+    # Changed events are updated in place.
+    changed_event = unresolved[('westconsul', 'check_cpu')]
+    assert changed_event.id == changed_event_id
+    assert changed_event.status == 'critical'
+    assert changed_event.output == 'CPU high'
+    # New events are tied to their hosts when we have them.
+    assert unresolved[('westprom', 'check_load')].host_id == \
+        Host.get_by_id_or_name('westprom').id
+    assert unresolved[('westunknown', 'check_cpu')].host_id is None
+    assert {x.polled_at for x in unresolved.values()} == \
+        {service.last_poll_time}
+    # Everything the poll didn't see has resolved.
+    resolved = Event.query.filter(
+        Event.monitoring_service_id == service.id, Event.resolved).all()
+    assert {(x.host_name, x.check_name) for x in resolved} == {
+        ('westconsul', 'check_mem'), ('westprom', 'check_cpu'),
+        ('westprom', 'check_disk'), ('westprom', 'check_mem')}
+    assert all(x.state == 'resolved' for x in resolved)
+    assert {x.resolved_at for x in resolved} == {service.last_poll_time}
+    # Other services' events are left alone.
+    assert Event.query.filter(
+        Event.monitoring_service_name == 'eastsensu', ~Event.resolved
+    ).count() == 5
+
+
+def test_event_upsert_sqlite(app, mocker):
+    """Test the executemany upsert used on databases other than Postgres."""
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    mocker.patch.object(db, 'session', session)
+    service = MonitoringService.create('sqlitesensu')
+    polled_at = datetime.utcnow()
+
+    def row(host_name, check_name, status, **kwargs):
+        return dict({
+            'id': f'{host_name}-{check_name}',
+            'monitoring_service_id': service.id,
+            'monitoring_service_name': service.name, 'zone_name': None,
+            'host_id': None, 'host_name': host_name, 'check_name': check_name,
+            'status': status, 'state': 'new', 'resolved': False,
+            'polled_at': polled_at}, **kwargs)
+
+    Event.upsert([row('host1', 'check_cpu', 'ok'),
+                  row('host1', 'check_mem', 'ok')])
+    session.commit()
+    session.query(Event).filter_by(check_name='check_mem').update(
+        {'state': 'acknowledged'})
+    # A resolved event for the same check doesn't conflict with a new one.
+    session.add(Event(service, host_name='host1', check_name='check_disk',
+                      status='critical', resolved=True))
+    session.commit()
+    Event.upsert([row('host1', 'check_cpu', 'critical', id='new-id'),
+                  row('host1', 'check_mem', 'warning', state='new'),
+                  row('host1', 'check_disk', 'ok')])
+    session.commit()
+    events = {(x.check_name, x.resolved): x for x in session.query(Event)}
+    assert set(events) == {('check_cpu', False), ('check_mem', False),
+                           ('check_disk', False), ('check_disk', True)}
+    # Existing events are updated, but keep their ids and states.
+    assert events[('check_cpu', False)].id == 'host1-check_cpu'
+    assert events[('check_cpu', False)].status == 'critical'
+    assert events[('check_mem', False)].status == 'warning'
+    assert events[('check_mem', False)].state == 'acknowledged'
+    assert events[('check_disk', False)].id == 'host1-check_disk'
+    session.remove()
+
+
+def test_event_resolve_unpolled(test_monitoring_bootstrap):
+    """Test resolving the events a poll didn't see."""
+    service = MonitoringService.get_by_id_or_name('westsensu')
+    last_poll = datetime.utcnow() - timedelta(minutes=1)
+    this_poll = datetime.utcnow()
+    Event.query.filter_by(
+        monitoring_service_id=service.id, check_name='check_cpu').update(
+            {'polled_at': this_poll})
+    Event.query.filter_by(
+        monitoring_service_id=service.id, check_name='check_disk').update(
+            {'polled_at': last_poll})
+    # Events seen by this poll stay unresolved, the ones only seen by the
+    # last poll or never polled at all are resolved as of this poll.
+    assert Event.resolve_unpolled(service.id, this_poll) == 4
+    db.session.commit()
+    events = Event.query.filter_by(monitoring_service_id=service.id).all()
+    assert {x.check_name for x in events if not x.resolved} == {'check_cpu'}
+    assert {x.resolved_at for x in events if x.resolved} == {this_poll}
+    assert all(x.state == 'resolved' for x in events if x.resolved)
+    # Nothing's left to resolve for this poll.
+    assert Event.resolve_unpolled(service.id, this_poll) == 0
+
+
+def test_backend_registry(test_monitoring_bootstrap, mocker):
+    """Test caching backends until their config changes."""
+    registry = BackendRegistry()
+    mocker.patch('opsy.monitoring.models.backend_registry', registry)
+    driver_manager = mocker.patch(
+        'opsy.monitoring.models.driver.DriverManager')
+    driver_manager.return_value.driver = SensuBackend
+    service = MonitoringService.create(
+        'cachedsensu', backend_name='sensu', backend_config={'host': 'sensu1'})
+    backend = service.backend
+    assert backend.host == 'sensu1'
+    assert backend.monitoring_service is service
+    # The class is only looked up once, and the same backend is returned
+    # until the config changes, however the service is loaded.
+    assert service.backend is backend
+    db.session.expire(service)
+    assert MonitoringService.query.get(service.id).backend is backend
+    driver_manager.assert_called_once_with(
+        namespace='opsy.monitoring.backend', name='sensu')
+    # Services without a backend don't get one.
+    assert MonitoringService.get_by_id_or_name('westsensu').backend is None
+    # Changing the config replaces the cached backend.
+    service.update(backend_config=dict(service.backend_config, host='sensu2'))
+    new_backend = service.backend
+    assert new_backend is not backend
+    assert new_backend.host == 'sensu2'
+    assert service.backend is new_backend
+    assert list(registry._backends) == [service.id]
+    # And deleting the service drops it.
+    service.delete()
+    assert registry._backends == {}
@@ -1,6 +1,8 @@
 import json
+from opsy.flask_extensions import db
 from opsy.auth.utils import create_token
-from opsy.inventory.models import Zone, Host, Group, HostGroupMapping
+from opsy.inventory.models import (Zone, Host, Group, GroupClosure,
+                                   HostGroupMapping)
 
 ###############################################################################
 # Zone Tests
@@ -38,6 +40,42 @@ def test_zones_list(client, admin_user, test_user, test_inventory_bootstrap):
     assert admin_response_data[0]['name'] == 'west'
 
 
+def test_zones_large_zone(client, admin_user, test_inventory_bootstrap,
+                          test_large_zone, sql_statements):
+    """A zone full of hosts should cost the same to fetch as an empty one."""
+    create_token(admin_user)
+
+    def get(url):
+        del sql_statements[:]
+        response = client.get(
+            url,
+            follow_redirects=True,
+            headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+        assert response.status_code == 200
+        # Only count reads, the test client tears the previous request down,
+        # writing any vars it compiled, at the start of the next one.
+        return [x for x in sql_statements if x.startswith('SELECT')]
+
+    # The first request also fills the token cache, so leave it out.
+    get('/api/v1/zones/west')
+    small_zone_statements = get('/api/v1/zones/west')
+    large_zone_statements = get(f'/api/v1/zones/{test_large_zone.name}')
+    assert len(large_zone_statements) == len(small_zone_statements)
+    # None of them should have touched the hosts table.
+    assert not [x for x in large_zone_statements if 'hosts' in x]
+    # Same goes for listing the zones.
+    list_statements = get('/api/v1/zones/')
+    assert not [x for x in list_statements if 'hosts' in x]
+    # A page of hosts out of the large zone should be a fixed number of
+    # queries no matter how big the page is, at least until the selectin
+    # loads have to be split into batches of 500.
+    small_page_statements = get(
+        f'/api/v1/hosts/?zone_name={test_large_zone.name}&limit=10')
+    large_page_statements = get(
+        f'/api/v1/hosts/?zone_name={test_large_zone.name}&limit=400')
+    assert len(large_page_statements) == len(small_page_statements)
+
+
 def test_zones_post(client, admin_user, test_user, test_inventory_bootstrap):
     # Zone test data
     zone_data = {
@@ -268,6 +306,92 @@ def test_hosts_list(client, admin_user, test_user, test_inventory_bootstrap):
     list_hosts_filter_out = json.loads(list_hosts_filter.data)
     assert len(list_hosts_filter_out) == 1
     assert list_hosts_filter_out[0]['name'] == 'westconsul'
+    # Test filtering by everything under a group
+    global_prom = Group.query.filter_by(
+        name='prom_nodes', zone_id=None).first()
+    list_hosts_descendant = client.get(
+        f'/api/v1/hosts/?descendant_of={global_prom.id}',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert list_hosts_descendant.status_code == 200
+    assert {x['name'] for x in json.loads(list_hosts_descendant.data)} == {
+        'westprom', 'centralprom', 'eastprom'}
+    # Test filtering by vars
+    list_hosts_vars = client.get(
+        '/api/v1/hosts/?vars.consul_node=westconsul,eastconsul',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert list_hosts_vars.status_code == 200
+    assert {x['name'] for x in json.loads(list_hosts_vars.data)} == {
+        'westprom', 'eastprom'}
+    list_hosts_vars = client.get(
+        '/api/v1/hosts/?vars.consul_node=!west*&zone_name=west,central',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert list_hosts_vars.status_code == 200
+    assert {x['name'] for x in json.loads(list_hosts_vars.data)} == {
+        'westconsul', 'centralconsul', 'centralprom'}
+    list_hosts_vars = client.get(
+        '/api/v1/hosts/?vars.consul$node=westconsul',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert list_hosts_vars.status_code == 400
+
+
+def test_hosts_list_pagination(client, admin_user, test_inventory_bootstrap):
+    create_token(admin_user)
+    # Walk the hosts two at a time following the next links.
+    url = '/api/v1/hosts/?limit=2&include_total=true'
+    host_names = []
+    while url:
+        response = client.get(
+            url,
+            follow_redirects=True,
+            headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+        assert response.status_code == 200
+        assert response.headers['X-Total-Count'] == '6'
+        page = json.loads(response.data)
+        assert len(page) <= 2
+        host_names.extend([x['name'] for x in page])
+        link = response.headers.get('Link')
+        url = link[1:link.index('>')] if link else None
+    # We should have seen every host exactly once, in name order.
+    assert host_names == sorted(x.name for x in Host.query.all())
+    # Filters should still apply when paginating.
+    response = client.get(
+        '/api/v1/hosts/?zone_name=west&limit=1',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert [x['name'] for x in json.loads(response.data)] == ['westconsul']
+    assert 'Link' in response.headers
+    # A garbage cursor should give us a 400.
+    response = client.get(
+        '/api/v1/hosts/?after=notacursor',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert response.status_code == 400
+
+
+def test_hosts_list_stream(client, admin_user, test_inventory_bootstrap):
+    create_token(admin_user)
+    # Newline delimited JSON should give us one host per line.
+    response = client.get(
+        '/api/v1/hosts/?stream=ndjson',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    hosts = [json.loads(x) for x in response.data.splitlines()]
+    assert len(hosts) == 6
+    assert all('compiled_vars' in x for x in hosts)
+    # The chunked array should parse as a normal list view would.
+    response = client.get(
+        '/api/v1/hosts/?stream=json&zone_name=west',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert response.status_code == 200
+    hosts = json.loads(response.data)
+    assert sorted(x['name'] for x in hosts) == ['westconsul', 'westprom']
 
 
 def test_hosts_post(client, admin_user, test_user, test_inventory_bootstrap):
@@ -341,6 +465,9 @@ def test_hosts_get(client, admin_user, test_user, test_inventory_bootstrap):
     assert host_admin_get_id.status_code == 200
     id_out = json.loads(host_admin_get_id.data)
     assert id_out['name'] == test_host.name
+    # The vars compiled for the response are materialized afterwards
+    db.session.expire(test_host)
+    assert test_host.compiled_vars_cache == id_out['compiled_vars']
     # Test that hosts_get by name or id fails on nonexistent host
     fail_get_id = client.get(
         '/api/v1/hosts/12345',
@@ -467,6 +594,65 @@ def test_hosts_delete(client, admin_user, test_user, test_inventory_bootstrap):
     assert verify_id.status_code == 404
 
 
+def test_hosts_bulk(client, admin_user, test_user, test_inventory_bootstrap):
+    west_zone = Zone.get_by_id_or_name('west')
+    create_token(test_user)
+    create_token(admin_user)
+    headers = [('X-AUTH-TOKEN', admin_user.session_token)]
+    # Test that nopriv user cannot bulk create hosts
+    nopriv_post = client.post(
+        '/api/v1/hosts/_bulk',
+        json={'items': [{'name': 'bulkhost', 'zone_id': west_zone.id}]},
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', test_user.session_token)])
+    assert nopriv_post.status_code == 403
+    # Test that the valid hosts get created and the rest are reported
+    admin_post = client.post(
+        '/api/v1/hosts/_bulk',
+        json={'items': [
+            {'name': 'bulkhost1', 'zone_id': west_zone.id},
+            {'name': 'bulkhost2', 'zone_id': west_zone.id,
+             'vars': {'bulk': True}},
+            {'name': 'bulkhost2', 'zone_id': west_zone.id},
+            {'name': 'westconsul', 'zone_id': west_zone.id},
+            {'name': 'bulkhost3', 'zone_id': 'notazone'},
+            {'name': 'bulkhost4'}]},
+        follow_redirects=True,
+        headers=headers)
+    assert admin_post.status_code == 200
+    results = json.loads(admin_post.data)
+    assert [x['status'] for x in results] == [
+        'created', 'created', 'invalid', 'invalid', 'invalid', 'invalid']
+    assert 'zone_id' in results[5]['error']
+    assert Host.get_by_id_or_name('bulkhost1').id == results[0]['id']
+    assert Host.get_by_id_or_name('bulkhost2').vars == {'bulk': True}
+    # Test bulk updates by id and name
+    admin_patch = client.patch(
+        '/api/v1/hosts/_bulk',
+        json={'items': [
+            {'id': results[0]['id'], 'vars': {'updated': True}},
+            {'id': 'bulkhost2', 'name': 'bulkhost5'},
+            {'id': 'bulkhost1', 'name': 'westconsul'},
+            {'id': 'notahost', 'vars': {}}]},
+        follow_redirects=True,
+        headers=headers)
+    assert admin_patch.status_code == 200
+    assert [x['status'] for x in json.loads(admin_patch.data)] == [
+        'updated', 'updated', 'invalid', 'not_found']
+    assert Host.get_by_id_or_name('bulkhost1').vars == {'updated': True}
+    assert Host.get_by_id_or_name('bulkhost5').vars == {'bulk': True}
+    # Test bulk deletes
+    admin_delete = client.delete(
+        '/api/v1/hosts/_bulk',
+        json={'items': ['bulkhost1', results[1]['id'], 'notahost']},
+        follow_redirects=True,
+        headers=headers)
+    assert admin_delete.status_code == 200
+    assert [x['status'] for x in json.loads(admin_delete.data)] == [
+        'deleted', 'deleted', 'not_found']
+    assert Host.query.filter(Host.name.like('bulkhost%')).count() == 0
+
+
 ###############################################################################
 # Host Group Mapping Tests
 ###############################################################################
@@ -969,6 +1155,15 @@ def test_groups_list(client, test_user, admin_user, test_inventory_bootstrap):
         headers=[('X-AUTH-TOKEN', admin_user.session_token)])
     assert admin_filter.status_code == 200
     assert len(json.loads(admin_filter.data)) == 1
+    # And with everything under the global prom_nodes group
+    global_prom = Group.query.filter_by(
+        name='prom_nodes', zone_id=None).first()
+    admin_descendant = client.get(
+        f'/api/v1/groups/?descendant_of={global_prom.id}',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert admin_descendant.status_code == 200
+    assert len(json.loads(admin_descendant.data)) == 4
 
 
 def test_groups_post(client, test_user, admin_user, test_inventory_bootstrap):
@@ -1091,3 +1286,166 @@ def test_groups_delete(client, test_user, admin_user, test_inventory_bootstrap):
         follow_redirects=True,
         headers=[('X-AUTH-TOKEN', admin_user.session_token)])
     assert verify.status_code == 404
+
+
+def test_groups_bulk(client, test_user, admin_user, test_inventory_bootstrap):
+    west_zone = Zone.get_by_id_or_name('west')
+    east_zone = Zone.get_by_id_or_name('east')
+    west_group = Group.query.filter_by(
+        name='prom_nodes', zone_id=west_zone.id).first()
+    create_token(admin_user)
+    headers = [('X-AUTH-TOKEN', admin_user.session_token)]
+    admin_post = client.post(
+        '/api/v1/groups/_bulk',
+        json={'items': [
+            {'name': 'bulkgroup', 'zone_id': west_zone.id,
+             'parent_id': west_group.id},
+            {'name': 'bulkgroup', 'zone_id': east_zone.id},
+            {'name': 'bulkgroup', 'zone_id': east_zone.id},
+            {'name': 'prom_nodes', 'zone_id': west_zone.id},
+            {'name': 'bulkgroup2', 'zone_id': east_zone.id,
+             'parent_id': west_group.id}]},
+        follow_redirects=True,
+        headers=headers)
+    assert admin_post.status_code == 200
+    results = json.loads(admin_post.data)
+    assert [x['status'] for x in results] == [
+        'created', 'created', 'invalid', 'invalid', 'invalid']
+    bulk_group = Group.get_by_id(results[0]['id'])
+    assert bulk_group.parent == west_group
+    # Bulk created groups get their defaults and closure rows like any other.
+    assert bulk_group.default_priority == 100
+    assert {(x.ancestor_id, x.depth) for x in GroupClosure.query.filter_by(
+        descendant_id=bulk_group.id)} == {
+            (bulk_group.id, 0), (west_group.id, 1),
+            (west_group.parent_id, 2)}
+    admin_descendant = client.get(
+        f'/api/v1/groups/?descendant_of={west_group.parent_id}',
+        follow_redirects=True,
+        headers=headers)
+    assert bulk_group.id in {
+        x['id'] for x in json.loads(admin_descendant.data)}
+    # Test bulk updates
+    admin_patch = client.patch(
+        '/api/v1/groups/_bulk',
+        json={'items': [
+            {'id': results[0]['id'], 'default_priority': 50},
+            {'id': results[1]['id'], 'zone_id': west_zone.id},
+            {'id': '12345', 'default_priority': 50}]},
+        follow_redirects=True,
+        headers=headers)
+    assert [x['status'] for x in json.loads(admin_patch.data)] == [
+        'updated', 'invalid', 'not_found']
+    assert Group.get_by_id(results[0]['id']).default_priority == 50
+    # Test bulk deletes
+    admin_delete = client.delete(
+        '/api/v1/groups/_bulk',
+        json={'items': [results[0]['id'], results[1]['id']]},
+        follow_redirects=True,
+        headers=headers)
+    assert [x['status'] for x in json.loads(admin_delete.data)] == [
+        'deleted', 'deleted']
+    assert Group.query.filter_by(name='bulkgroup').count() == 0
+
+
+def test_group_hosts_bulk(client, test_user, admin_user,
+                          test_inventory_bootstrap):
+    west_zone = Zone.get_by_id_or_name('west')
+    west_prom = Group.query.filter_by(
+        name='prom_nodes', zone_id=west_zone.id).first()
+    westconsul = Host.get_by_id_or_name('westconsul')
+    # westconsul isn't in the west prom_nodes group yet.
+    assert 'prom_region' not in westconsul.compiled_vars
+    create_token(test_user)
+    create_token(admin_user)
+    # Test that nopriv user cannot add hosts
+    nopriv_post = client.post(
+        f'/api/v1/groups/{west_prom.id}/hosts/_bulk',
+        json={'items': ['westconsul']},
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', test_user.session_token)])
+    assert nopriv_post.status_code == 403
+    # Test that a nonexistent group fails
+    invalid_post = client.post(
+        '/api/v1/groups/12345/hosts/_bulk',
+        json={'items': ['westconsul']},
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert invalid_post.status_code == 404
+    # Test that admin can add hosts, and the rest are reported
+    admin_post = client.post(
+        f'/api/v1/groups/{west_prom.id}/hosts/_bulk',
+        json={'items': ['westconsul', 'westprom', 'eastconsul', 'nothost'],
+              'priority': 50},
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert admin_post.status_code == 200
+    assert [x['status'] for x in json.loads(admin_post.data)] == [
+        'created', 'invalid', 'invalid', 'not_found']
+    assert west_prom.get_host_priority(westconsul) == 50
+    assert Host.get_by_id_or_name('westconsul').compiled_vars[
+        'prom_region'] == 'west'
+    # Test that admin can remove hosts
+    admin_delete = client.delete(
+        f'/api/v1/groups/{west_prom.id}/hosts/_bulk',
+        json={'items': [westconsul.id, 'westprom', 'eastconsul']},
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert admin_delete.status_code == 200
+    assert [x['status'] for x in json.loads(admin_delete.data)] == [
+        'deleted', 'deleted', 'invalid']
+    assert HostGroupMapping.query.filter_by(
+        group_id=west_prom.id).count() == 0
+    assert 'prom_region' not in Host.get_by_id_or_name(
+        'westconsul').compiled_vars
+
+
+###############################################################################
+# Inventory Export Tests
+###############################################################################
+
+
+def test_ansible_inventory_get(client, test_user, admin_user,
+                               test_inventory_bootstrap):
+    create_token(test_user)
+    create_token(admin_user)
+    # Test unprivileged user can't export the inventory
+    user_response = client.get(
+        '/api/v1/inventory/ansible',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', test_user.session_token)])
+    assert user_response.status_code == 403
+    # Test admin user can export the inventory
+    admin_response = client.get(
+        '/api/v1/inventory/ansible',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert admin_response.status_code == 200
+    inventory = json.loads(admin_response.data)
+    assert len(inventory['_meta']['hostvars']) == 6
+    for host in Host.query.all():
+        assert inventory['_meta']['hostvars'][host.name] == \
+            host.compile_vars()
+    assert sorted(inventory['west']['hosts']) == ['westconsul', 'westprom']
+    assert sorted(inventory['prom_nodes']['hosts']) == [
+        'centralprom', 'eastprom', 'westprom']
+    assert sorted(inventory['default']['hosts']) == [
+        'westconsul', 'westprom']
+    # Test the ETag gets us a 304 until something changes
+    etag = admin_response.headers['ETag']
+    cached_response = client.get(
+        '/api/v1/inventory/ansible',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token),
+                 ('If-None-Match', etag)])
+    assert cached_response.status_code == 304
+    Zone.get_by_id_or_name('west').update(vars={'datacenter': 'elsewhere'})
+    changed_response = client.get(
+        '/api/v1/inventory/ansible',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token),
+                 ('If-None-Match', etag)])
+    assert changed_response.status_code == 200
+    inventory = json.loads(changed_response.data)
+    assert inventory['_meta']['hostvars']['westprom']['datacenter'] == \
+        'elsewhere'
@@ -0,0 +1,107 @@
+import json
+from opsy.auth.utils import create_token
+from opsy.monitoring.models import Event
+
+###############################################################################
+# Event Tests
+###############################################################################
+
+
+def test_events_list(client, admin_user, test_user, test_monitoring_bootstrap):
+    create_token(admin_user)
+    create_token(test_user)
+
+    def get(url, user=admin_user):
+        return client.get(
+            url,
+            follow_redirects=True,
+            headers=[('X-AUTH-TOKEN', user.session_token)])
+
+    # Only the admin can see events.
+    assert get('/api/v1/monitoring/events/').status_code == 200
+    assert get('/api/v1/monitoring/events/', user=test_user).status_code == 403
+    # Every host in the test inventory has 3 events.
+    assert len(json.loads(get('/api/v1/monitoring/events/').data)) == 18
+    # These filter the same way the inventory ones do.
+    response_data = json.loads(
+        get('/api/v1/monitoring/events/?zone_name=west').data)
+    assert len(response_data) == 6
+    assert {x['zone_name'] for x in response_data} == {'west'}
+    response_data = json.loads(
+        get('/api/v1/monitoring/events/?status=critical&resolved=false').data)
+    assert len(response_data) == 5
+    response_data = json.loads(
+        get('/api/v1/monitoring/events/?host_name=*prom&check_name=!check_cpu')
+        .data)
+    assert len(response_data) == 6
+    # And they page like everything else.
+    response = get('/api/v1/monitoring/events/?limit=10&include_total=true')
+    assert len(json.loads(response.data)) == 10
+    assert response.headers['X-Total-Count'] == '18'
+    assert 'rel="next"' in response.headers['Link']
+
+
+def test_events_facets(client, admin_user, test_monitoring_bootstrap):
+    create_token(admin_user)
+    response = client.get(
+        '/api/v1/monitoring/events/facets?zone_name=east',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert response.status_code == 200
+    response_data = json.loads(response.data)
+    assert response_data['status'] == {'ok': 2, 'warning': 2, 'critical': 2}
+    assert response_data['state'] == {'new': 5, 'resolved': 1}
+    assert response_data['resolved'] == {'false': 5, 'true': 1}
+    # Facets aren't paginated, so the docs don't list those parameters.
+    spec = json.loads(client.get('/docs/swagger.json').data)
+    parameters = {x['name'] for x in spec['paths'][
+        '/api/v1/monitoring/events/facets']['get']['parameters']}
+    assert 'zone_name' in parameters
+    assert not parameters & {'limit', 'after', 'include_total'}
+
+
+def test_events_get(client, admin_user, test_monitoring_bootstrap):
+    create_token(admin_user)
+    event = Event.query.filter_by(
+        host_name='westprom', check_name='check_disk').first()
+    response = client.get(
+        f'/api/v1/monitoring/events/{event.id}',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert response.status_code == 200
+    response_data = json.loads(response.data)
+    assert response_data['id'] == event.id
+    assert response_data['status'] == 'warning'
+    response = client.get(
+        '/api/v1/monitoring/events/notarealevent',
+        follow_redirects=True,
+        headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+    assert response.status_code == 404
+
+###############################################################################
+# Dashboard Tests
+###############################################################################
+
+
+def test_dashboard_events_list(client, admin_user, test_monitoring_bootstrap):
+    create_token(admin_user)
+
+    def get(url):
+        return client.get(
+            url,
+            follow_redirects=True,
+            headers=[('X-AUTH-TOKEN', admin_user.session_token)])
+
+    # The dashboard only wants the cpu and disk checks in the west zone.
+    response = get('/api/v1/monitoring/dashboards/west_dashboard/events')
+    assert response.status_code == 200
+    response_data = json.loads(response.data)
+    assert len(response_data) == 4
+    assert {x['check_name'] for x in response_data} == {
+        'check_cpu', 'check_disk'}
+    # Query filters narrow it down further.
+    response = get(
+        '/api/v1/monitoring/dashboards/west_dashboard/events?status=warning')
+    assert len(json.loads(response.data)) == 2
+    response = get('/api/v1/monitoring/dashboards/notadashboard/events')
+    assert response.status_code == 404